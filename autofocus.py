@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Программный автофокус по контрасту для линз без AfMode.
+
+Оценка — резкость центральной области lores-кадра (imaging), положение
+линзы — из метаданных того же кадра (LensPosition). Подписчик камеры только
+забирает кадр (make_array; у Picamera2 — копия буфера) с позицией, оценивает
+поток поиска — поток кадров не ждёт imaging. Поиск от грубого к точному:
+  1) грубый проход по всему диапазону: новая позиция на каждом кадре,
+     каждый кадр оценивается с той позицией, о которой доложила линза;
+  2) точный проход с мелким шагом вокруг лучшей точки;
+  3) вершина параболы по трём лучшим соседним точкам.
+Если камера не сообщает LensPosition, используется пошаговое золотое
+сечение (на каждой точке ждём, пока линза встанет). По исчерпании бюджета
+времени линза ставится в лучшую найденную точку.
+"""
+
+import math
+import threading
+import time
+
+import imaging
+
+_INVPHI = (math.sqrt(5.0) - 1.0) / 2.0   # 0.618…
+
+
+class ContrastAF:
+    """Поиск фокуса по контрасту.
+
+    lo, hi       — диапазон LensPosition;
+    coarse_steps — точек грубого прохода, fine_steps — точного;
+    tol          — требуемая точность положения линзы;
+    budget       — бюджет времени на поиск, с;
+    settle       — кадров задержки применения управления (ждём в конце прохода
+                   и перед оценкой в пошаговом режиме).
+    """
+
+    def __init__(self, cam, stream="lores", lo=0.0, hi=10.0, coarse_steps=9, fine_steps=7,
+                 tol=0.1, budget=0.8, settle=3, roi=0.5, step=2):
+        self.cam = cam
+        self.stream = stream
+        self.lo, self.hi = float(lo), float(hi)
+        self.coarse_steps = max(3, int(coarse_steps))
+        self.fine_steps = max(3, int(fine_steps))
+        self.tol = float(tol)
+        self.budget = float(budget)
+        self.settle = int(settle)
+        self.roi = roi
+        self.step = step
+        self.last = None            # результат последнего поиска
+        self._cond = threading.Condition()
+        self._frames = 0
+        self._samples = None        # [(pos, кадр)] во время прохода; оценка — в потоке поиска
+        self._assume = None         # позиция для кадров без LensPosition (пошаговый режим)
+        self._fmt = None
+
+    def _on_frame(self, request):
+        samples = self._samples
+        if samples is not None:
+            lp = (request.get_metadata() or {}).get("LensPosition", self._assume)
+            if lp is not None:
+                samples.append((float(lp), request.make_array(self.stream)))
+        with self._cond:
+            self._frames += 1
+            self._cond.notify_all()
+
+    def _scored(self, samples):
+        """[(pos, кадр)] -> [(pos, резкость)]; в потоке поиска, не камеры."""
+        return [(p, imaging.score_frame(arr, self._fmt, frac=self.roi, step=self.step)["sharpness"])
+                for p, arr in samples]
+
+    def _wait_frames(self, n, timeout=0.5):
+        with self._cond:
+            target = self._frames + n
+            return self._cond.wait_for(lambda: self._frames >= target, timeout)
+
+    def sweep(self, positions, deadline=None):
+        """Проход: по позиции на кадр. Возвращает [(позиция линзы из метаданных, резкость)].
+        deadline (time.monotonic) — после него новые позиции не ставятся, ожидание
+        кадров не дольше оставшегося: возвращается то, что успели оценить."""
+        def left(limit):
+            return limit if deadline is None else max(0.0, min(limit, deadline - time.monotonic()))
+
+        samples = []
+        self._samples = samples
+        try:
+            for p in positions:
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                self.cam.set_controls({"LensPosition": p})
+                self._wait_frames(1, left(0.5))
+            if left(1.0) > 0:
+                self._wait_frames(self.settle, left(0.5 * self.settle))   # дождаться последних позиций
+        finally:
+            self._samples = None
+        return self._scored(samples)
+
+    def measure(self, pos):
+        """Поставить линзу в pos, дождаться settle кадров и оценить кадр."""
+        self.cam.set_controls({"LensPosition": pos})
+        self._wait_frames(self.settle)
+        samples = []
+        self._samples, self._assume = samples, pos
+        try:
+            self._wait_frames(1)
+        finally:
+            self._samples, self._assume = None, None
+        return self._scored(samples[-1:])[0][1] if samples else -1.0
+
+    # --- поиск ---
+    def run(self):
+        """Найти фокус. Возвращает dict: position, score, steps (оценённых
+        кадров), seconds, converged (нашли вершину или точность tol в бюджете),
+        mode ("sweep"/"golden"), trace [(pos, score)]."""
+        cfg = (self.cam.camera_configuration() or {})
+        if not cfg.get(self.stream):
+            self.stream = "main"
+        self._fmt = (cfg.get(self.stream) or {}).get("format")
+        t0 = time.monotonic()
+        deadline = t0 + self.budget
+        trace = []
+
+        self.cam.add_listener(self._on_frame)
+        try:
+            n = self.coarse_steps
+            span = self.hi - self.lo
+            coarse = self.sweep([self.lo + span * i / (n - 1) for i in range(n)], deadline)
+            trace += coarse
+            vertex = None
+            if coarse:
+                mode = "sweep"
+                converged, vertex = self._fine_sweep(trace, span / (n - 1), deadline)
+            else:
+                mode = "golden"
+                converged = self._golden(trace, deadline)
+        finally:
+            self.cam.remove_listener(self._on_frame)
+
+        best_p, best_s = max(trace, key=lambda t: t[1]) if trace else (self.lo, -1.0)
+        pos = best_p if vertex is None else vertex
+        self.cam.set_controls({"LensPosition": pos})
+        self.last = {"position": round(pos, 3), "score": best_s, "steps": len(trace),
+                     "seconds": time.monotonic() - t0, "converged": converged,
+                     "mode": mode, "trace": trace}
+        return self.last
+
+    def _fine_sweep(self, trace, spacing, deadline):
+        """Точный проход вокруг лучшей точки. (converged, вершина параболы или None)."""
+        best_p = max(trace, key=lambda t: t[1])[0]
+        a, b = max(self.lo, best_p - spacing), min(self.hi, best_p + spacing)
+        m = self.fine_steps
+        if time.monotonic() < deadline:
+            trace += self.sweep([a + (b - a) * i / (m - 1) for i in range(m)], deadline)
+        pts = sorted({round(p, 3): s for p, s in trace if a <= p <= b}.items())
+        if len(pts) < 3:
+            return False, None
+        k = max(range(len(pts)), key=lambda i: pts[i][1])
+        k = min(max(k, 1), len(pts) - 2)
+        (x0, y0), (x1, y1), (x2, y2) = pts[k - 1], pts[k], pts[k + 1]
+        vertex = None
+        den = (x0 - x1) * (x0 - x2) * (x1 - x2)
+        if den:
+            ca = (x2 * (y1 - y0) + x1 * (y0 - y2) + x0 * (y2 - y1)) / den
+            cb = (x2 * x2 * (y0 - y1) + x1 * x1 * (y2 - y0) + x0 * x0 * (y1 - y2)) / den
+            if ca < 0 and x0 <= -cb / (2 * ca) <= x2:
+                vertex = -cb / (2 * ca)
+        return vertex is not None or (b - a) / (m - 1) <= self.tol, vertex
+
+    def _golden(self, trace, deadline):
+        """Пошаговое золотое сечение (линза не сообщает позицию)."""
+        cache = {}
+
+        def f(p):
+            p = round(min(self.hi, max(self.lo, p)), 3)
+            if p not in cache:
+                cache[p] = self.measure(p)
+                trace.append((p, cache[p]))
+            return cache[p]
+
+        n = max(3, self.coarse_steps // 2)
+        grid = [self.lo + (self.hi - self.lo) * i / (n - 1) for i in range(n)]
+        scores = []
+        for p in grid:
+            scores.append(f(p))
+            if time.monotonic() > deadline: break
+        i = max(range(len(scores)), key=lambda k: scores[k])
+        a, b = grid[max(0, i - 1)], grid[min(len(grid) - 1, i + 1)]
+        c, d = b - _INVPHI * (b - a), a + _INVPHI * (b - a)
+        while b - a > self.tol and time.monotonic() < deadline:
+            if f(c) >= f(d):
+                b, d = d, c
+                c = b - _INVPHI * (b - a)
+            else:
+                a, c = c, d
+                d = a + _INVPHI * (b - a)
+        return b - a <= self.tol
@@ -0,0 +1,792 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Бенчмарк предпросмотра и съёмки.
+
+Меряет тем же кодом, что и fundus.py:
+  - FPS предпросмотра (PreviewPipeline: lores -> RGB -> масштаб) и сброшенные кадры;
+  - задержку кадр->экран (от SensorTimestamp до готовой картинки);
+  - чтение метаданных: блокирующий capture_metadata() против MetadataPump;
+  - программный AF по контрасту (время, кадры, ошибка на симуляторе);
+  - зажатую клавишу зума/фокуса через CameraScheduler (записи на кадр,
+    слияние, задержка команда->кадр);
+  - задержку кнопка->файл для take_photo;
+  - точность окна вспышки (длительность VIS и попадание экспозиции кадра в окно);
+  - то же для ZSL-съёмки из FrameRing и выигрыш по задержке затвора,
+    в том числе для серии с выбором самого резкого кадра;
+  - зажатую клавишу зума 1×->8× с ускорением автоповтора: программный зум
+    предпросмотра против задержки ScalerCrop;
+  - фиксацию 3A транзакцией и вспышку по границам кадров (sync_);
+  - серию быстрых снимков через EncodeQueue (очередь, отказы, время кодирования);
+  - индекс снимков и галерею: миниатюры в фоне, выборка страницы, LRU;
+  - MJPEG-вещание headless: одно кодирование на кадр, пропуски у медленного зрителя;
+  - цену засечки трассировки стадий (tracing) выключенной и включённой;
+  - сырой снимок (.npy, memmap) против передачи в пул JPEG и проявку;
+  - пару ИК + VIS одной фиксацией 3A против двух отдельных снимков;
+  - ИК-стек (stacking): время стека в пуле записи, кадры в стеке, выигрыш SNR
+    (с --drift симулятор сдвигает кадр — проверка совмещения);
+  - видео с предзаписью (recorder): FPS предпросмотра во время записи,
+    пропуски кадров, время JPEG на кадр, скорость записи, длина предзаписи;
+  - шину ввода (inputbus): задержку нажатие->действие затвора среди
+    автоповтора зума — простая очередь против приоритетов и слияния повторов
+    (запись событий воспроизводится replay);
+  - калибровку экспозиции вспышки (flashcal): p99 и пересвет кадра VIS с
+    экспозицией AE под ИК против значений из таблицы, вспышки и время
+    калибровки, цену гистограммной проверки кадра (imaging.exposure_check);
+  - процесс захвата с общей памятью (shmcam, --shm) против камеры в процессе
+    UI под нагрузкой на GIL: кадры, пропуски, задержка кадр->подписчик,
+    задержка между процессами и перезаписи кольца.
+
+Примеры:
+  python bench.py                          # симулятор
+  python bench.py --backend picamera2      # на устройстве
+  python bench.py --json new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import camera_backend
+import capture
+import flashcal
+import imaging
+import tracing
+from autofocus import ContrastAF
+from controller import KeyRepeat, STEP, ZOOM_STEP_MAX
+from frame_ring import FrameRing
+from headless import MjpegBroadcaster
+from camera_backend import sensor_time
+from metadata import MetadataPump, exposure_window
+from scheduler import CameraScheduler
+from sessions import SessionStore, ThumbCache
+from storage import EncodeQueue
+from preview import PreviewPipeline, lores_size
+
+
+class RecordingLED:
+    """Обёртка над светодиодом: запоминает моменты on/off."""
+
+    def __init__(self, led):
+        self.led = led
+        self.events = []
+
+    def on(self):
+        self.led.on(); self.events.append((time.monotonic(), True))
+
+    def off(self):
+        self.led.off(); self.events.append((time.monotonic(), False))
+
+    @property
+    def is_lit(self):
+        return getattr(self.led, "is_lit", False)
+
+    def last_pulse(self):
+        """(t_on, t_off) последнего включения или None."""
+        t_on, last = None, None
+        for t, lit in self.events:
+            if lit:
+                t_on = t
+            elif t_on is not None:
+                last, t_on = (t_on, t), None
+        return last
+
+
+def percentile(values, p):
+    if not values: return float("nan")
+    v = sorted(values)
+    k = min(len(v) - 1, max(0, int(round(p / 100.0 * (len(v) - 1)))))
+    return v[k]
+
+
+def bench_preview(cam, seconds=5.0, box=(800, 440), poll=0.015, peaking=False):
+    """PreviewPipeline + опрос как в update_frame (без Tk): FPS показа,
+    отброшенные кадры, задержка кадр->экран (мс) и цена HUD/peaking.
+    С peaking=True ключи с префиксом peaking_."""
+    pipe = PreviewPipeline(cam, "lores")
+    pipe.set_box(*box)
+    pipe.peaking = peaking
+    pipe.start()
+    lat, n = [], 0
+    t0 = time.monotonic()
+    try:
+        while time.monotonic() - t0 < seconds:
+            img = pipe.take()
+            if img is not None:
+                ts = pipe.shown_metadata.get("SensorTimestamp")
+                if ts: lat.append((time.monotonic() - sensor_time(ts)) * 1000.0)
+                n += 1
+            time.sleep(poll)
+    finally:
+        pipe.stop()
+    dt = time.monotonic() - t0
+    st = pipe.stats()
+    res = {
+        "preview_fps": n / dt if dt > 0 else 0.0,
+        "preview_dropped": pipe.dropped,
+        "frame_to_screen_ms_p50": percentile(lat, 50),
+        "frame_to_screen_ms_p95": percentile(lat, 95),
+        "hud_ms": st["hud_ms"],
+        "hud_every": st["hud_every"],
+    }
+    return {("peaking_" + k if peaking else k): v for k, v in res.items()}
+
+
+def bench_metadata(cam, pump, n=20):
+    """Среднее время чтения метаданных (мс): capture_metadata() и pump.latest()."""
+    t0 = time.monotonic()
+    for _ in range(n):
+        cam.capture_metadata()
+    blocking = (time.monotonic() - t0) / n * 1000.0
+    t0 = time.monotonic()
+    for _ in range(n):
+        pump.latest()
+    return {"metadata_blocking_ms": blocking,
+            "metadata_pump_ms": (time.monotonic() - t0) / n * 1000.0}
+
+
+def bench_af(cam, runs=3, budget=0.8):
+    """Программный AF по контрасту: время, число оценённых кадров и (на
+    симуляторе) ошибка положения линзы."""
+    if "AfMode" in getattr(cam, "camera_controls", {}):
+        cam.set_controls({"AfMode": 0})
+    ms, steps, err = [], [], []
+    for i in range(runs):
+        cam.set_controls({"LensPosition": 10.0 * i / max(1, runs - 1)})
+        time.sleep(0.2)
+        res = ContrastAF(cam, budget=budget).run()
+        ms.append(res["seconds"] * 1000.0)
+        steps.append(res["steps"])
+        if hasattr(cam, "best_focus"):
+            err.append(abs(res["position"] - cam.best_focus))
+    return {"af_ms_p50": percentile(ms, 50), "af_ms_max": max(ms),
+            "af_steps_p50": percentile(steps, 50),
+            "af_error_max": max(err) if err else float("nan")}
+
+
+def bench_controls(cam, pump, seconds=1.5, rate=30.0):
+    """Автоповтор клавиши фокуса (rate Гц) через CameraScheduler, посередине —
+    «съёмка» с монопольным доступом 0.3 с. Записи управления на кадр,
+    слитые команды, задержка команда->кадр с результатом."""
+    sched = CameraScheduler(cam)
+    sched.start()
+    seq0 = pump.latest()[0]
+    stop = time.monotonic() + seconds
+
+    def hold():
+        time.sleep(seconds / 3)
+        with sched.exclusive():
+            time.sleep(0.3)
+
+    t = threading.Thread(target=hold, daemon=True)
+    t.start()
+    i = 0
+    try:
+        while time.monotonic() < stop:
+            sched.set({"LensPosition": 3.0 + 0.1 * (i % 40)})
+            i += 1
+            time.sleep(1.0 / rate)
+        sched.set({"LensPosition": 5.0})   # отпустили клавишу
+        time.sleep(0.3)
+        t.join()
+    finally:
+        sched.stop()
+    frames = max(1, pump.latest()[0] - seq0)
+    st = sched.stats()
+    return {"control_requests": st["requests"], "control_writes": st["writes"],
+            "control_writes_per_frame": st["writes"] / frames,
+            "control_queue_depth_max": st["queue_depth_max"],
+            "control_latency_ms_p50": st["control_latency_ms_p50"],
+            "control_latency_ms_p95": st["control_latency_ms_p95"]}
+
+
+def bench_zoom(cam, rate=30.0, box=(800, 440), zoom_max=8.0):
+    """Зажатая клавиша зума 1×->zoom_max с ускорением автоповтора (KeyRepeat):
+    нажатий и времени до предела, записей ScalerCrop на кадр, сколько ждать
+    картинку с новым полем — программный зум (set_crop) против задержки
+    самого ScalerCrop."""
+    sensor = cam.camera_controls["ScalerCrop"][1]
+    bx, by, bw, bh = sensor
+    sched = CameraScheduler(cam)
+    sched.start()
+    pipe = PreviewPipeline(cam, "lores")
+    pipe.set_box(*box)
+    pipe.set_crop(sensor)
+    pipe.start()
+    repeat = KeyRepeat()
+    frames0, view_ms, zoom, presses = sched._frames, [], 1.0, 0
+    time.sleep(0.3)
+    t0 = time.monotonic()
+    try:
+        while zoom < zoom_max:
+            zoom = min(zoom_max, zoom + repeat.step("zoom+", STEP, ZOOM_STEP_MAX))
+            presses += 1
+            cw, ch = int(bw / zoom) & ~1, int(bh / zoom) & ~1
+            crop = (int(bx + (bw - cw) / 2) & ~1, int(by + (bh - ch) / 2) & ~1, cw, ch)
+            sched.set({"ScalerCrop": crop})
+            t = time.perf_counter()
+            pipe.set_crop(crop)
+            view_ms.append((time.perf_counter() - t) * 1000.0)
+            time.sleep(1.0 / rate)
+        t_full = time.monotonic() - t0
+        time.sleep(0.3)
+    finally:
+        pipe.stop()
+        sched.stop()
+    st = sched.stats()
+    return {"zoom_presses_to_max": presses, "zoom_time_to_max_ms": t_full * 1000.0,
+            "zoom_writes_per_frame": st["writes"] / float(max(1, sched._frames - frames0)),
+            "zoom_soft_view_ms_p50": percentile(view_ms, 50),
+            "zoom_crop_latency_ms_p50": st["control_latency_ms_p50"],
+            "zoom_soft_frames": pipe.soft_zoomed}
+
+
+def bench_capture(cam, ir_led, vis_led, shots=3, window=1.0, out_dir=None, pump=None, ring=None,
+                  burst=1, sched=None):
+    """Съёмка как в take_photo: кнопка->файл и точность окна вспышки.
+    ring — FrameRing: режим ZSL (вспышка гаснет сразу после кадра);
+    burst — серия кадров с выбором самого резкого;
+    sched — CameraScheduler: фиксация 3A транзакцией и вспышка по границам
+    кадров (settle_ms — сколько ждали кадр с применённым управлением)."""
+    controls = getattr(cam, "camera_controls", {})
+    af_available = any(k in controls for k in ("AfMode", "AfTrigger"))
+    has_lenspos = "LensPosition" in controls
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    press_to_file, window_err, in_window, margins, flash, saved, score_ms = [], [], 0, [], [], [], []
+    settle = []
+    flash_pump = pump if sched is not None else None
+    for _ in range(shots):
+        t_press = time.monotonic()
+        lock = capture.lock_3a(cam, af_available, has_lenspos, pump, sched)
+        if lock["settle_ms"] is not None:
+            settle.append(lock["settle_ms"])
+        try:
+            path = capture.photo_path(out_dir, "Видимый", f"bench_{len(press_to_file)}")
+            if ring is not None:
+                res = capture.flash_and_capture_zsl(cam, ring, ir_led, vis_led, path,
+                                                    visible=True, window=window, burst=burst,
+                                                    pump=flash_pump)
+                saved.append(res["lag_saved_ms"])
+            else:
+                res = capture.flash_and_capture(cam, ir_led, vis_led, path, visible=True,
+                                                window=window, burst=burst, pump=flash_pump)
+            if "score_ms" in res:
+                score_ms.append(res["score_ms"])
+        finally:
+            vis_led.off(); ir_led.on()
+            capture.restore_3a(cam, lock, af_available, sched)
+        if not os.path.exists(res["path"]):
+            raise RuntimeError(f"Файл не записан: {res['path']}")
+        press_to_file.append((res["t_saved"] - t_press) * 1000.0)
+
+        pulse = vis_led.last_pulse()
+        if pulse:
+            flash.append((pulse[1] - pulse[0]) * 1000.0)
+            if not res.get("synced"):
+                window_err.append(abs((pulse[1] - pulse[0]) - window) * 1000.0)
+            win = exposure_window(res["metadata"])
+            if win:
+                f_start, f_end = win
+                f_end += getattr(cam, "readout", 0.0)   # последняя строка (rolling shutter)
+                margin = min(f_start - pulse[0], pulse[1] - f_end) * 1000.0
+                margins.append(margin)
+                if margin >= 0: in_window += 1
+        time.sleep(0.2)
+    out = {
+        "flash_ms_max": max(flash) if flash else float("nan"),
+        "press_to_file_ms_p50": percentile(press_to_file, 50),
+        "press_to_file_ms_max": max(press_to_file) if press_to_file else float("nan"),
+        "flash_window_error_ms_max": max(window_err) if window_err else float("nan"),
+        "flash_frame_in_window": in_window / float(shots) if shots else float("nan"),
+        "flash_frame_margin_ms_min": min(margins) if margins else float("nan"),
+    }
+    if ring is not None or sched is not None:
+        # для ZSL и вспышки по кадрам окно короче намеренно; точность окна не имеет смысла
+        out.pop("flash_window_error_ms_max")
+    if sched is not None:
+        out["settle_ms_p50"] = percentile(settle, 50)
+        out = {"sync_" + k: v for k, v in out.items()}
+    if ring is not None:
+        out["lag_saved_ms_p50"] = percentile(saved, 50)
+        out = {"zsl_" + k: v for k, v in out.items()}
+    if burst > 1:
+        out["burst_score_ms_max"] = max(score_ms) if score_ms else float("nan")
+        out = {f"burst{burst}_" + k: v for k, v in out.items()}
+    return out
+
+
+def bench_gallery(cam, photos=12, rows=3000, per_page=12, out_dir=None):
+    """Индекс на rows снимков (файлов photos, остальные строки ссылаются на
+    них): время миниатюры в фоне, выборка страницы из SQLite и показ
+    страницы из LRU — холодный и повторный (мс)."""
+    from PIL import Image
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    store = SessionStore(out_dir)
+    store.start()
+    store.new_session()
+    paths = []
+    for i in range(photos):
+        path = capture.photo_path(out_dir, "Видимый", f"gallery_{i}")
+        capture.save_array(cam, cam.capture_array("main"), path)
+        paths.append(path)
+    for i in range(rows):
+        store.add(paths[i % photos], "VIS", {"LensPosition": 5.0, "ExposureTime": 20000}, 4.0, 100.0)
+    for p in paths:
+        store.saved(p)
+    deadline = time.monotonic() + 10.0
+    while store.stats()["thumbs_pending"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.1)
+    cache = ThumbCache(lambda p: Image.open(p).convert("RGB"), maxsize=256)
+    query, cold, warm = [], [], []
+    for page in range(0, 20):
+        t0 = time.perf_counter()
+        items = store.page(page * 97 % max(1, rows // per_page) * per_page, per_page)
+        t1 = time.perf_counter()
+        for r in items:
+            if r["thumb"]: cache.get(r["thumb"])
+        t2 = time.perf_counter()
+        for r in items:
+            if r["thumb"]: cache.get(r["thumb"])
+        t3 = time.perf_counter()
+        query.append((t1 - t0) * 1000.0); cold.append((t2 - t1) * 1000.0); warm.append((t3 - t2) * 1000.0)
+    st = store.stats()
+    store.close()
+    return {"thumb_ms_p50": st["thumb_ms_p50"],
+            "gallery_query_ms_p50": percentile(query, 50),
+            "gallery_page_ms_max": max(cold), "gallery_page_cached_ms_max": max(warm)}
+
+
+def bench_mjpeg(cam, seconds=2.0, box=(800, 440), slow=0.2):
+    """MJPEG-вещание headless: один быстрый и один медленный (slow с на
+    кадр) зритель. Кодирований JPEG на кадр (должно быть 1, а не по
+    зрителю), кадры и пропуски у каждого, время кодирования."""
+    pipe = PreviewPipeline(cam, "lores")
+    pipe.set_box(*box)
+    pipe.start()
+    stream = MjpegBroadcaster(pipe.take)
+    stream.start()
+    got = {"fast": 0, "slow": 0}
+
+    def viewer(name, delay):
+        t0 = time.monotonic()
+        for _ in stream.frames():
+            got[name] += 1
+            if time.monotonic() - t0 >= seconds: break
+            if delay: time.sleep(delay)
+
+    threads = [threading.Thread(target=viewer, args=("fast", 0.0)),
+               threading.Thread(target=viewer, args=("slow", slow))]
+    try:
+        for t in threads: t.start()
+        time.sleep(0.5)
+        st = stream.stats()   # пока оба смотрят
+        for t in threads: t.join(seconds + 2.0)
+    finally:
+        stream.stop()
+        pipe.stop()
+    fast_drops, slow_drops = sorted(st["drops"]) if len(st["drops"]) == 2 else (0, 0)
+    return {"mjpeg_encodes_per_frame": stream.encoded / max(1, got["fast"]),
+            "mjpeg_fast_fps": got["fast"] / seconds, "mjpeg_slow_fps": got["slow"] / seconds,
+            "mjpeg_slow_drops": slow_drops, "mjpeg_fast_drops": fast_drops,
+            "mjpeg_encode_ms_p50": st["encode_ms_p50"]}
+
+
+def bench_encode(cam, encoder, presses=8, out_dir=None):
+    """Серия быстрых нажатий: кадр -> EncodeQueue. Время до освобождения
+    съёмки, отказы по backpressure, глубина очереди и время кодирования."""
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    release = []
+    t0 = time.monotonic()
+    for i in range(presses):
+        t_press = time.monotonic()
+        if not encoder.reserve():
+            continue
+        req = cam.capture_request()
+        try:
+            arr = req.make_array("main")
+        finally:
+            req.release()
+        capture.submit_array(cam, encoder, arr, os.path.join(out_dir, f"enc_{i}.jpg"))
+        release.append((time.monotonic() - t_press) * 1000.0)
+    encoder.flush()
+    st = encoder.stats()
+    return {
+        "encode_press_release_ms_p50": percentile(release, 50),
+        "encode_all_written_ms": (time.monotonic() - t0) * 1000.0,
+        "encode_rejected": st["rejected"],
+        "encode_queue_depth_max": st["queue_depth_max"],
+        "encode_ms_p50": st["encode_ms_p50"],
+    }
+
+
+def bench_pair(cam, ring, ir_led, vis_led, pump, sched, shots=3, window=1.0, out_dir=None):
+    """Пара ИК + VIS одной последовательностью (capture_pair) против двух
+    отдельных снимков (ИК и VIS, каждый со своей фиксацией и возвратом 3A):
+    время от фиксации до возврата, зазор между кадрами пары, освещённость
+    ИК-кадра (доля экспозиции при ИК, только симулятор) и пары без кадра со
+    вспышкой (pair_lost: вторую вспышку capture_pair не делает)."""
+    controls = getattr(cam, "camera_controls", {})
+    af_available = any(k in controls for k in ("AfMode", "AfTrigger"))
+    has_lenspos = "LensPosition" in controls
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    pair_ms, apart_ms, gaps, ir_lit = [], [], [], []
+    lost = 0
+
+    def locked(fn):
+        """fn() между lock_3a и restore_3a: (результат, мс от фиксации до возврата)."""
+        t0 = time.monotonic()
+        lock = capture.lock_3a(cam, af_available, has_lenspos, pump, sched)
+        try:
+            res = fn()
+        finally:
+            vis_led.off(); ir_led.on()
+            capture.restore_3a(cam, lock, af_available, sched)
+        return res, (time.monotonic() - t0) * 1000.0
+
+    for i in range(shots):
+        try:
+            res, ms = locked(lambda: capture.capture_pair(cam, ring, ir_led, vis_led,
+                                                          os.path.join(out_dir, f"pair_{i}.jpg"), pump, window))
+        except RuntimeError:
+            lost += 1   # кадр со вспышкой потерян — пара не снята
+        else:
+            pair_ms.append(ms)
+            gaps.append(res["gap_ms"])
+            win = exposure_window(res["metadata_ir"])
+            if win and hasattr(ir_led.led, "lit_fraction"):
+                ir_lit.append(ir_led.led.lit_fraction(*win))
+        time.sleep(0.2)
+        total = 0.0
+        for visible in (False, True):
+            total += locked(lambda: capture.flash_and_capture_zsl(
+                cam, ring, ir_led, vis_led, os.path.join(out_dir, f"apart_{i}_{int(visible)}.jpg"),
+                visible=visible, window=window, pump=pump))[1]
+        apart_ms.append(total)
+        time.sleep(0.2)
+    return {
+        "pair_ms_p50": percentile(pair_ms, 50),
+        "pair_apart_ms_p50": percentile(apart_ms, 50),
+        "pair_gap_ms_max": max(gaps) if gaps else float("nan"),
+        "pair_ir_lit_min": min(ir_lit) if ir_lit else float("nan"),
+        "pair_lost": lost,
+    }
+
+
+def bench_flash(cam, ring, ir_led, vis_led, pump, sched, shots=3, window=1.0, zooms=(1.0, 4.0),
+                out_dir=None):
+    """Экспозиция вспышки VIS: снимки с фиксацией AE (меряет ИК) против
+    экспозиции из таблицы калибровки (flashcal, таблица — во временной
+    папке). p99 и доля пересвета кадра (imaging.exposure_check), вспышки и
+    время калибровки, время самой проверки на кадре main."""
+    controls = getattr(cam, "camera_controls", {})
+    af_available = any(k in controls for k in ("AfMode", "AfTrigger"))
+    has_lenspos = "LensPosition" in controls
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    table = flashcal.FlashTable(os.path.join(out_dir, "flash_exposure.json"))
+    mode = "bench"
+
+    def shots_with(flash, tag):
+        checks = []
+        for i in range(shots):
+            lock = capture.lock_3a(cam, af_available, has_lenspos, pump, sched, flash)
+            try:
+                res = capture.flash_and_capture_zsl(cam, ring, ir_led, vis_led,
+                                                    os.path.join(out_dir, f"flash_{tag}_{i}.jpg"),
+                                                    window=window, pump=pump)
+                checks.append(res["exposure"])
+            finally:
+                vis_led.off(); ir_led.on()
+                capture.restore_3a(cam, lock, af_available, sched)
+            time.sleep(0.3)   # AE снова сходится под ИК
+        return checks
+
+    before = shots_with(None, "ae")
+    t0 = time.monotonic()
+    with sched.exclusive():
+        meta = pump.latest()[1] or {}
+        try:
+            cal = flashcal.calibrate(cam, sched, pump, ring, ir_led, vis_led, table, mode, zooms,
+                                     lambda z: {}, (meta.get("ExposureTime") or 10000,
+                                                    meta.get("AnalogueGain") or 1.0), window=window)
+        finally:
+            vis_led.off(); ir_led.on()
+            capture.restore_3a(cam, {"ae": True, "awb": True}, False, sched)
+    cal_s = time.monotonic() - t0
+    time.sleep(0.3)
+    after = shots_with(table.get(mode, zooms[0]), "cal")
+
+    req = cam.capture_request()
+    try:
+        arr = req.make_array("main")
+    finally:
+        req.release()
+    fmt, _ = capture._stream_format(cam, "main")
+    check_ms = []
+    for _ in range(20):
+        t = time.perf_counter()
+        imaging.exposure_check(arr, fmt)
+        check_ms.append((time.perf_counter() - t) * 1000.0)
+    return {
+        "flash_ae_p99": percentile([c["p99"] for c in before], 50),
+        "flash_ae_clipped": percentile([c["clipped"] for c in before], 50),
+        "flash_cal_p99": percentile([c["p99"] for c in after], 50),
+        "flash_cal_clipped": percentile([c["clipped"] for c in after], 50),
+        "flash_cal_ok": sum(c["verdict"] == "ok" for c in after),
+        "flash_cal_flashes": sum(r["flashes"] for r in cal),
+        "flash_cal_s": cal_s,
+        "exposure_check_ms_p50": percentile(check_ms, 50),
+    }
+
+
+def bench_stacking(cam, ir_led, vis_led, encoder, ring, shots=2, frames=8, out_dir=None):
+    """ИК-стек: кадры из FrameRing -> stacking.stack_and_save в пуле записи.
+    Время стека, всей обработки (с записью), кадры в стеке, выигрыш SNR."""
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    infos = []
+    for i in range(shots):
+        if not encoder.reserve():
+            continue
+        res = capture.capture_ir_stack(cam, ir_led, vis_led, os.path.join(out_dir, f"stack_{i}.jpg"),
+                                       frames, ring=ring, encoder=encoder)
+        infos.append(res["stack"].result())
+    return {
+        "stack_ms_p50": percentile([x["stack_seconds"] * 1000.0 for x in infos], 50),
+        "stack_total_ms_p50": percentile([x["seconds"] * 1000.0 for x in infos], 50),
+        "stack_frames_used": min((x["used"] for x in infos), default=0),
+        "stack_snr_gain": percentile([x["snr_gain"] for x in infos], 50),
+    }
+
+
+def bench_raw(cam, encoder, shots=5, out_dir=None):
+    """Сырой снимок (.npy через memmap, в потоке съёмки) против передачи
+    массива в пул JPEG: сколько занят поток съёмки; и время проявки в JPEG."""
+    import rawfile
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    raw_ms, submit_ms, develop_ms = [], [], []
+    for i in range(shots):
+        req = cam.capture_request()
+        try:
+            arr, meta = req.make_array("main"), req.get_metadata() or {}
+        finally:
+            req.release()
+        for raw in (True, False):
+            if not encoder.reserve():
+                encoder.flush(); encoder.reserve()
+            t0 = time.perf_counter()
+            if raw:
+                capture.store_raw(cam, arr, os.path.join(out_dir, f"raw_{i}.npy"), "main", meta, encoder)
+                raw_ms.append((time.perf_counter() - t0) * 1000.0)
+            else:
+                capture.submit_array(cam, encoder, arr, os.path.join(out_dir, f"raw_{i}.jpg"))
+                submit_ms.append((time.perf_counter() - t0) * 1000.0)
+        develop_ms.append(rawfile.develop(os.path.join(out_dir, f"raw_{i}.npy"), "png")[1] * 1000.0)
+    encoder.flush()
+    return {"raw_write_ms_p50": percentile(raw_ms, 50), "raw_jpeg_submit_ms_p50": percentile(submit_ms, 50),
+            "raw_develop_png_ms_p50": percentile(develop_ms, 50)}
+
+
+def bench_video(cam, seconds=2.0, preroll=1.0, fps=15.0, out_dir=None):
+    """Видео обследования: предзапись preroll, затем запись seconds, а рядом
+    предпросмотр (как bench_preview) — не должен проседать."""
+    from recorder import VideoRecorder
+    out_dir = out_dir or tempfile.mkdtemp(prefix="fundus_bench_")
+    rec = VideoRecorder(cam, "lores", fps=fps, preroll=preroll)
+    rec.start()
+    try:
+        time.sleep(preroll + 0.3)
+        rec.record(os.path.join(out_dir, "video.avi"))
+        prev = bench_preview(cam, seconds)
+        info = rec.finish()
+        st = rec.stats()
+    finally:
+        rec.stop()
+    return {"video_preview_fps": prev["preview_fps"], "video_frames": info["frames"],
+            "video_fps": (info["frames"] - 1) / info["seconds"] if info["seconds"] else 0.0,
+            "video_preroll_s": info["preroll_seconds"],
+            "video_dropped": info["dropped_encode"] + info["dropped_write"],
+            "video_encode_ms_p50": st["encode_ms_p50"], "video_write_mb_s": info["write_mb_s"]}
+
+
+def bench_input(presses=90, rate=60.0, zoom_ms=25.0, every=15):
+    """Шина ввода на записи событий: автоповтор зума rate Гц (действие
+    zoom_ms — перерисовка кадра программного зума) и затвор каждые every
+    повторов. fifo_ — та же шина как простая очередь (один приоритет, без
+    слияния и дедупликации): затвор ждёт весь накопленный хвост зума."""
+    from inputbus import InputBus, SHUTTER, REPEAT
+    trace = [{"dt": i / rate, "source": "key", "name": "photo" if i % every == every - 1 else "zoom_in"}
+             for i in range(presses)]
+    res = {}
+    for fifo in (True, False):
+        bus = InputBus(dedupe=0.0 if fifo else 0.15)
+        bus.bind("zoom_in", lambda: time.sleep(zoom_ms / 1000.0), REPEAT, repeat=not fifo)
+        bus.bind("photo", lambda: None, REPEAT if fifo else SHUTTER)
+        bus.start()
+        bus.replay(trace)
+        bus.drain()
+        bus.stop()
+        st = bus.stats()
+        pre = "input_fifo_" if fifo else "input_"
+        res.update({pre + "shutter_ms_p95": percentile([w * 1000.0 for n, _, w in bus.latency if n == "photo"], 95),
+                    pre + "press_to_action_ms_p95": st["press_to_action_ms_p95"],
+                    pre + "coalesced": st["input_coalesced"]})
+    return res
+
+
+def bench_shm(sim, shared, seconds=3.0, box=(800, 440)):
+    """Подписчик берёт lores и main каждого кадра, пока поток «UI» держит GIL
+    чистым Python (как перерисовка Tk и PIL). sim — камера в этом процессе,
+    shared — shmcam.SharedCamera (тот же симулятор в процессе захвата)."""
+    res = {}
+    for prefix, cam in (("inproc_", sim), ("shm_", shared)):
+        lat, seqs, stop = [], [], []
+        def on_frame(req, lat=lat, seqs=seqs):
+            req.make_array("lores"); req.make_array("main")
+            meta = req.get_metadata()
+            lat.append((time.monotonic() - sensor_time(meta["SensorTimestamp"])) * 1000.0)
+            seqs.append(meta["SensorSequence"])
+        def hog(stop=stop):
+            while not stop:
+                sum(i * i for i in range(20000))
+        cam.stop()
+        cam.configure(cam.create_preview_configuration(
+            main={"size": (1280, 720)}, lores={"size": lores_size(*box, (1280, 720)), "format": "YUV420"}))
+        cam.add_listener(on_frame)
+        cam.start()
+        t = threading.Thread(target=hog, daemon=True)
+        t.start()
+        time.sleep(seconds)
+        stop.append(True)
+        t.join()
+        cam.remove_listener(on_frame)
+        cam.stop()
+        res.update({prefix + "frames": len(seqs),
+                    prefix + "dropped": seqs[-1] - seqs[0] + 1 - len(seqs) if seqs else 0,
+                    prefix + "frame_to_listener_ms_p50": percentile(lat, 50),
+                    prefix + "frame_to_listener_ms_p99": percentile(lat, 99)})
+    st = shared.stats()
+    res.update({"shm_cross_process_ms_p50": st["latency_ms_p50"], "shm_cross_process_ms_max": st["latency_ms_max"],
+                "shm_overruns": st["overruns"]})
+    return res
+
+
+def bench_tracing(n=100000):
+    """Цена засечки tracing.span на стадию: выключено и включено (нс)."""
+    res = {}
+    for on in (False, True):
+        tracing.enable(on)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            with tracing.span("bench"):
+                pass
+        res["trace_span_ns_" + ("on" if on else "off")] = (time.perf_counter() - t0) / n * 1e9
+    tracing.enable(False)
+    tracing.reset()
+    return res
+
+
+def compare(new, old):
+    """Строки 'метрика: старое -> новое (Δ%)'."""
+    lines = []
+    for k in sorted(new):
+        if k not in old or not isinstance(new[k], (int, float)): continue
+        a, b = old[k], new[k]
+        d = f"{(b - a) / abs(a) * 100.0:+.1f}%" if a else "—"
+        lines.append(f"  {k:32s} {a:10.2f} -> {b:10.2f}  ({d})")
+    return lines
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backend", default="sim", choices=("sim", "picamera2"))
+    ap.add_argument("--fps", type=float, default=30.0, help="частота кадров симулятора")
+    ap.add_argument("--latency", type=float, default=0.03, help="задержка кадра симулятора, с")
+    ap.add_argument("--seconds", type=float, default=5.0, help="длительность теста предпросмотра")
+    ap.add_argument("--shots", type=int, default=3)
+    ap.add_argument("--window", type=float, default=1.0, help="VISIBLE_WINDOW, с")
+    ap.add_argument("--burst", type=int, default=3, help="кадров в серии (ZSL), 1 — без серии")
+    ap.add_argument("--drift", type=float, default=0.0, help="дрейф глаза симулятора, пикс./кадр")
+    ap.add_argument("--shm", action="store_true", help="процесс захвата с общей памятью (shmcam)")
+    ap.add_argument("--json", help="сохранить результат в файл")
+    ap.add_argument("--compare", help="сравнить с прошлым результатом (json)")
+    args = ap.parse_args(argv)
+
+    # fork до потоков: сначала процесс захвата, потом пул (у него свой поток управления)
+    shared = camera_backend.shared_camera("proc:sim") if args.shm and args.backend == "sim" else None
+    encoder = EncodeQueue()
+    encoder.start()
+    ir_led, vis_led, _ = camera_backend.open_lights(17, 27, kind=args.backend)
+    ir_led, vis_led = RecordingLED(ir_led), RecordingLED(vis_led)
+    if args.backend == "sim":
+        cam = camera_backend.SimCamera(fps=args.fps, latency=args.latency,
+                                       lights=(ir_led.led, vis_led.led), drift=args.drift)
+    else:
+        cam = camera_backend.open_camera("picamera2")
+    cam.configure(cam.create_preview_configuration(
+        main={"size": (1280, 720)},
+        lores={"size": lores_size(800, 440, (1280, 720)), "format": "YUV420"}))
+    pump = MetadataPump(cam)
+    pump.start()
+    cam.start()
+    ir_led.on()
+    try:
+        result = {"backend": args.backend}
+        result.update(bench_tracing())
+        result.update(bench_preview(cam, args.seconds))
+        result.update(bench_preview(cam, args.seconds, peaking=True))
+        result.update(bench_mjpeg(cam))
+        result.update(bench_metadata(cam, pump))
+        result.update(bench_af(cam))
+        result.update(bench_controls(cam, pump))
+        result.update(bench_zoom(cam))
+        result.update(bench_video(cam, args.seconds))
+        result.update(bench_input())
+        result.update(bench_capture(cam, ir_led, vis_led, args.shots, args.window, pump=pump))
+        ring = FrameRing(cam, "main")
+        ring.start()
+        result.update(bench_capture(cam, ir_led, vis_led, args.shots, args.window, pump=pump, ring=ring))
+        if args.burst > 1:
+            result.update(bench_capture(cam, ir_led, vis_led, args.shots, args.window, pump=pump,
+                                        ring=ring, burst=args.burst))
+        # транзакция 3A + вспышка по границам кадров
+        sched = CameraScheduler(cam)
+        sched.start()
+        result.update(bench_capture(cam, ir_led, vis_led, args.shots, args.window, pump=pump,
+                                    sched=sched))
+        result.update(bench_capture(cam, ir_led, vis_led, args.shots, args.window, pump=pump,
+                                    ring=ring, burst=args.burst, sched=sched))
+        result.update(bench_pair(cam, ring, ir_led, vis_led, pump, sched, args.shots, args.window))
+        result.update(bench_flash(cam, ring, ir_led, vis_led, pump, sched, args.shots, args.window))
+        sched.stop()
+        result.update(bench_stacking(cam, ir_led, vis_led, encoder, ring))
+        ring.stop()
+        result.update(bench_encode(cam, encoder))
+        result.update(bench_raw(cam, encoder))
+        result.update(bench_gallery(cam))
+        if shared is not None:
+            shared.open(17, 27)
+            result.update(bench_shm(cam, shared))
+    finally:
+        pump.stop()
+        encoder.close()
+        ir_led.off(); vis_led.off()
+        cam.stop(); cam.close()
+        if shared is not None: shared.close()
+
+    for k, v in result.items():
+        print(f"{k:34s} {v:.2f}" if isinstance(v, float) else f"{k:34s} {v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\nСравнение с", args.compare)
+            print("\n".join(compare(result, json.load(f))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Бэкенды камеры и света.
+
+fundus.py работает с камерой только через подмножество API Picamera2
+(configure/start/stop/set_controls/capture_*), поэтому настоящую камеру
+можно подменить детерминированным симулятором — для бенчмарков и
+проверок без устройства.
+
+Выбор бэкенда: переменная окружения FUNDUS_CAMERA=picamera2|sim|sim-noaf
+(sim-noaf — симулятор линзы без AfMode, только LensPosition). Приставка
+proc: (proc:picamera2, proc:sim) — камера и свет в отдельном процессе
+захвата, кадры через общую память (shmcam.py).
+"""
+
+import os
+import random
+import threading
+import time
+
+# ====== ЧАСЫ СЕНСОРА ======
+# SensorTimestamp у libcamera — наносекунды CLOCK_BOOTTIME (начало считывания
+# кадра, т.е. конец экспозиции первой строки). Для сравнения с time.monotonic()
+# вычитаем постоянный сдвиг между часами.
+try:
+    BOOT_OFFSET = time.clock_gettime(time.CLOCK_BOOTTIME) - time.monotonic()
+except (AttributeError, OSError):
+    BOOT_OFFSET = 0.0
+
+
+def sensor_time(ts_ns):
+    """SensorTimestamp (нс) -> секунды по часам time.monotonic()."""
+    return ts_ns / 1e9 - BOOT_OFFSET
+
+
+# ====== ИНТЕРФЕЙС ======
+class CameraBackend:
+    """То, чем fundus.py пользуется у Picamera2. Запросы (capture_request)
+    отдают объекты с make_array(name)/get_metadata()/release()."""
+
+    camera_controls = {}
+
+    def create_preview_configuration(self, main=None, lores=None, **kw):
+        raise NotImplementedError
+
+    def create_still_configuration(self, main=None, lores=None, **kw):
+        raise NotImplementedError
+
+    def configure(self, config):
+        raise NotImplementedError
+
+    def camera_configuration(self):
+        raise NotImplementedError
+
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def set_controls(self, ctrls):
+        raise NotImplementedError
+
+    def capture_metadata(self):
+        raise NotImplementedError
+
+    def capture_array(self, name="main"):
+        raise NotImplementedError
+
+    def capture_request(self):
+        raise NotImplementedError
+
+    def capture_file(self, path, name="main"):
+        raise NotImplementedError
+
+    def add_listener(self, fn):
+        """fn(request) вызывается из потока камеры на каждый готовый кадр."""
+        raise NotImplementedError
+
+    def remove_listener(self, fn):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class Picamera2Backend(CameraBackend):
+    """Тонкая обёртка над настоящей Picamera2."""
+
+    def __init__(self, camera_num=0):
+        from picamera2 import Picamera2
+        self.cam = Picamera2(camera_num)
+        self._listeners = []
+        self.cam.post_callback = self._dispatch
+
+    def _dispatch(self, request):
+        for fn in list(self._listeners):
+            try: fn(request)
+            except Exception as e: print("Listener error:", e)
+
+    @property
+    def camera_controls(self):
+        return getattr(self.cam, "camera_controls", {})
+
+    def create_preview_configuration(self, main=None, lores=None, **kw):
+        return self.cam.create_preview_configuration(main=main or {}, lores=lores, **kw)
+
+    def create_still_configuration(self, main=None, lores=None, **kw):
+        return self.cam.create_still_configuration(main=main or {}, lores=lores, **kw)
+
+    def configure(self, config):           self.cam.configure(config)
+    def camera_configuration(self):        return self.cam.camera_configuration()
+    def start(self):                       self.cam.start()
+    def stop(self):                        self.cam.stop()
+    def set_controls(self, ctrls):         self.cam.set_controls(ctrls)
+    def capture_metadata(self):            return self.cam.capture_metadata()
+    def capture_array(self, name="main"):  return self.cam.capture_array(name)
+    def capture_request(self):             return self.cam.capture_request()
+
+    def capture_file(self, path, name="main"):
+        return self.cam.capture_file(path, name=name)
+
+    def add_listener(self, fn):
+        if fn not in self._listeners: self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        try: self._listeners.remove(fn)
+        except ValueError: pass
+
+    def close(self):
+        try: self.cam.close()
+        except Exception: pass
+
+    def __getattr__(self, name):
+        # всё остальное — напрямую в Picamera2
+        return getattr(self.__dict__["cam"], name)
+
+
+# ====== СВЕТ ======
+class DummyLED:
+    def on(self):  pass
+    def off(self): pass
+
+
+class DummyButton:  # noqa: N801
+    def __init__(self, *a, **kw): pass
+    def close(self): pass
+    when_pressed = None
+
+
+class SimLED:
+    """Светодиод-симулятор: запоминает моменты включения/выключения
+    (time.monotonic), чтобы симулятор камеры и бенчмарк знали, когда
+    кадр был освещён."""
+
+    def __init__(self, name="", clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.is_lit = False
+        self.events = []   # [(t, lit)]
+        self._lock = threading.Lock()
+
+    def _set(self, lit):
+        with self._lock:
+            if lit == self.is_lit: return
+            self.is_lit = lit
+            self.events.append((self.clock(), lit))
+            del self.events[:-256]
+
+    def on(self):  self._set(True)
+    def off(self): self._set(False)
+
+    def lit_fraction(self, t0, t1):
+        """Доля интервала [t0, t1], когда светодиод горел."""
+        if t1 <= t0:
+            return 1.0 if self.is_lit else 0.0
+        with self._lock:
+            events = list(self.events)
+            state = self.is_lit
+        # состояние на момент t0
+        before = [lit for t, lit in events if t <= t0]
+        if before:          state = before[-1]
+        elif events:        state = not events[0][1]
+        lit_time, last = 0.0, t0
+        for t, lit in events:
+            if t <= t0: continue
+            if t >= t1: break
+            if state: lit_time += t - last
+            state, last = lit, t
+        if state: lit_time += t1 - last
+        return lit_time / (t1 - t0)
+
+
+_shared = {}
+
+
+def shared_camera(kind):
+    """Процесс захвата для kind=proc:<бэкенд> (один на процесс). Создаётся
+    fork'ом — первый вызов до потоков и Tk (CameraController это делает)."""
+    if kind not in _shared:
+        from shmcam import SharedCamera
+        _shared[kind] = SharedCamera(kind.partition(":")[2] or "picamera2")
+    return _shared[kind]
+
+
+def open_lights(ir_gpio, vis_gpio, active_high=True, kind=None):
+    """(ir_led, vis_led, Button). Без gpiozero — заглушки. С proc: свет
+    открывается в процессе захвата, кнопки остаются здесь."""
+    kind = kind or os.environ.get("FUNDUS_CAMERA", "picamera2")
+    if kind.startswith("proc"):
+        cam = shared_camera(kind)
+        cam.open(ir_gpio, vis_gpio, active_high)
+        try:
+            from gpiozero import Button
+        except Exception:
+            Button = DummyButton
+        return cam.ir_led, cam.vis_led, (DummyButton if "sim" in kind else Button)
+    if kind.startswith("sim"):
+        return SimLED("ir"), SimLED("vis"), DummyButton
+    try:
+        from gpiozero import LED, Button
+        ir_led  = LED(ir_gpio,  active_high=active_high)
+        vis_led = LED(vis_gpio, active_high=active_high)
+        ir_led.off(); vis_led.off()
+        return ir_led, vis_led, Button
+    except Exception:
+        return DummyLED(), DummyLED(), DummyButton
+
+
+def open_camera(kind=None, lights=None):
+    """Создать камеру выбранного бэкенда. lights=(ir, vis) нужен симулятору."""
+    kind = kind or os.environ.get("FUNDUS_CAMERA", "picamera2")
+    if kind.startswith("proc"):
+        return shared_camera(kind)
+    if kind.startswith("sim"):
+        return SimCamera(lights=lights, af=(kind != "sim-noaf"))
+    return Picamera2Backend()
+
+
+# ====== СИМУЛЯТОР ======
+ROW_SAMPLES = (0.0, 0.125, 0.25, 0.375, 0.5, 0.625, 0.75, 0.875, 1.0)   # строки (доля высоты) для освещённости
+
+def _box_blur(a, r):
+    """Box-блюр по обеим осям через кумулятивные суммы (float32, HxWxC)."""
+    import numpy as np
+    out = a
+    for axis in (0, 1):
+        pad = [(0, 0)] * out.ndim
+        pad[axis] = (r + 1, r)
+        c = np.cumsum(np.pad(out, pad, mode="edge"), axis=axis, dtype=np.float32)
+        n = out.shape[axis]
+        hi = np.take(c, np.arange(2 * r + 1, 2 * r + 1 + n), axis=axis)
+        lo = np.take(c, np.arange(0, n), axis=axis)
+        out = (hi - lo) / (2 * r + 1)
+    return out
+
+
+def synthetic_fundus(w, h, seed=0):
+    """Синтетическое глазное дно: красный диск с виньеткой, диск зрительного
+    нерва, макула, сосуды и мелкая текстура. Возвращает float32 HxWx3 (0..255)."""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    s = float(min(w, h))
+    cx, cy = w / 2.0, h / 2.0
+    r = np.hypot(x - cx, y - cy) / (0.48 * s)
+    vign = np.clip(1.0 - r ** 2.2, 0.0, 1.0)
+
+    img = np.empty((h, w, 3), np.float32)
+    img[..., 0] = 200 * vign + 10
+    img[..., 1] = 85 * vign + 4
+    img[..., 2] = 30 * vign + 2
+
+    # диск зрительного нерва
+    dx, dy = cx + 0.18 * s, cy - 0.02 * s
+    rd = np.hypot(x - dx, y - dy) / (0.075 * s)
+    disc = np.exp(-rd ** 4)
+    img[..., 0] += 55 * disc
+    img[..., 1] += 140 * disc
+    img[..., 2] += 70 * disc
+
+    # макула
+    mx, my = cx - 0.12 * s, cy + 0.02 * s
+    mac = np.exp(-(np.hypot(x - mx, y - my) / (0.07 * s)) ** 2)
+    img *= (1.0 - 0.35 * mac)[..., None]
+
+    # сосуды: изогнутые лучи из диска
+    th = np.arctan2(y - dy, x - dx)
+    rr = np.hypot(x - dx, y - dy) / s
+    vessels = np.exp(-(np.sin(5 * th + 6 * rr) ** 2) / 0.004) * np.clip(rr * 8, 0, 1) * (rd > 0.8)
+    img *= (1.0 - 0.55 * vessels)[..., None]
+
+    # мелкая текстура сетчатки — по ней меряется резкость
+    cell = max(2, int(s) // 160)
+    tex = rng.normal(0.0, 1.0, (h // cell + 1, w // cell + 1)).astype(np.float32)
+    tex = np.repeat(np.repeat(tex, cell, 0), cell, 1)[:h, :w]
+    img *= (1.0 + 0.12 * tex * vign)[..., None]
+    return np.clip(img, 0, 255)
+
+
+class SimRequest:
+    """Кадр симулятора: массивы рендерятся лениво при make_array()."""
+
+    def __init__(self, cam, seq, metadata, params):
+        self.cam = cam
+        self.seq = seq
+        self._metadata = metadata
+        self._params = params
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def get_metadata(self):
+        return dict(self._metadata)
+
+    def make_array(self, name="main"):
+        with self._lock:
+            if name not in self._arrays:
+                self._arrays[name] = self.cam._render(name, self._params, self.seq)
+            return self._arrays[name]
+
+    def save(self, name, path):
+        from PIL import Image
+        Image.fromarray(self.make_array(name)).save(path)
+
+    def release(self):
+        pass
+
+
+class SimCamera(CameraBackend):
+    """Детерминированная камера-симулятор.
+
+    Кадры идут с частотой fps; каждый кадр становится доступен через
+    latency секунд после конца экспозиции. ScalerCrop и LensPosition
+    учитываются (кроп сенсора, дефокус), AE подстраивает ExposureTime
+    под освещённость от lights=(ir, vis), если это SimLED. Изменения
+    управления применяются с задержкой control_delay кадров, как у
+    libcamera. af=False — линза без AfMode (только LensPosition).
+    drift — дрейф глаза: случайное блуждание кадра, пикселей сенсора за кадр
+    (для проверки совмещения при стекинге). readout — время считывания
+    (rolling shutter, как у сенсоров Pi): последняя строка экспонируется на
+    readout секунд позже первой; SensorTimestamp — конец экспозиции первой.
+    """
+
+    def __init__(self, sensor_size=(2304, 1296), fps=30.0, latency=0.03,
+                 seed=0, lights=None, best_focus=5.0, af=True, control_delay=2, drift=0.0,
+                 readout=0.008):
+        self.sensor_size = tuple(sensor_size)
+        self.fps = float(fps)
+        self.latency = float(latency)
+        self.seed = seed
+        self.lights = lights
+        self.best_focus = float(best_focus)
+        self.control_delay = int(control_delay)
+        self.drift = float(drift)
+        self.readout = float(readout)
+        self._eye = [0.0, 0.0]
+        self._rng = random.Random(seed)
+        sw, sh = self.sensor_size
+        self.camera_controls = {
+            "LensPosition": (0.0, 10.0, 1.0),
+            "ScalerCrop": ((0, 0, 64, 64), (0, 0, sw, sh), (0, 0, sw, sh)),
+            "AeEnable": (False, True, True),
+            "AwbEnable": (False, True, True),
+            "ExposureTime": (100, 66666, 20000),
+            "AnalogueGain": (1.0, 16.0, 1.0),
+        }
+        if af:
+            self.camera_controls["AfMode"] = (0, 2, 0)
+            self.camera_controls["AfTrigger"] = (0, 1, 0)
+
+        self._config = self.create_preview_configuration(main={"size": (1280, 720)})
+        self._ctrl = {
+            "ScalerCrop": (0, 0, sw, sh), "LensPosition": 1.0, "AfMode": 0,
+            "AeEnable": True, "AwbEnable": True, "ExposureTime": 20000, "AnalogueGain": 1.0,
+        }
+        self._pending = []          # [(seq_effective, ctrls)]
+        self._lens = 1.0
+        self._exposure = 20000.0
+        self._seq = -1
+        self._last = None
+        self._cond = threading.Condition()
+        self._listeners = []
+        self._thread = None
+        self._running = False
+        self._base = None
+        self._blur = None
+        self._noise = None
+        self._sampled = {}
+
+    # --- конфигурация ---
+    def _make_config(self, main, lores, kind):
+        main = dict(main or {})
+        main.setdefault("size", (1280, 720))
+        main.setdefault("format", "BGR888")   # байты R,G,B (именование libcamera)
+        cfg = {"main": main, "lores": None, "kind": kind,
+               "sensor": {"output_size": self.sensor_size}}
+        if lores:
+            lores = dict(lores)
+            lores.setdefault("format", "YUV420")
+            cfg["lores"] = lores
+        return cfg
+
+    def create_preview_configuration(self, main=None, lores=None, **kw):
+        return self._make_config(main, lores, "preview")
+
+    def create_still_configuration(self, main=None, lores=None, **kw):
+        return self._make_config(main or {"size": self.sensor_size}, lores, "still")
+
+    def configure(self, config):
+        if self._running:
+            raise RuntimeError("Camera must be stopped before configuring")
+        self._config = config
+
+    def camera_configuration(self):
+        return self._config
+
+    # --- старт/стоп ---
+    def start(self):
+        if self._running: return
+        if self._base is None:
+            self._base = synthetic_fundus(*self.sensor_size, seed=self.seed)
+            self._blur = _box_blur(self._base, max(2, self.sensor_size[1] // 100))
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=1.0)
+        self._thread = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self):
+        self.stop()
+
+    # --- управление ---
+    def set_controls(self, ctrls):
+        for k in ctrls:
+            if k not in self.camera_controls:
+                raise RuntimeError(f"Control {k} is not advertised by libcamera")
+        with self._cond:
+            self._pending.append((self._seq + 1 + self.control_delay, dict(ctrls)))
+
+    def add_listener(self, fn):
+        if fn not in self._listeners: self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        try: self._listeners.remove(fn)
+        except ValueError: pass
+
+    # --- захват ---
+    def _next_request(self, timeout=2.0):
+        with self._cond:
+            seq = self._seq
+            if not self._cond.wait_for(lambda: self._seq > seq or not self._running, timeout):
+                raise TimeoutError("Sim camera: no frame")
+            if self._seq <= seq:
+                raise RuntimeError("Camera is not running")
+            return self._last
+
+    def capture_request(self):
+        return self._next_request()
+
+    def capture_metadata(self):
+        return self._next_request().get_metadata()
+
+    def capture_array(self, name="main"):
+        return self._next_request().make_array(name)
+
+    def capture_file(self, path, name="main"):
+        req = self._next_request()
+        req.save(name, path)
+        return req.get_metadata()
+
+    # --- поток кадров ---
+    def _light_level(self, t0, t1):
+        ir, vis = (self.lights or (None, None))
+        level = 0.02  # засветка помещения
+        if isinstance(ir, SimLED):  level += 0.25 * ir.lit_fraction(t0, t1)
+        if isinstance(vis, SimLED): level += 1.0 * vis.lit_fraction(t0, t1)
+        return level
+
+    def _loop(self):
+        period = 1.0 / self.fps
+        t_next = time.monotonic() + period
+        skipped = 0
+        while self._running:
+            delay = t_next - time.monotonic()
+            if delay > 0: time.sleep(delay)
+            # время кадра — по сетке сенсора, а не по тому, когда проснулся поток
+            t_end = t_next - self.latency
+            with self._cond:
+                seq = self._seq + 1 + skipped
+                for item in [p for p in self._pending if p[0] <= seq]:
+                    self._ctrl.update(item[1])
+                    self._pending.remove(item)
+                ctrl = dict(self._ctrl)
+
+            # экспозиция и AE
+            gain = float(ctrl.get("AnalogueGain", 1.0))
+            exp_us = self._exposure
+            t_start = t_end - exp_us / 1e6
+            # освещённость по строкам: строка i экспонируется на i/h·readout позже первой
+            rows = [self._light_level(t_start + f * self.readout, t_end + f * self.readout)
+                    for f in ROW_SAMPLES]
+            light = rows[len(rows) // 2]
+            if ctrl.get("AeEnable", True):
+                target = 20000.0 * 0.27 / max(light * gain, 1e-3)
+                self._exposure = min(66666.0, max(100.0, exp_us + 0.5 * (target - exp_us)))
+            else:
+                self._exposure = float(ctrl.get("ExposureTime", exp_us))
+
+            # линза: AfMode=2 сама тянет её к фокусу
+            if ctrl.get("AfMode", 0) == 2:
+                self._lens += 0.3 * (self.best_focus - self._lens)
+                af_state = 2 if abs(self._lens - self.best_focus) < 0.05 else 1
+            else:
+                self._lens = float(ctrl.get("LensPosition", self._lens))
+                af_state = 0
+
+            crop = tuple(int(v) for v in ctrl["ScalerCrop"])
+            if self.drift:
+                # блуждание с возвратом к центру: глаз не уходит дальше ~10·drift
+                for i in (0, 1):
+                    self._eye[i] += self._rng.gauss(0.0, self.drift) - 0.05 * self._eye[i]
+            brightness = light * exp_us * gain / (20000.0 * 0.27)
+            meta = {
+                "SensorTimestamp": int((t_end + BOOT_OFFSET) * 1e9),
+                "SensorSequence": seq,
+                "FrameDuration": int(period * 1e6),
+                "ExposureTime": int(exp_us),
+                "AnalogueGain": gain,
+                "ScalerCrop": crop,
+                "LensPosition": round(self._lens, 3),
+                "AfState": af_state,
+                "AeLocked": not ctrl.get("AeEnable", True),
+                "Lux": round(400.0 * light, 1),
+            }
+            scale = exp_us * gain / (20000.0 * 0.27)
+            params = {"crop": crop, "lens": self._lens, "brightness": brightness,
+                      "rows": [v * scale for v in rows],
+                      "eye": (int(round(self._eye[0])), int(round(self._eye[1])))}
+            req = SimRequest(self, seq, meta, params)
+            with self._cond:
+                self._seq = seq
+                self._last = req
+                self._cond.notify_all()
+            for fn in list(self._listeners):
+                try: fn(req)
+                except Exception as e: print("Listener error:", e)
+
+            # отстали (медленные подписчики) — кадры теряются, как у настоящей
+            # камеры, но сетка времени и нумерация кадров сохраняются
+            t_next += period
+            skipped = 0
+            while t_next < time.monotonic():
+                t_next += period
+                skipped += 1
+
+    def _render(self, name, params, seq):
+        import numpy as np
+        stream = (self._config or {}).get(name) or {}
+        if name == "raw":
+            stream = {"size": self.sensor_size}
+        if not stream:
+            raise RuntimeError(f"Stream {name} is not configured")
+        out_w, out_h = stream["size"]
+        x0, y0, cw, ch = params["crop"]
+        ex, ey = params.get("eye", (0, 0))
+        x0, y0 = x0 + ex, y0 + ey
+        sw, sh = self.sensor_size
+        x0 = min(max(0, x0), sw - 1); y0 = min(max(0, y0), sh - 1)
+        cw = max(1, min(cw, sw - x0));  ch = max(1, min(ch, sh - y0))
+        # выборка под кроп меняется редко (зум) — кэшируем резкий кадр и разницу с размытым
+        key = (x0, y0, cw, ch, out_w, out_h)
+        cached = self._sampled.get(key)
+        if cached is None:
+            xs = (x0 + (np.arange(out_w) + 0.5) * cw / out_w).astype(np.intp)
+            ys = (y0 + (np.arange(out_h) + 0.5) * ch / out_h).astype(np.intp)
+            sharp = self._base.take(ys, axis=0).take(xs, axis=1)
+            cached = (sharp, self._blur.take(ys, axis=0).take(xs, axis=1) - sharp)
+            if len(self._sampled) > 8: self._sampled.clear()
+            self._sampled[key] = cached
+        sharp, diff = cached
+        w = min(1.0, abs(params["lens"] - self.best_focus) / 2.5)
+        img = np.multiply(diff, w)
+        img += sharp
+        rows = params.get("rows")
+        if rows and max(rows) - min(rows) > 1e-6 * max(rows):
+            img *= np.interp(np.linspace(0.0, 1.0, out_h), ROW_SAMPLES,
+                             rows).astype(np.float32).reshape((out_h,) + (1,) * (img.ndim - 1))
+        else:
+            img *= params["brightness"]
+        # шум: свой у каждого кадра (равномерный int8, σ≈74), как у сенсора —
+        # сдвинутые копии одного поля коррелируют между кадрами и ломают совмещение.
+        # Масштабатор ISP усредняет пиксели сенсора: при уменьшении шум падает (lores)
+        sigma = (2.0 + 6.0 / max(params["brightness"], 0.1)) * min(1.0, out_w / cw)
+        img += self._noise_field(img.shape) * np.float32(sigma / 74.0)
+        np.clip(img, 0, 255, out=img)
+        return _pack(img.astype(np.uint8), stream.get("format", "BGR888"))
+
+    def _noise_field(self, shape):
+        import numpy as np
+        if self._noise is None:
+            self._noise = np.random.default_rng(self.seed)
+        # байты генератора — ~10 мс на кадр 1280x720 против ~55 мс у normal()
+        return np.frombuffer(self._noise.bytes(int(np.prod(shape))), np.int8).reshape(shape)
+
+
+def _pack(rgb, fmt):
+    """RGB uint8 -> раскладка формата Picamera2 (YUV420 — I420 высотой h*3/2)."""
+    import numpy as np
+    if fmt == "YUV420":
+        f = rgb.astype(np.float32)
+        y = 16.0 + 0.257 * f[..., 0] + 0.504 * f[..., 1] + 0.098 * f[..., 2]
+        sub = f[0::2, 0::2]
+        u = 128.0 - 0.148 * sub[..., 0] - 0.291 * sub[..., 1] + 0.439 * sub[..., 2]
+        v = 128.0 + 0.439 * sub[..., 0] - 0.368 * sub[..., 1] - 0.071 * sub[..., 2]
+        h, w = y.shape
+        flat = np.concatenate([y.ravel(), u.ravel(), v.ravel()])
+        return np.clip(flat, 0, 255).astype(np.uint8).reshape(h * 3 // 2, w)
+    if fmt == "RGB888":
+        return np.ascontiguousarray(rgb[..., ::-1])
+    if fmt in ("XBGR8888", "XRGB8888"):
+        c = rgb if fmt == "XBGR8888" else rgb[..., ::-1]
+        return np.concatenate([c, np.full(rgb.shape[:2] + (1,), 255, np.uint8)], axis=2)
+    return rgb
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Последовательность съёмки без UI: фиксация AE/AWB/линзы, свет, снимок,
+возврат в исходное состояние. Используется fundus.py и bench.py."""
+
+import datetime
+import json
+import math
+import os
+import time
+from time import sleep
+
+import tracing
+
+
+# время считывания сенсора (rolling shutter): последняя строка экспонируется
+# на столько позже первой. None — FrameDuration (верхняя оценка: считывание
+# не дольше кадра; вспышка длиннее нужного, но кадр освещён целиком)
+READOUT = None
+
+_issued = set()   # пути, уже выданные под ещё не записанные файлы
+
+
+def photo_path(save_dir, subdir, prefix, ext=".jpg"):
+    """save_dir/Fundus/<subdir>/<prefix>_YYYYmmdd_HHMMSS<ext> (папка создаётся).
+    Несколько снимков в одну секунду получают суффикс _2, _3, …
+    ext=".npy" — сырой снимок (rawfile)."""
+    base_dir = os.path.join(save_dir, "Fundus", subdir)
+    os.makedirs(base_dir, exist_ok=True)
+    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    path, n = os.path.join(base_dir, f"{prefix}_{now}{ext}"), 1
+    while path in _issued or os.path.exists(path):
+        n += 1
+        path = os.path.join(base_dir, f"{prefix}_{now}_{n}{ext}")
+    _issued.add(path)
+    if len(_issued) > 256: _issued.clear(); _issued.add(path)
+    return path
+
+
+def _advertised(cam, ctrls):
+    """Только те ключи, которые камера объявляет (неизвестный ключ валит всю запись)."""
+    controls = getattr(cam, "camera_controls", None)
+    if not controls:
+        return dict(ctrls)
+    return {k: v for k, v in ctrls.items() if k in controls}
+
+
+def _apply(cam, ctrls, sched=None, wait=False):
+    """Одна запись ctrls (через планировщик, если он есть); wait — дождаться
+    кадра, в котором они действуют. Если камера отвергла набор целиком —
+    по одному ключу, как раньше. Возвращает множество применённых ключей и
+    результат transaction (или None)."""
+    try:
+        if sched is not None and wait:
+            return set(ctrls), sched.transaction(ctrls)
+        if sched is not None:
+            sched.apply_now(ctrls)
+        else:
+            with tracing.span("set_controls"):
+                cam.set_controls(ctrls)
+        return set(ctrls), None
+    except Exception as e:
+        print("Управление одной записью не прошло, по одному:", e)
+    ok = set()
+    for k, v in ctrls.items():
+        try:
+            cam.set_controls({k: v})
+            ok.add(k)
+        except Exception:
+            pass
+    return ok, None
+
+
+def lock_3a(cam, af_available, has_lenspos, pump=None, sched=None, flash=None):
+    """Зафиксировать автоэкспозицию/баланс и фокус одной транзакцией.
+    Текущие ExposureTime/AnalogueGain (и ColourGains, если камера их
+    докладывает) задаются явно вместе с AeEnable/AwbEnable=0, линза — в
+    ручной режим на текущей позиции. pump — MetadataPump: значения берутся
+    без ожидания кадра; sched — CameraScheduler: ждём кадр, в котором всё
+    это уже действует (settle_ms), вместо паузы наугад. flash —
+    ExposureTime/AnalogueGain для видимой вспышки (таблица flashcal) вместо
+    измеренных AE под ИК: уходят той же записью.
+    Возвращает состояние для restore_3a: ae/awb (None — не удалось),
+    lens (позиция линзы или None), frozen (линза переведена в ручной)."""
+    state = {"ae": True, "awb": True, "lens": None, "frozen": False, "settle_ms": None}
+    try:
+        if pump is not None and pump.seq >= 0:
+            meta = pump.latest()[1]
+        else:
+            meta = cam.capture_metadata() or {}
+    except Exception:
+        meta = {}
+
+    ctrls = {"AeEnable": 0, "AwbEnable": 0}
+    for k in ("ExposureTime", "AnalogueGain", "ColourGains"):
+        if meta.get(k) is not None:
+            ctrls[k] = meta[k]
+    if flash:
+        ctrls.update({k: flash[k] for k in ("ExposureTime", "AnalogueGain") if flash.get(k) is not None})
+    # если AF был включён — заморозим текущую позицию линзы
+    if af_available:
+        lp = meta.get("LensPosition")
+        state["lens"] = lp
+        if has_lenspos and lp is not None:
+            ctrls.update({"AfMode": 0, "LensPosition": lp})
+
+    ok, done = _apply(cam, _advertised(cam, ctrls), sched, wait=True)
+    if "AeEnable" not in ok:  state["ae"] = None
+    if "AwbEnable" not in ok: state["awb"] = None
+    state["frozen"] = "LensPosition" in ok and "AfMode" in ok
+    if done is not None:
+        state["settle_ms"] = done[2] * 1000.0
+    elif sched is not None:
+        print("3A: кадр с применённым управлением не дождались")
+    return state
+
+
+def restore_3a(cam, state, restore_af, sched=None):
+    """Вернуть AE/AWB и, если restore_af, непрерывный AF (одной записью).
+    True — AF вернули."""
+    ctrls = {}
+    if state["ae"] is not None:  ctrls["AeEnable"] = 1
+    if state["awb"] is not None: ctrls["AwbEnable"] = 1
+    if restore_af:               ctrls["AfMode"] = 2
+    ok, _ = _apply(cam, _advertised(cam, ctrls), sched)
+    return restore_af and "AfMode" in ok
+
+
+def _sleep_until(t):
+    """Точное ожидание момента t (time.monotonic): sleep, последняя миллисекунда — опросом."""
+    left = t - time.monotonic()
+    if left > 0.002:
+        sleep(left - 0.001)
+    while time.monotonic() < t:
+        pass
+
+
+def readout_time(meta):
+    """Время считывания кадра, с: READOUT или FrameDuration из метаданных."""
+    if READOUT is not None:
+        return READOUT
+    return (meta.get("FrameDuration") or 0) / 1e6
+
+
+def frame_flash(led, pump, frames=1, margin=0.002, lead=0.003, timeout=1.0, off=None, after=None,
+                plan=None):
+    """Включить led ровно на экспозицию следующих frames кадров (± margin).
+    Границы кадров предсказываются по метаданным последнего кадра:
+    SensorTimestamp, FrameDuration и ExposureTime (экспозиция зафиксирована
+    lock_3a, поэтому предсказание точное). SensorTimestamp — конец
+    экспозиции первой строки; последняя (rolling shutter) кончает на
+    readout_time() позже — до неё вспышка и горит. lead — запас на то, чтобы успеть
+    включить свет до начала экспозиции. off — другой свет, который гаснет в
+    тот же момент (ИК перед VIS); after — экспозиция кадра перед вспышкой
+    должна начаться не раньше этого момента. Свет с pulse() (процесс захвата,
+    shmcam) переключается там по расписанию, lead — не меньше его led.lead.
+    plan(t_on, t_off, period) — вызывается с расчётными моментами до вспышки.
+    Возвращает (t_on, t_off)."""
+    from metadata import exposure_window
+    got = pump.wait_next(timeout)
+    if got is None:
+        raise RuntimeError("Вспышка: нет кадров")
+    meta = got[1]
+    win = exposure_window(meta)
+    period = (meta.get("FrameDuration") or 0) / 1e6
+    if win is None or period <= 0:
+        raise RuntimeError("Вспышка: нет SensorTimestamp/FrameDuration")
+    start, end = win
+    pulse = getattr(led, "pulse", None)
+    if pulse is not None:
+        lead = max(lead, getattr(led, "lead", 0.0))
+    k = max(1, int((time.monotonic() + lead + margin - start) / period) + 1)
+    if after is not None:
+        k = max(k, int(math.ceil((after - start) / period)) + 1)
+    t_on = start + k * period - margin
+    t_off = end + (k + max(1, frames) - 1) * period + readout_time(meta) + margin
+    if plan is not None:
+        plan(t_on, t_off, period)
+    if pulse is not None and (off is None or hasattr(off, "pulse")):
+        t_on, t_off = pulse(t_on, t_off, off)
+        tracing.record("flash", t_off - t_on)
+        return t_on, t_off
+    _sleep_until(t_on)
+    if off is not None:
+        off.off()
+    led.on()
+    t_on = time.monotonic()
+    _sleep_until(t_off)
+    led.off()
+    t_off = time.monotonic()
+    tracing.record("flash", t_off - t_on)
+    return t_on, t_off
+
+
+def _after(t):
+    """keep для FrameRing: кадры, экспозиция которых началась не раньше t."""
+    return lambda start, end: start is not None and start >= t
+
+
+def _plan(ring, before=0):
+    """plan для frame_flash: буфер копирует только кадры вспышки и before
+    кадров прямо перед ней (ИК-кадр пары)."""
+    def plan(t_on, t_off, period):
+        lo = t_on - (before + 0.5) * period
+        ring.keep(lambda start, end: start is not None and lo <= start < t_off)
+    return plan
+
+
+def _lit(t_on, t_off, readout=0.0):
+    """Фильтр кадров: экспозиция всех строк (первой [start, end], последней —
+    на readout позже) целиком внутри [t_on, t_off]."""
+    def pred(start, end):
+        return start is not None and start >= t_on and end + readout <= t_off
+    return pred
+
+
+def flash_and_capture(cam, ir_led, vis_led, path, visible=True, window=1.0, encoder=None,
+                      burst=1, keep_rest=False, pump=None):
+    """Включить свет, снять кадр, сохранить.
+    visible=True и pump (MetadataPump) — вспышка по границам кадров
+    (frame_flash): VIS горит ровно на экспозицию burst кадров, а эти кадры
+    копирует временный FrameRing, взведённый до вспышки (кадров пришло
+    меньше burst — в лог); window — только предел ожидания.
+    Без pump — как раньше: кадр в середине окна window, затем хвост окна.
+    Для ИК (visible=False) IR остаётся, VIS выключен.
+    Свет обратно не переключается — это делает вызывающий в finally.
+    encoder — EncodeQueue с зарезервированным местом: в окне берётся только
+    массив, JPEG пишется в пуле. Без него — capture_file, как раньше.
+    burst > 1 — серия кадров подряд, сохраняется самый резкий (store_best).
+    Возвращает тайминги (time.monotonic) и метаданные снимка."""
+    n = max(1, burst)
+    if visible and pump is not None:
+        # кадры копируются подписчиком с момента до вспышки: frame_flash
+        # возвращается после неё, и capture_request уже не застал бы кадры серии
+        from frame_ring import FrameRing
+        ring = FrameRing(cam, "main", max_frames=n + 2)
+        ring.start()
+        ring.arm(_after(time.monotonic()))
+        try:
+            ir_led.off()
+            t0, t_off = frame_flash(vis_led, pump, n, timeout=window, plan=_plan(ring))
+            lit = _lit(t0, t_off, readout_time(pump.latest()[1]))
+            got = ring.wait_frames(lambda f: lit(f.start, f.end), n, timeout=window,
+                                   stop=lambda f: f.start is not None and f.start > t_off)
+        finally:
+            ring.stop()
+        if not got:
+            raise RuntimeError("Нет кадра со вспышкой")
+        if len(got) < n:
+            print(f"Серия: со вспышкой {len(got)} из {n} кадров (кадры потеряны)")
+        frames = [(f.array, f.metadata) for f in got]
+        t_cap = time.monotonic()
+        info = store_best(cam, frames, path, "main", encoder, keep_rest)
+        res = {"path": path, "t_light": t0, "t_capture": t_cap, "t_saved": time.monotonic(),
+               "t_end": t_off, "metadata": frames[info["best"]][1], "synced": True}
+        res.update(info)
+        return res
+
+    if visible:
+        ir_led.off(); vis_led.on()
+    else:
+        vis_led.off(); ir_led.on()
+
+    t0 = time.monotonic()
+    sleep(window / 2)
+    t_cap = time.monotonic()
+    info = {}
+    if encoder is None and n == 1 and not path.endswith(".npy"):
+        with tracing.span("capture_file"):
+            meta = cam.capture_file(path)
+    else:
+        frames = []
+        for _ in range(n):
+            req = cam.capture_request()
+            try:
+                frames.append((req.make_array("main"), req.get_metadata()))
+            finally:
+                req.release()
+        info = store_best(cam, frames, path, "main", encoder, keep_rest)
+        meta = frames[info["best"]][1]
+    t_saved = time.monotonic()
+
+    # добираем хвост окна
+    sleep(max(0, window - (time.monotonic() - t0)))
+    if visible: tracing.record("flash", time.monotonic() - t0)
+    res = {"path": path, "t_light": t0, "t_capture": t_cap, "t_saved": t_saved,
+           "t_end": time.monotonic(), "metadata": meta or {}}
+    res.update(info)
+    return res
+
+
+def _stream_format(cam, stream):
+    cfg = (cam.camera_configuration() or {}).get(stream) or {}
+    return cfg.get("format", "XBGR8888"), (cfg.get("size") or (None,))[0]
+
+
+def save_array(cam, arr, path, stream="main"):
+    """Сохранить массив потока stream в файл (формат — по расширению)."""
+    from PIL import Image
+    from preview import to_rgb
+    with tracing.span("capture_file"):
+        Image.fromarray(to_rgb(arr, *_stream_format(cam, stream))).save(path)
+
+
+def submit_array(cam, encoder, arr, path, stream="main"):
+    """Отдать массив потока stream в EncodeQueue (место уже зарезервировано)."""
+    fmt, width = _stream_format(cam, stream)
+    return encoder.submit(arr, fmt, width, path)
+
+
+def store_raw(cam, arr, path, stream="main", metadata=None, encoder=None):
+    """Сырой массив потока -> path (.npy, rawfile.save_raw) здесь же, без пула:
+    одна копия в отображённый файл, без JPEG и передачи в процесс. Место в
+    encoder (зарезервированное) освобождается сразу. Возвращает секунды."""
+    import rawfile
+    fmt, width = _stream_format(cam, stream)
+    dt = rawfile.save_raw(arr, path, fmt, width, metadata, stream)
+    tracing.record("capture_file", dt)
+    if encoder is not None:
+        encoder.complete(path, dt)
+    return dt
+
+
+def _put(cam, arr, path, stream, meta, encoder):
+    """Кадр в path: .npy — сырой (store_raw), иначе — в пул или здесь же."""
+    if path.endswith(".npy"): store_raw(cam, arr, path, stream, meta, encoder)
+    elif encoder is not None: submit_array(cam, encoder, arr, path, stream)
+    else:                     save_array(cam, arr, path, stream)
+
+
+def store_best(cam, frames, path, stream="main", encoder=None, keep_rest=False):
+    """frames — [(array, metadata)] серии. Оценить каждый кадр (imaging.score_frame
+    на прореженной центральной области), лучший записать в path, остальные —
+    в <path>_b<N> (с тем же расширением), если keep_rest и в очереди записи
+    есть место. path на .npy — сырые файлы (store_raw).
+    Время оценки — стадия score трассировки. Возвращает best, scores, score_ms и
+    exposure — гистограммную проверку лучшего кадра (imaging.exposure_check:
+    verdict over/under/ok), сразу после съёмки, до записи."""
+    import imaging
+    fmt, _ = _stream_format(cam, stream)
+    t0 = time.perf_counter()
+    scores = [imaging.score_frame(arr, fmt) for arr, _ in frames]
+    score_ms = (time.perf_counter() - t0) * 1000.0
+    tracing.record("score", score_ms / 1000.0)
+    best = max(range(len(frames)), key=lambda i: scores[i]["score"])
+    exposure = imaging.exposure_check(frames[best][0], fmt)
+    _put(cam, frames[best][0], path, stream, frames[best][1], encoder)
+    if keep_rest:
+        stem, ext = os.path.splitext(path)
+        for i, (arr, meta) in enumerate(frames):
+            if i == best: continue
+            if encoder is not None and not encoder.reserve():
+                print("Серия: очередь записи полна, остальные кадры пропущены"); break
+            _put(cam, arr, f"{stem}_b{i + 1}{ext}", stream, meta, encoder)
+    return {"best": best, "scores": scores, "score_ms": score_ms, "exposure": exposure}
+
+
+def flash_and_capture_zsl(cam, ring, ir_led, vis_led, path, visible=True, window=1.0,
+                          settle=0.0, encoder=None, burst=1, keep_rest=False, pump=None):
+    """Как flash_and_capture, но кадры берутся из FrameRing.
+    visible=True и pump — вспышка по границам кадров (frame_flash), из буфера
+    берутся кадры, экспозиция которых целиком пришлась на неё.
+    Иначе — первые burst кадров, экспозиция которых началась не раньше чем
+    через settle после включения света; VIS гасится сразу, как они пришли.
+    Оценка серии идёт уже после вспышки.
+    lag_saved_ms — насколько раньше середины окна получен последний кадр."""
+    n = max(1, burst)
+    synced = visible and pump is not None
+    ring.arm(_after(time.monotonic()) if synced else None)
+    try:
+        if synced:
+            ir_led.off()
+            t0, t_off = frame_flash(vis_led, pump, n, timeout=window, plan=_plan(ring))
+            lit = _lit(t0, t_off, readout_time(pump.latest()[1]))
+            frames = ring.wait_frames(lambda f: lit(f.start, f.end), n, timeout=window,
+                                      stop=lambda f: f.start is not None and f.start > t_off)
+            t_got = time.monotonic()
+        else:
+            if visible:
+                ir_led.off(); vis_led.on()
+            else:
+                vis_led.off(); ir_led.on()
+            t0 = time.monotonic()
+            frames = ring.wait_frames(lambda f: f.start is not None and f.start >= t0 + settle,
+                                      n, timeout=window)
+            t_got = time.monotonic()
+            if visible:
+                vis_led.off()
+            t_off = time.monotonic()
+    finally:
+        ring.disarm()
+    if not frames:
+        raise RuntimeError("ZSL: нет кадра в окне вспышки")
+    if len(frames) < min(n, ring.capacity or n):
+        print(f"Серия: со вспышкой {len(frames)} из {n} кадров (кадры потеряны)")
+
+    info = store_best(cam, [(f.array, f.metadata) for f in frames], path, ring.stream,
+                      encoder, keep_rest)
+    res = {"path": path, "t_light": t0, "t_capture": t_got, "t_saved": time.monotonic(),
+           "t_end": t_off, "metadata": frames[info["best"]].metadata,
+           "lag_saved_ms": max(0.0, (t0 + window / 2) - t_got) * 1000.0,
+           "synced": synced}
+    res.update(info)
+    return res
+
+
+def capture_ir_stack(cam, ir_led, vis_led, path, frames=8, ring=None, window=1.0, encoder=None):
+    """ИК-снимок стеком: frames кадров подряд при ИК-подсветке, совмещение и
+    усреднение (stacking.py) — в пуле encoder (место уже зарезервировано), без
+    него — здесь же. В path — стек, рядом <имя>_ref.jpg — опорный кадр.
+    stack в результате — Future пула (результат — info stacking) или сам info."""
+    import stacking
+    vis_led.off(); ir_led.on()
+    n = max(2, frames)
+    t0 = time.monotonic()
+    if ring is not None:
+        ring.arm(_after(t0))
+        try:
+            got = ring.wait_frames(lambda f: f.start is not None and f.start >= t0, n,
+                                   timeout=window + 0.1 * n)
+        finally:
+            ring.disarm()
+        items = [(f.array, f.metadata) for f in got]
+        stream = ring.stream
+    else:
+        items, stream = [], "main"
+        for _ in range(n):
+            req = cam.capture_request()
+            try:
+                items.append((req.make_array("main"), req.get_metadata() or {}))
+            finally:
+                req.release()
+    if len(items) < 2:
+        raise RuntimeError("ИК-стек: мало кадров")
+    t_got = time.monotonic()
+    fmt, width = _stream_format(cam, stream)
+    arrays = [a for a, _ in items]
+    if encoder is not None:
+        stack = encoder.submit_call(stacking.stack_and_save,
+                                    (arrays, fmt, width, path, encoder.quality), path)
+    else:
+        with tracing.span("stack"):
+            stack = stacking.stack_and_save(arrays, fmt, width, path)
+    return {"path": path, "t_light": t0, "t_capture": t_got, "t_saved": time.monotonic(),
+            "t_end": t_got, "metadata": items[len(items) // 2][1], "frames": len(items),
+            "stack": stack}
+
+
+def pair_paths(path):
+    """Пути пары по общему имени path: <имя>_ir<ext>, <имя>_vis<ext>, <имя>.json."""
+    stem, ext = os.path.splitext(path)
+    return stem + "_ir" + ext, stem + "_vis" + ext, stem + ".json"
+
+
+def _sensor_seq(frame):
+    """Номер кадра сенсора (SensorSequence; без него — номер кадра в FrameRing)."""
+    seq = frame.metadata.get("SensorSequence")
+    return frame.seq if seq is None else seq
+
+
+def capture_pair(cam, ring, ir_led, vis_led, path, pump, window=1.0, encoder=None,
+                 burst=1, keep_rest=False, retries=0):
+    """Пара ИК + VIS одной последовательностью (3A уже зафиксирована один раз).
+    ИК горит на кадр перед вспышкой и гаснет на той же границе кадра, где
+    загорается VIS (frame_flash(off=ir_led)). VIS — первый кадр вспышки,
+    ИК — кадр сенсора прямо перед ним (номера кадров соседние, проверяется по
+    SensorSequence); глаз между ними почти не смещается. Кадр потерян —
+    RuntimeError, пара не пишется: повторная вспышка в глаз — только если
+    вызывающий явно разрешил (retries > 0).
+    Буфер взводится до вспышки, а кадр перед ней начинается не раньше этого
+    (frame_flash(after=)), — ИК-кадр гарантированно попадает в буфер.
+    burst > 1 — вспышка на burst кадров; остальные кадры вспышки пишутся
+    только при keep_rest (<имя>_vis_b<N>), в пару идёт первый.
+    encoder — EncodeQueue с двумя зарезервированными местами. Рядом пишется
+    <имя>.json: оба файла, SensorTimestamp, номера и окна экспозиции кадров.
+    Возвращает результат как у flash_and_capture (metadata — VIS) и
+    path_ir, metadata_ir, gap_ms (от конца экспозиции ИК до начала VIS)."""
+    if pump is None:
+        raise RuntimeError("Пара: нужен MetadataPump (вспышка по границам кадров)")
+    path_ir, path_vis, path_json = pair_paths(path)
+    n = max(1, burst)
+    frames, ir = [], None
+    for attempt in range(retries + 1):
+        if attempt:
+            print("Пара: кадр потерян, повтор вспышки")
+        vis_led.off(); ir_led.on()
+        t_arm = time.monotonic()
+        ring.arm(_after(t_arm))
+        try:
+            t0, t_off = frame_flash(vis_led, pump, n, timeout=window, off=ir_led, after=t_arm,
+                                    plan=_plan(ring, before=1))
+            lit = _lit(t0, t_off, readout_time(pump.latest()[1]))
+            frames = ring.wait_frames(lambda f: lit(f.start, f.end), n, timeout=window,
+                                      stop=lambda f: f.start is not None and f.start > t_off)
+            t_got = time.monotonic()
+            # ИК-кадр — по номеру, когда кадры вспышки уже пришли (кадры приходят по порядку)
+            ir = None
+            if frames:
+                want = _sensor_seq(frames[0]) - 1
+                ir = next((f for f in ring.frames() if _sensor_seq(f) == want and f.start is not None
+                           and f.start >= t_arm), None)
+        finally:
+            ring.disarm()
+        if frames and ir is not None:
+            break
+    if not frames:
+        raise RuntimeError("Пара: нет кадра со вспышкой")
+    if ir is None:
+        raise RuntimeError("Пара: нет ИК-кадра прямо перед вспышкой (кадр потерян)")
+    vis = frames[0]
+
+    info = store_best(cam, [(vis.array, vis.metadata)], path_vis, ring.stream, encoder)
+    _put(cam, ir.array, path_ir, ring.stream, ir.metadata, encoder)
+    if keep_rest:
+        stem, ext = os.path.splitext(path_vis)
+        for i, f in enumerate(frames[1:], 2):
+            if encoder is not None and not encoder.reserve():
+                print("Пара: очередь записи полна, остальные кадры вспышки пропущены"); break
+            _put(cam, f.array, f"{stem}_b{i}{ext}", ring.stream, f.metadata, encoder)
+    gap_ms = (vis.start - ir.end) * 1000.0   # < 0 — экспозиции стыкуются без зазора
+    with open(path_json, "w") as f:
+        json.dump({"ir": {"path": os.path.basename(path_ir), "seq": _sensor_seq(ir),
+                          "sensor_timestamp": ir.metadata.get("SensorTimestamp"),
+                          "exposure": [ir.start, ir.end]},
+                   "vis": {"path": os.path.basename(path_vis), "seq": _sensor_seq(vis),
+                           "sensor_timestamp": vis.metadata.get("SensorTimestamp"),
+                           "exposure": [vis.start, vis.end]},
+                   "gap_ms": gap_ms, "flash": [t0, t_off]}, f, indent=1)
+    res = {"path": path_vis, "path_ir": path_ir, "path_json": path_json,
+           "t_light": t0, "t_capture": t_got, "t_saved": time.monotonic(), "t_end": t_off,
+           "metadata": vis.metadata, "metadata_ir": ir.metadata, "gap_ms": gap_ms, "synced": True}
+    res.update(info)
+    return res
@@ -0,0 +1,822 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Логика камеры без UI: свет, зум/фокус/AF, предпросмотр, съёмка, запись.
+
+CameraController используется и Tk-интерфейсом (fundus.py), и
+безголовым режимом (headless.py). О переменах он сообщает через
+колбэки on_status/on_toast/on_zoom/on_focus — их вызывают из любых
+потоков, UI сам решает, как показывать.
+
+Железо (камера, GPIO) открывается не в конструкторе, а в open() или
+в фоне через warm_up(), пока UI показывает стартовый экран. Базовый
+ScalerCrop (1×) кэшируется в ~/.cache/fundus по режиму сенсора, там же —
+таблица экспозиции вспышки (flashcal.py, calibrate_flash).
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from time import sleep
+
+import camera_backend
+import capture
+import flashcal
+import tracing
+from autofocus import ContrastAF
+from frame_ring import FrameRing
+from metadata import MetadataPump
+from scheduler import CameraScheduler
+from sessions import SessionStore
+from storage import EncodeQueue
+from preview import PreviewPipeline, lores_size
+from recorder import VideoRecorder
+
+# ====== ПИНЫ СВЕТА (опционально) ======
+IR_GPIO  = 17     # ИК-подсветка
+VIS_GPIO = 27     # видимый свет/вспышка
+ACTIVE_HIGH = True
+
+# ====== ПАРАМЕТРЫ ======
+VISIBLE_WINDOW = 1.0       # сек; предел ожидания кадра со вспышкой (сама вспышка — по границам кадров)
+FOCUS_MIN, FOCUS_MAX = 0.0, 10.0
+INITIAL_FOCUS = 5.0
+ZOOM_MIN, ZOOM_MAX   = 1.0, 8.0     # допустимый диапазон зума
+INITIAL_ZOOM         = 4.0          # стартуем с честного 4× от базового окна
+STEP = 0.1  # шаг зума/фокуса на одно нажатие
+REPEAT_GAP = 0.2            # сек; нажатия чаще — автоповтор: шаг растёт
+REPEAT_ACCEL = 1.15         # множитель шага на каждый повтор подряд
+ZOOM_STEP_MAX = 0.8         # предел шага зума при автоповторе (1×–8× за ~0.6 с)
+FOCUS_STEP_MAX = 0.4        # предел шага фокуса при автоповторе
+SOFT_AF_BUDGET = 0.8        # сек; бюджет программного AF по контрасту (линза без AfMode)
+PREVIEW_MAIN = (1280, 720)  # основной поток; предпросмотр идёт с lores под размер окна
+ZSL_ENABLED = True          # снимок из буфера кадров, вспышка гаснет сразу после кадра
+ZSL_MAX_MB  = 64            # предел памяти буфера кадров ZSL
+BURST_FRAMES = 3            # кадров в серии на снимок; сохраняется самый резкий
+BURST_KEEP_ALL = False      # сохранять и остальные кадры серии (_b2, _b3, …)
+RAW_CAPTURE = False         # снимки сырыми .npy (rawfile.py), проявка потом — develop.py
+IR_STACK_FRAMES = 1         # ИК-снимок — стек стольких кадров (stacking.py); 1 — одиночный кадр
+VIDEO_FPS = 15.0            # кадров/с в видео обследования (MJPEG с потока предпросмотра)
+VIDEO_PREROLL = 3.0         # сек предзаписи: ролик начинается раньше нажатия
+VIDEO_QUALITY = 80          # качество JPEG кадров видео
+FLASH_CAL_ZOOMS = (1.0, 2.0, 4.0, 8.0)   # точки зума калибровки вспышки; между ними — интерполяция
+ENCODE_WORKERS = 2          # процессов кодирования JPEG
+ENCODE_QUEUE   = 4          # снимков в очереди на запись; больше — «подождите»
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "fundus")
+
+
+def _even(x):
+    return int(x) & ~1  # ScalerCrop любит чётные значения
+
+
+def _nothing(*args):
+    pass
+
+
+class KeyRepeat:
+    """Ускорение автоповтора клавиш: одно нажатие — базовый шаг, каждое
+    следующее той же клавиши не позже gap — шаг × accel, до предела."""
+
+    def __init__(self, gap=REPEAT_GAP, accel=REPEAT_ACCEL):
+        self.gap = gap
+        self.accel = accel
+        self._key, self._t, self._n = None, 0.0, 0
+
+    def step(self, key, base, limit):
+        now = time.monotonic()
+        self._n = self._n + 1 if key == self._key and now - self._t <= self.gap else 0
+        self._key, self._t = key, now
+        return min(limit, base * self.accel ** self._n)
+
+
+class CameraController:
+    """Камера, свет и всё состояние съёмки.
+
+    Создавайте до запуска Tk/HTTP-сервера: процесс захвата (proc:…) и пул
+    кодирования стартуют fork'ом первыми, пока в процессе нет лишних потоков. Камера и GPIO — позже, в
+    open()/warm_up(). camera — вид камеры для camera_backend.open_camera
+    (None — из FUNDUS_CAMERA).
+    """
+
+    def __init__(self, camera=None, save_dir=None):
+        self.on_status = print
+        self.on_toast = _nothing
+        self.on_zoom = _nothing      # on_zoom("4.0x")
+        self.on_focus = _nothing     # on_focus("auto: 5.00")
+        self.timings = {}            # засечки запуска, мс (mark)
+
+        # железо — в open(); процесс захвата (proc:…) — fork'ом первым, пока нет
+        # потоков (у пула кодирования после start() уже есть поток управления)
+        self.camera = camera
+        kind = camera or os.environ.get("FUNDUS_CAMERA", "picamera2")
+        if kind.startswith("proc"):
+            camera_backend.shared_camera(kind)
+
+        # ====== ЗАПИСЬ ======
+        self.encode_queue = EncodeQueue(ENCODE_WORKERS, ENCODE_QUEUE, on_done=self._on_photo_saved)
+        self.encode_queue.start()
+        self.cam = None
+        self.ir_led = self.vis_led = self.Button = None
+        self.has_lenspos = self.af_available = False
+        self.meta_pump = self.sched = self.zsl_ring = None
+        self.preview_config = None
+        self.streaming = False        # камера запущена (прогрев или предпросмотр)
+        self._hw_lock = threading.Lock()
+        self._warm = None
+
+        # состояния
+        self.zoom_factor = INITIAL_ZOOM
+        self.focus_position = INITIAL_FOCUS
+        self.last_auto_focus_position = None
+        self.af_mode = "manual"
+        self.save_dir = save_dir or os.path.expanduser("~/Pictures")
+        self.running_preview = False
+        self._capturing = 0    # съёмок/калибровок идёт или ждёт камеру (capturing)
+        self._capturing_lock = threading.Lock()
+        self.peaking = False
+        self.raw = RAW_CAPTURE
+        self.repeat = KeyRepeat()
+        self.crop = None       # последний заданный ScalerCrop
+        self.base_crop = None  # (x0, y0, w, h) — принятое за 1×
+        self.pipeline = None   # PreviewPipeline, пока идёт предпросмотр
+        self.recorder = None   # VideoRecorder, пока идёт предпросмотр (предзапись)
+        self.last_stack = None # info последнего ИК-стека (stacking.stack_frames)
+        self.last_exposure = None  # проверка экспозиции последнего снимка (imaging.exposure_check)
+        self.flash_table = flashcal.FlashTable(os.path.join(CACHE_DIR, "flash_exposure.json"))
+        self.store = None      # SessionStore для текущей папки сохранения
+        self._soft_af_busy = threading.Lock()   # держит идущий программный AF
+        self._cal_busy = threading.Lock()       # держит идущая калибровка вспышки
+
+    # ====== ЗАПУСК ======
+    def mark(self, name, since):
+        """Засечка запуска: мс от since (time.monotonic()) — в timings и в консоль."""
+        ms = (time.monotonic() - since) * 1000.0
+        self.timings[name] = ms
+        print(f"Старт: {name} {ms:.0f} мс")
+        return ms
+
+    def open(self):
+        """Открыть свет и камеру (один раз; можно из любого потока)."""
+        with self._hw_lock:
+            if self.cam is not None: return
+            t0 = time.monotonic()
+            # Без gpiozero свет и кнопки — заглушки.
+            ir_led, vis_led, self.Button = camera_backend.open_lights(
+                IR_GPIO, VIS_GPIO, ACTIVE_HIGH, kind=self.camera)
+            cam = camera_backend.open_camera(self.camera, lights=(ir_led, vis_led))
+
+            controls = getattr(cam, "camera_controls", {})
+            self.has_lenspos = "LensPosition" in controls
+            self.af_available = any(k in controls for k in ("AfMode", "AfTrigger"))
+
+            # метаданные каждого кадра — один подписчик на всех
+            self.meta_pump = MetadataPump(cam)
+            self.meta_pump.start()
+            # все записи управления (зум/фокус/AF) — через планировщик, не чаще раза за кадр
+            self.sched = CameraScheduler(cam)
+            self.sched.start()
+            # ёмкость — на самую длинную серию (стек ИК, серия VIS, пара), иначе wait_frames её урежет
+            self.zsl_ring = FrameRing(cam, "main", max_bytes=ZSL_MAX_MB << 20,
+                                      max_frames=max(IR_STACK_FRAMES, BURST_FRAMES) + 2)
+            self.zsl_ring.start()
+            self.ir_led, self.vis_led = ir_led, vis_led
+            self.cam = cam
+            self.mark("open_ms", t0)
+
+    def warm_up(self, box=(800, 440), on_ready=None):
+        """В фоне: open(), конфигурация предпросмотра под box, старт потока
+        кадров (AE/AWB сходятся заранее) и базовый кроп. Свет не включается.
+        on_ready() — из фонового потока, когда всё готово."""
+        if self._warm is not None: return
+        def worker():
+            t0 = time.monotonic()
+            try:
+                self.open()
+                self._stream(box)
+                self.mark("warm_up_ms", t0)
+            except Exception as e:
+                self.on_status(f"Ошибка камеры: {e}")
+            if on_ready is not None:
+                try: on_ready()
+                except Exception as e: print("on_ready error:", e)
+        self._warm = threading.Thread(target=worker, daemon=True)
+        self._warm.start()
+
+    def wait_ready(self, timeout=10.0):
+        """Дождаться прогрева (если шёл) и открыть железо, если ещё не открыто."""
+        t = self._warm
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout)
+        self.open()
+
+    def _stream(self, box):
+        """Камера запущена с lores под box; перенастраивается только при смене размера."""
+        box_w, box_h = box
+        if box_w < 100 or box_h < 100:
+            box_w, box_h = 800, 440
+        lores = lores_size(box_w, box_h, PREVIEW_MAIN)
+        cur = (self.preview_config or {}).get("lores") or {}
+        if self.streaming and tuple(cur.get("size") or ()) == tuple(lores):
+            return False
+        if self.streaming:
+            self.cam.stop()
+            self.streaming = False
+        self.preview_config = self.cam.create_preview_configuration(
+            main={"size": PREVIEW_MAIN}, lores={"size": lores, "format": "YUV420"})
+        self.cam.configure(self.preview_config)
+        self.cam.start()
+        self.streaming = True
+        self.init_base_crop()   # база = 1×
+        return True
+
+    # ====== ВСПОМОГАТЕЛЬНОЕ ======
+    def update_focus_label(self):
+        lp = self.meta_pump.get("LensPosition")  # без ожидания кадра
+        if self.af_mode == "auto":
+            self.on_focus(f"auto: {lp:.2f}" if lp is not None else "auto")
+        else:
+            self.on_focus(f"{self.focus_position:.2f}" if self.has_lenspos else "нет")
+
+    def _mode_key(self):
+        """Режим сенсора: модель, выход сенсора и размер main (от них зависит 1×)."""
+        cfg = self.cam.camera_configuration() or {}
+        sensor = cfg.get("sensor") or {}
+        props = getattr(self.cam, "camera_properties", None) or {}
+        model = props.get("Model") or type(self.cam).__name__
+        return (f"{model}:{list(sensor.get('output_size') or ())}:{sensor.get('bit_depth')}"
+                f":{list((cfg.get('main') or {}).get('size') or ())}")
+
+    def _crop_cache(self, key, crop=None):
+        """Базовый кроп из кэша (crop=None) или записать crop в кэш."""
+        path = os.path.join(CACHE_DIR, "base_crop.json")
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+        except Exception:
+            cache = {}
+        if crop is None:
+            got = cache.get(key)
+            return tuple(got) if got and len(got) == 4 else None
+        cache[key] = list(crop)
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".part", "w") as f:
+                json.dump(cache, f)
+            os.replace(path + ".part", path)
+        except Exception as e:
+            print("Crop cache error:", e)
+
+    def init_base_crop(self, retries=8, timeout=0.5):
+        """Стартовый ScalerCrop — за 1×: из кэша по режиму сенсора, иначе
+        из метаданных первого кадра (и в кэш на следующий запуск)."""
+        self.base_crop = None
+        key = self._mode_key()
+        cached = self._crop_cache(key)
+        if cached is not None:
+            self.base_crop = cached
+            return
+        seq = self.meta_pump.latest()[0]
+        for _ in range(retries):
+            got = self.meta_pump.wait_after(seq, timeout)   # первый кадр после seq
+            if got is None:
+                continue
+            seq, meta = got
+            sc = meta.get("ScalerCrop")
+            if sc and len(sc) == 4 and sc[2] > 0 and sc[3] > 0:
+                self.base_crop = (_even(sc[0]), _even(sc[1]), _even(sc[2]), _even(sc[3]))
+                self._crop_cache(key, self.base_crop)
+                break
+        # фоллбэк — от конфигурации
+        if self.base_crop is None:
+            try:
+                w, h = self.cam.camera_configuration()["main"]["size"]
+                self.base_crop = (0, 0, _even(w), _even(h))
+            except Exception:
+                self.base_crop = (0, 0, 1280, 720)
+
+    def open_store(self, save_dir=None):
+        """Индекс снимков для папки сохранения (открывается один раз на папку)."""
+        if save_dir:
+            self.save_dir = save_dir
+        if self.store is not None and self.store.save_dir == self.save_dir:
+            return self.store
+        if self.store is not None:
+            self.store.close()
+        self.store = SessionStore(self.save_dir)
+        self.store.start()
+        return self.store
+
+    # ====== АВТОФОКУС/РУЧНОЙ ======
+    def enable_autofocus(self):
+        """GPIO16 / Кнопка: включить автофокус."""
+        if not self.af_available:
+            if self.has_lenspos: self.run_soft_autofocus()
+            else: self.on_status("AF недоступен на этой камере")
+            return
+        try:
+            # зовётся из потока шины ввода: идёт съёмка — не ждём её, AfMode
+            # встаёт в очередь (триггеры очередь слила бы — их пропускаем)
+            now = False
+            try: now = self.sched.apply_now({"AfMode": 2}, wait=False)  # Continuous
+            except Exception: pass
+            try:
+                # триггеры не сливаем — по одной записи на каждый
+                if now and self.sched.apply_now({"AfTrigger": 0}, wait=False):
+                    self.sched.apply_now({"AfTrigger": 1}, wait=False)
+            except Exception: pass
+            self.af_mode = "auto"
+            self.on_status("Автофокус: ВКЛ")
+            def read_af_pos():
+                sleep(0.2)
+                lp = self.meta_pump.get("LensPosition")
+                if lp is not None: self.last_auto_focus_position = lp
+                self.update_focus_label()
+            threading.Thread(target=read_af_pos, daemon=True).start()
+        except Exception as e:
+            self.on_status(f"AF ошибка: {e}")
+
+    def run_soft_autofocus(self, wait=False):
+        """Программный AF по контрасту (autofocus.py) — для линз без AfMode.
+        Однократный поиск; линза остаётся в ручном режиме.
+        wait=True — в текущем потоке, возвращает результат ContrastAF.run()."""
+        if not self._soft_af_busy.acquire(blocking=False): return None
+        self.on_status("Автофокус по контрасту…")
+        result = {}
+        def worker():
+            try:
+                with self.sched.exclusive():
+                    res = ContrastAF(self.cam, "lores", FOCUS_MIN, FOCUS_MAX,
+                                     budget=SOFT_AF_BUDGET).run()
+                result.update(res)
+                self.focus_position = res["position"]
+                self.on_status(f"Фокус {res['position']:.2f} за {res['seconds'] * 1000:.0f} мс")
+            except Exception as e:
+                self.on_status(f"AF ошибка: {e}")
+            finally:
+                self._soft_af_busy.release()
+                self.update_focus_label()
+        if wait:
+            worker()
+            return result or None
+        threading.Thread(target=worker, daemon=True).start()
+        return None
+
+    def switch_to_manual_from_current(self):
+        """Перейти в ручной, стартуя с текущего авто-значения."""
+        lp = self.meta_pump.get("LensPosition")
+        if lp is not None: self.last_auto_focus_position = lp
+        if self.last_auto_focus_position is not None:
+            self.focus_position = self.last_auto_focus_position
+        try:
+            ctrls = {}
+            if self.af_available:
+                ctrls["AfMode"] = 0  # Manual
+            if self.has_lenspos:
+                ctrls["LensPosition"] = self.focus_position
+            if ctrls:
+                self.sched.set(ctrls)
+        except Exception:
+            pass
+        self.af_mode = "manual"
+        self.update_focus_label()
+        self.on_status("Фокус: РУЧНОЙ")
+
+    # ====== КАМЕРА/СВЕТ ======
+    def apply_zoom(self):
+        """Цифровой зум относительно стартового поля (base_crop = 1×)."""
+        if self.base_crop is None:
+            self.init_base_crop()
+
+        self.zoom_factor = max(ZOOM_MIN, min(self.zoom_factor, ZOOM_MAX))
+        bx, by, bw, bh = self.base_crop
+
+        try:
+            crop_w = max(16, _even(bw / self.zoom_factor))
+            crop_h = max(16, _even(bh / self.zoom_factor))
+            x0 = _even(bx + (bw - crop_w) / 2)
+            y0 = _even(by + (bh - crop_h) / 2)
+
+            self.crop = (x0, y0, crop_w, crop_h)
+            self.sched.set({"ScalerCrop": self.crop})
+            if self.pipeline is not None:
+                self.pipeline.set_crop(self.crop)   # предпросмотр — сразу, программно
+
+            # Фактический зум относительно базы
+            eff_zoom = bw / float(crop_w) if crop_w else self.zoom_factor
+            self.on_zoom(f"{eff_zoom:.1f}x")
+        except Exception as e:
+            print("Zoom error:", e)
+            self.on_zoom(f"{self.zoom_factor:.1f}x")
+
+    def apply_focus(self):
+        if self.af_mode == "auto":
+            self.update_focus_label(); return
+        if not self.has_lenspos:
+            self.on_focus("нет"); return
+        self.focus_position = max(FOCUS_MIN, min(self.focus_position, FOCUS_MAX))
+        self.sched.set({"LensPosition": self.focus_position})
+        self.update_focus_label()
+
+    def start_preview(self, box=(800, 440)):
+        """Старт предпросмотра (lores под размер box), сразу AF. Если камера
+        уже прогрета под этот размер — без перенастройки и повторного старта."""
+        self.wait_ready()
+        if self.running_preview:
+            self.pipeline.stop()
+        box_w, box_h = box
+        if box_w < 100 or box_h < 100:
+            box_w, box_h = 800, 440
+        self._stream((box_w, box_h))
+        self.zoom_factor = INITIAL_ZOOM
+        self.focus_position = INITIAL_FOCUS
+        self.running_preview = True
+        self.ir_led.on(); self.vis_led.off()
+
+        self.apply_zoom()       # сразу выставим INITIAL_ZOOM честно
+        self.enable_autofocus()
+
+        self.pipeline = PreviewPipeline(self.cam, "lores", paused=lambda: self.capturing)
+        self.pipeline.peaking = self.peaking
+        self.pipeline.set_box(box_w, box_h)
+        self.pipeline.set_crop(self.crop)   # первые кадры со старым полем — тоже кадрируются
+        self.pipeline.start()
+        if self.recorder is None:
+            self.recorder = VideoRecorder(self.cam, "lores", VIDEO_FPS, VIDEO_PREROLL, VIDEO_QUALITY,
+                                          on_saved=self._on_video_saved)
+            self.recorder.start()   # предзапись идёт всё время предпросмотра
+        self.on_status("Предпросмотр включён (AF)")
+
+    def stop_preview(self):
+        self.running_preview = False
+        if self.recorder is not None:
+            self.recorder.stop()    # идущая запись дописывается
+            self.recorder = None
+        if self.pipeline is not None: self.pipeline.stop()
+        if self.cam is None: return
+        try: self.cam.stop()
+        except Exception: pass
+        self.streaming = False
+        self.ir_led.off(); self.vis_led.off()
+        self.on_status("Предпросмотр остановлен")
+
+    def set_peaking(self, on):
+        self.peaking = bool(on)
+        if self.pipeline is not None:
+            self.pipeline.peaking = self.peaking
+
+    def set_raw(self, on):
+        """Сырые снимки (.npy + .json, без JPEG в окне съёмки). ИК-стек
+        по-прежнему пишется JPEG — он уже обработан."""
+        self.raw = bool(on)
+        self.on_status("Сырые снимки: ВКЛ (develop.py — проявка)" if self.raw else "Сырые снимки: ВЫКЛ")
+
+    # ====== ФОТО ======
+    def _on_photo_saved(self, path, err, dt):
+        """Снимок записан пулом кодирования (вызывается из служебного потока)."""
+        if self.store is not None:
+            self.store.saved(path, err)   # индекс + миниатюра в фоне
+        if err is not None:
+            self.on_status(f"Ошибка сохранения: {err}")
+            self.on_toast("Ошибка сохранения"); return
+        st = self.encode_queue.stats()
+        self.on_status(f"Сохранено: {path} ({dt * 1000:.0f} мс, в очереди {st['queue_depth']})")
+        self.on_toast("Фото сохранено")
+
+    def _on_stack_done(self, fut, frames):
+        """ИК-стек готов (служебный поток пула): кадры в стеке, выигрыш SNR, время."""
+        try:
+            info = fut.result()
+        except Exception:
+            return   # ошибку уже показал _on_photo_saved
+        self.last_stack = info
+        msg = (f"ИК-стек: {info['used']}/{frames} кадров, SNR ×{info['snr_gain']:.2f}, "
+               f"{info['stack_seconds'] * 1000:.0f} мс")
+        self.on_status(msg)
+
+    @property
+    def capturing(self):
+        """Идёт съёмка/калибровка или ждёт камеру (предпросмотр на паузе)."""
+        return self._capturing > 0
+
+    @contextmanager
+    def _busy(self):
+        """Счётчик capturing: снимок, вставший в очередь за другим, не сбрасывается его finally."""
+        with self._capturing_lock:
+            self._capturing += 1
+        try:
+            yield
+        finally:
+            with self._capturing_lock:
+                self._capturing -= 1
+
+    def _photo_worker(self, visible, pair=False):
+        """Общий поток съёмки для VIS, ИК и пары ИК + VIS (см. capture.py).
+        Возвращает результат съёмки (path, metadata, …) или None."""
+        # место в очереди записи — до вспышки, чтобы не светить впустую
+        slots = 2 if pair else 1
+        for i in range(slots):
+            if not self.encode_queue.reserve():
+                for _ in range(i): self.encode_queue.cancel()
+                self.on_status("Очередь сохранения заполнена — подождите")
+                self.on_toast("Подождите"); return None
+        prev_af_mode = self.af_mode
+        lock = None
+        queued = False
+        res = None
+        what = "Пара ИК + VIS" if pair else "Фото" if visible else "ИК фото"
+        # камера целиком наша: зум/фокус с клавиш копятся и применятся после
+        with self._busy(), self.sched.exclusive():
+            try:
+                # 1) зафиксировать автоэкспозицию/баланс и фокус; для вспышки VIS —
+                # экспозиция из калибровки (AE меряет ИК). Пара — тоже: оба кадра под
+                # одной фиксацией, соседние кадры сенсора экспозицию между собой не меняют
+                flash = self.flash_table.get(self._mode_key(), self.zoom_factor) if visible else None
+                lock = capture.lock_3a(self.cam, self.af_available, self.has_lenspos,
+                                       self.meta_pump, self.sched, flash)
+                if lock["lens"] is not None:
+                    self.last_auto_focus_position = lock["lens"]
+                if lock["frozen"]:
+                    self.af_mode = "manual"
+                    self.focus_position = lock["lens"]
+
+                # 2) свет и 3) сохранить кадр в середине окна
+                stack = not visible and not pair and IR_STACK_FRAMES > 1
+                ext = ".npy" if self.raw and not stack else ".jpg"
+                if pair:
+                    path = capture.photo_path(self.save_dir, "Пары", "fundus_pair", ext)
+                elif visible:
+                    path = capture.photo_path(self.save_dir, "Видимый", "fundus", ext)
+                else:
+                    path = capture.photo_path(self.save_dir, "ИК", "fundus_ir", ext)
+                if pair:
+                    res = capture.capture_pair(self.cam, self.zsl_ring, self.ir_led, self.vis_led, path,
+                                               self.meta_pump, window=VISIBLE_WINDOW,
+                                               encoder=self.encode_queue,
+                                               burst=BURST_FRAMES if BURST_KEEP_ALL else 1,
+                                               keep_rest=BURST_KEEP_ALL)   # в пару — кадр рядом с ИК
+                    path = res["path"]
+                elif stack:
+                    res = capture.capture_ir_stack(self.cam, self.ir_led, self.vis_led, path,
+                                                   IR_STACK_FRAMES, self.zsl_ring if ZSL_ENABLED else None,
+                                                   VISIBLE_WINDOW, self.encode_queue)
+                    res["stack"].add_done_callback(lambda f, n=res["frames"]: self._on_stack_done(f, n))
+                elif ZSL_ENABLED:
+                    res = capture.flash_and_capture_zsl(self.cam, self.zsl_ring, self.ir_led, self.vis_led,
+                                                        path, visible=visible, window=VISIBLE_WINDOW,
+                                                        encoder=self.encode_queue, burst=BURST_FRAMES,
+                                                        keep_rest=BURST_KEEP_ALL, pump=self.meta_pump)
+                else:
+                    res = capture.flash_and_capture(self.cam, self.ir_led, self.vis_led, path,
+                                                    visible=visible, window=VISIBLE_WINDOW,
+                                                    encoder=self.encode_queue, burst=BURST_FRAMES,
+                                                    keep_rest=BURST_KEEP_ALL, pump=self.meta_pump)
+                queued = True
+                self.on_status(f"{what}: снято, сохраняется…")
+                self._check_exposure(what, res.get("exposure"), flash)
+                if self.store is not None:
+                    scores = res.get("scores")
+                    try:
+                        ir_id = None
+                        if pair:
+                            ir_id = self.store.add(res["path_ir"], "IR", res["metadata_ir"], self.zoom_factor)
+                        self.store.add(path, "VIS" if visible or pair else "IR", res.get("metadata"),
+                                       self.zoom_factor,
+                                       scores[res["best"]]["sharpness"] if scores else None, pair=ir_id)
+                    except Exception as e:
+                        print("Index error:", e)
+
+            except Exception as e:
+                if not queued:
+                    for _ in range(slots): self.encode_queue.cancel()
+                err = "Ошибка пары" if pair else "Ошибка фото" if visible else "Ошибка ИК-фото"
+                self.on_status(f"{err}: {e}")
+                self.on_toast(err)
+                res = None
+            finally:
+                # 4) вернуть как было: выключить VIS, включить IR, AE/AWB и AF назад
+                self.vis_led.off(); self.ir_led.on()
+                if lock is not None:
+                    if capture.restore_3a(self.cam, lock,
+                                          self.af_available and prev_af_mode == "auto", self.sched):
+                        self.af_mode = "auto"
+        return res
+
+    def _check_exposure(self, what, check, flash):
+        """Сразу после съёмки: пересвет/недодержка по гистограмме — в статус и тост."""
+        if not check: return
+        self.last_exposure = dict(check, exposure_source="flash_table" if flash else "ae")
+        if check["verdict"] == "ok": return
+        hint = "" if flash or not what.startswith("Фото") else " — откалибруйте вспышку (C)"
+        if check["verdict"] == "over":
+            self.on_status(f"{what}: пересвет {check['clipped'] * 100:.0f}%{hint}")
+            self.on_toast("Пересвет")
+        else:
+            self.on_status(f"{what}: недодержка, p99 {check['p99']}{hint}")
+            self.on_toast("Недодержка")
+
+    def take_photo(self, visible=True, wait=False):
+        """Фото с видимой вспышкой (visible) или в ИК.
+           VIS: временно выключаем IR, вспышка на экспозицию кадра, снимаем,
+           возвращаемся в исходное состояние (IR on, AF/AE/AWB назад).
+           ИК: видимый свет не включаем, IR остаётся; папка Fundus/ИК.
+        wait=True — снять в текущем потоке и вернуть результат."""
+        if wait:
+            return self._photo_worker(visible)
+        threading.Thread(target=self._photo_worker, args=(visible,), daemon=True).start()
+        return None
+
+    def take_pair(self, wait=False):
+        """Пара ИК + VIS одной последовательностью: одна фиксация 3A, ИК-кадр
+        прямо перед вспышкой, VIS — во вспышке; файлы связаны (capture.capture_pair,
+        индекс — pair). Папка Fundus/Пары."""
+        if wait:
+            return self._photo_worker(True, pair=True)
+        threading.Thread(target=self._photo_worker, args=(True, True), daemon=True).start()
+        return None
+
+    # ====== КАЛИБРОВКА ВСПЫШКИ ======
+    def _zoom_ctrls(self, z):
+        """Зум z (очередь планировщика) и его ScalerCrop — для транзакции калибровки."""
+        self.zoom_factor = z
+        self.apply_zoom()
+        return {"ScalerCrop": self.crop} if self.crop else {}
+
+    def calibrate_flash(self, zooms=FLASH_CAL_ZOOMS, wait=False):
+        """Калибровка экспозиции вспышки VIS (flashcal.py) по точкам зума
+        zooms для текущего режима сенсора — на модели глаза или мишени, не на
+        пациенте: несколько пробных вспышек на точку. Камера — монопольно,
+        предпросмотр на паузе; зум и AE потом — как были. Таблица — в кэше,
+        take_photo берёт из неё экспозицию вспышки.
+        wait=True — в текущем потоке, возвращает результаты по зумам."""
+        if not self.running_preview:
+            self.on_status("Калибровка: предпросмотр не запущен"); return None
+        if not self._cal_busy.acquire(blocking=False): return None
+        self.on_status("Калибровка вспышки…")
+        result = []
+        def worker():
+            zoom0 = self.zoom_factor
+            try:
+                with self._busy(), self.sched.exclusive():
+                    mode = self._mode_key()
+                    start = self.flash_table.get(mode, zooms[0]) or self.meta_pump.latest()[1] or {}
+                    try:
+                        res = flashcal.calibrate(
+                            self.cam, self.sched, self.meta_pump, self.zsl_ring, self.ir_led, self.vis_led,
+                            self.flash_table, mode, zooms, self._zoom_ctrls,
+                            (start.get("ExposureTime") or 10000, start.get("AnalogueGain") or 1.0),
+                            window=VISIBLE_WINDOW,
+                            on_step=lambda z, i, c: self.on_status(
+                                f"Калибровка {z:.1f}x: вспышка {i + 1}, p99 {c['p99']}"))
+                    finally:
+                        self.vis_led.off(); self.ir_led.on()
+                        self.zoom_factor = zoom0
+                        self.apply_zoom()
+                        capture.restore_3a(self.cam, {"ae": True, "awb": True}, False, self.sched)
+                result.extend(res)
+                bad = [f"{r['zoom']:.1f}x" for r in res if not r["ok"]]
+                if bad:
+                    self.on_status(f"Калибровка: не сошлась на {', '.join(bad)}")
+                    self.on_toast("Калибровка неточна")
+                else:
+                    self.on_status(f"Калибровка вспышки: точек зума — {len(res)}")
+                    self.on_toast("Вспышка откалибрована")
+            except Exception as e:
+                self.on_status(f"Ошибка калибровки: {e}")
+                self.on_toast("Ошибка калибровки")
+            finally:
+                self._cal_busy.release()
+        if wait:
+            worker()
+            return result
+        threading.Thread(target=worker, daemon=True).start()
+        return None
+
+    # ====== ВИДЕО ======
+    def start_recording(self):
+        """Начать видео обследования (Fundus/Видео, .avi): в файл сначала идут
+        последние VIDEO_PREROLL с предзаписи, потом живые кадры."""
+        if self.recorder is None:
+            self.on_status("Видео: предпросмотр не запущен"); return None
+        if self.recorder.recording:
+            return self.recorder.path
+        path = capture.photo_path(self.save_dir, "Видео", "fundus_vid", ".avi")
+        self.recorder.record(path)
+        if self.store is not None:   # индекс открывает UI (open_store), не поток шины
+            self.store.add(path, "VIDEO", self.meta_pump.latest()[1], zoom=self.zoom_factor)
+        self.on_status(f"Запись видео: {path}")
+        self.on_toast("● Запись")
+        return path
+
+    def stop_recording(self):
+        """Закончить видео; сводка записи (кадры, пропуски, МБ/с) или None."""
+        if self.recorder is None or not self.recorder.recording:
+            return None
+        info = self.recorder.finish()
+        if info and info.get("pending"):
+            self.on_status(f"Видео: запись дописывается в фоне ({info['path']})")
+        elif info:
+            self.on_status(f"Видео: {info['frames']} кадров, {info['seconds']:.1f} с "
+                           f"(предзапись {info['preroll_seconds']:.1f} с), пропущено "
+                           f"{info['dropped_encode'] + info['dropped_write']}, "
+                           f"запись {info['write_mb_s']:.1f} МБ/с")
+        return info
+
+    def toggle_recording(self):
+        """Кнопка/клавиша видео: старт или стоп."""
+        if self.recorder is not None and self.recorder.recording:
+            return self.stop_recording()
+        return self.start_recording()
+
+    def _on_video_saved(self, path, err):
+        """Файл видео закрыт (поток записи): индекс + миниатюра (первый кадр)."""
+        if self.store is not None:
+            self.store.saved(path, err)
+        self.on_toast("Ошибка видео" if err is not None else "Видео сохранено")
+
+    # ====== УПРАВЛЕНИЕ (шаг 0.1, при автоповторе — с ускорением) ======
+    def zoom_in(self):
+        self.zoom_by(self.repeat.step("zoom+", STEP, ZOOM_STEP_MAX))
+
+    def zoom_out(self):
+        self.zoom_by(-self.repeat.step("zoom-", STEP, ZOOM_STEP_MAX))
+
+    def zoom_by(self, delta):
+        if self.af_mode == "auto": self.switch_to_manual_from_current()
+        self.zoom_factor += delta; self.apply_zoom()
+
+    def zoom_to(self, value):
+        self.zoom_by(float(value) - self.zoom_factor)
+
+    def focus_near(self):
+        self.focus_by(self.repeat.step("focus+", STEP, FOCUS_STEP_MAX))
+
+    def focus_far(self):
+        self.focus_by(-self.repeat.step("focus-", STEP, FOCUS_STEP_MAX))
+
+    def focus_by(self, delta):
+        if self.af_mode == "auto": self.switch_to_manual_from_current()
+        if not self.has_lenspos: self.on_status("Нет ручного фокуса"); return
+        self.focus_position += delta; self.apply_focus()
+
+    def focus_to(self, value):
+        if self.af_mode == "auto": self.switch_to_manual_from_current()
+        self.focus_by(float(value) - self.focus_position)
+
+    def reset_zoom_focus(self):
+        """GPIO20 / Pin38 — Сброс."""
+        self.zoom_factor, self.focus_position = INITIAL_ZOOM, INITIAL_FOCUS
+        self.af_mode = "manual"
+        if self.af_available:
+            self.sched.set({"AfMode": 0})   # очередью: поток шины не ждёт съёмку
+        self.apply_zoom(); self.apply_focus()
+        self.on_status("Сброс выполнен")
+        self.on_toast("Сброс")
+
+    def dump_trace(self):
+        """Засечки стадий (tracing) — в save_dir/Fundus/trace_<дата>.json. Путь."""
+        folder = os.path.join(self.save_dir, "Fundus")
+        os.makedirs(folder, exist_ok=True)
+        now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = tracing.dump(os.path.join(folder, f"trace_{now}.json"))
+        self.on_status(f"Трассировка: {path}")
+        return path
+
+    def state(self):
+        """Снимок состояния для API/отладки."""
+        out = {"preview": self.running_preview, "capturing": self.capturing, "raw": self.raw,
+               "zoom": round(self.zoom_factor, 2), "focus": round(self.focus_position, 3),
+               "af_mode": self.af_mode, "save_dir": self.save_dir,
+               "encode": self.encode_queue.stats(), "startup_ms": dict(self.timings)}
+        if self.cam is not None:
+            out["lens_position"] = self.meta_pump.get("LensPosition")
+            out["controls"] = self.sched.stats()
+            out["flash_table"] = dict(self.flash_table.entries.get(self._mode_key()) or {})
+            if hasattr(self.cam, "overruns"):
+                out["capture_process"] = self.cam.stats()
+        if self.pipeline is not None:
+            out["preview_stats"] = self.pipeline.stats()
+            out["sharpness"] = self.pipeline.sharpness
+        if self.recorder is not None:
+            out["video"] = self.recorder.stats()
+        if self.last_exposure is not None:
+            out["exposure"] = self.last_exposure
+        return out
+
+    def close(self, timeout=30):
+        """Остановить всё и дописать очередь записи."""
+        t = self._warm
+        if t is not None and t is not threading.current_thread():
+            t.join(10.0)
+        self.stop_preview()
+        if self.sched is not None: self.sched.stop()
+        # дописать всё, что ещё в очереди кодирования
+        self.on_status("Сохранение снимков…")
+        self.encode_queue.close(timeout=timeout)
+        if self.store is not None: self.store.close()
+        if self.cam is None: return
+        try: self.ir_led.off(); self.vis_led.off()
+        except Exception: pass
+        try: self.cam.close()   # процесс захвата (proc:) завершается и освобождает общую память
+        except Exception as e: print("Camera close error:", e)
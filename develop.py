@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Пакетная проявка сырых снимков (.npy, rawfile.py) в JPEG/PNG/TIFF.
+
+Ищет под папкой ещё не проявленные .npy и проявляет их параллельно по
+ядрам (пул процессов); результат — рядом, <имя>.jpg|png|tiff. Съёмку не
+трогает: можно запускать и во время обследования, и после.
+
+Примеры:
+  python3 develop.py ~/Pictures/Fundus
+  python3 develop.py ~/Pictures/Fundus --format tiff --workers 2
+  python3 develop.py снимок.npy --format png --force
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import rawfile
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", default=[os.path.expanduser("~/Pictures/Fundus")],
+                    help="файлы .npy или папки (по умолчанию ~/Pictures/Fundus)")
+    ap.add_argument("--format", default="jpg", choices=sorted(rawfile.FORMATS))
+    ap.add_argument("--quality", type=int, default=95, help="качество JPEG")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--force", action="store_true", help="переписать уже проявленные")
+    args = ap.parse_args(argv)
+
+    todo = []
+    for p in args.paths:
+        if os.path.isdir(p):
+            todo += rawfile.pending(p, args.format, args.force)
+        elif p.endswith(".npy"):
+            todo.append(p)
+    if not todo:
+        print("Нечего проявлять")
+        return 0
+
+    t0 = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futs = {pool.submit(rawfile.develop, p, args.format, args.quality, args.force): p for p in todo}
+        for fut in as_completed(futs):
+            try:
+                out, dt = fut.result()
+                print(f"{out} ({dt * 1000:.0f} мс)")
+            except Exception as e:
+                failed += 1
+                print("Ошибка проявки:", futs[fut], e)
+    dt = time.perf_counter() - t0
+    print(f"Проявлено {len(todo) - failed}/{len(todo)} за {dt:.1f} с "
+          f"({args.workers} процесс., {len(todo) / dt:.1f} файл/с)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
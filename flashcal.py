@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Калибровка экспозиции видимой вспышки и таблица результатов.
+
+Автоэкспозиция предпросмотра меряет сцену под ИК-подсветкой; вспышка VIS
+в разы ярче, и снимок с зафиксированными этим AE ExposureTime/AnalogueGain
+пересвечен. Калибровка (на модели глаза или мишени, не на пациенте) для
+каждого зума из списка подбирает выдержку и усиление: пробная вспышка ->
+гистограмма кадра (imaging.exposure_check) -> поправка exp·gain, пока p99
+не придёт к цели. Результат — таблица в ~/.cache/fundus/flash_exposure.json
+по режиму сенсора (как базовый кроп): {режим: {"4.0": {ExposureTime,
+AnalogueGain, p99, clipped, when}}}. Для зума между точками таблицы
+exp·gain интерполируется в логарифмах.
+"""
+
+import datetime
+import json
+import math
+import os
+import time
+
+import capture
+import imaging
+
+TARGET = 200            # цель для p99 яркости кадра со вспышкой (из 255)
+TOLERANCE = 0.12        # допустимое отклонение p99 от цели (доля)
+ITERATIONS = 6          # пробных вспышек на одну точку зума, не больше
+MAX_EXPOSURE = 20000    # мкс; длиннее — смаз от движения глаза, добираем усилением
+MIN_EXPOSURE = 100      # мкс
+MAX_GAIN = 8.0
+
+
+def split(total, max_exposure=MAX_EXPOSURE, max_gain=MAX_GAIN, min_exposure=MIN_EXPOSURE):
+    """exp·gain -> (ExposureTime, AnalogueGain): сначала выдержка (до
+    max_exposure), остальное — усилением (не меньше 1, не больше max_gain)."""
+    exp = min(max_exposure, max(min_exposure, total))
+    gain = min(max_gain, max(1.0, total / exp))
+    return int(round(exp)), round(gain, 3)
+
+
+class FlashTable:
+    """Таблица калибровки: get(режим, зум) — ExposureTime/AnalogueGain для
+    вспышки или None (режим не калиброван); put()/save() — запись."""
+
+    def __init__(self, path, max_exposure=MAX_EXPOSURE, max_gain=MAX_GAIN):
+        self.path = path
+        self.max_exposure = max_exposure
+        self.max_gain = max_gain
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except Exception:
+            self.entries = {}
+
+    def points(self, mode):
+        """[(зум, exp·gain, запись)] режима по возрастанию зума."""
+        pts = []
+        for z, e in (self.entries.get(mode) or {}).items():
+            try:
+                pts.append((float(z), e["ExposureTime"] * e["AnalogueGain"], e))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return sorted(pts, key=lambda p: p[0])
+
+    def get(self, mode, zoom):
+        pts = self.points(mode)
+        if not pts:
+            return None
+        zoom = float(zoom)
+        for (z0, t0, _), (z1, t1, _) in zip(pts, pts[1:]):
+            if z0 < zoom < z1:
+                k = math.log(zoom / z0) / math.log(z1 / z0)
+                exp, gain = split(math.exp(math.log(t0) + k * (math.log(t1) - math.log(t0))),
+                                  self.max_exposure, self.max_gain)
+                return {"ExposureTime": exp, "AnalogueGain": gain}
+        # вне диапазона или точное попадание — ближайшая точка
+        _, _, e = min(pts, key=lambda p: abs(math.log(p[0] / zoom)))
+        return {"ExposureTime": e["ExposureTime"], "AnalogueGain": e["AnalogueGain"]}
+
+    def put(self, mode, zoom, exp, gain, check=None):
+        entry = {"ExposureTime": int(exp), "AnalogueGain": float(gain),
+                 "when": datetime.datetime.now().isoformat(timespec="seconds")}
+        if check:
+            entry.update({"p99": check["p99"], "clipped": round(check["clipped"], 4)})
+        self.entries.setdefault(mode, {})[f"{float(zoom):.1f}"] = entry
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".part", "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(self.path + ".part", self.path)
+        except Exception as e:
+            print("Flash table error:", e)
+
+
+def measure(cam, ring, pump, ir_led, vis_led, target=TARGET, window=1.0, frames=2):
+    """Одна пробная вспышка по границам кадров (capture.frame_flash) на
+    frames кадров -> exposure_check первого, экспозиция которого целиком
+    пришлась на неё (второй — запас на потерянный кадр). ИК на время
+    вспышки гасится и снова включается после."""
+    fmt, _ = capture._stream_format(cam, ring.stream)
+    ring.arm(capture._after(time.monotonic()))
+    try:
+        ir_led.off()
+        t0, t_off = capture.frame_flash(vis_led, pump, frames, timeout=window, plan=capture._plan(ring))
+        ok = capture._lit(t0, t_off, capture.readout_time(pump.latest()[1]))
+        lit = ring.wait_frames(lambda f: ok(f.start, f.end), 1, timeout=window,
+                                  stop=lambda f: f.start is not None and f.start > t_off)
+    finally:
+        ring.disarm()
+        ir_led.on()
+    if not lit:
+        raise RuntimeError("Калибровка: нет кадра со вспышкой")
+    out = imaging.exposure_check(lit[0].array, fmt, target)
+    out["metadata"] = lit[0].metadata
+    return out
+
+
+def calibrate(cam, sched, pump, ring, ir_led, vis_led, table, mode, zooms, zoom_ctrls, start,
+              target=TARGET, tol=TOLERANCE, iterations=ITERATIONS, window=1.0, on_step=None):
+    """Подобрать экспозицию вспышки для каждого зума из zooms и записать в
+    table (режим mode). Вызывать внутри sched.exclusive(), при идущем потоке
+    кадров. zoom_ctrls(z) — поставить зум z и вернуть его управление
+    (ScalerCrop), оно уходит той же транзакцией, что и экспозиция.
+    start — (ExposureTime, AnalogueGain) первой пробы; следующий зум
+    начинает с результата предыдущего. on_step(z, i, check) — после каждой
+    вспышки; вспышка без кадра (кадр потерян) — одна попытка из iterations.
+    Таблица сохраняется и при ошибке — с уже подобранными точками.
+    Возвращает [{zoom, ExposureTime, AnalogueGain, p99, clipped, flashes, ok}]."""
+    total = max(1.0, float(start[0]) * float(start[1]))
+    results = []
+    try:
+        for z in zooms:
+            zc = dict(zoom_ctrls(z) or {})
+            best, t0 = None, time.monotonic()
+            for i in range(iterations):
+                exp, gain = split(total, table.max_exposure, table.max_gain)
+                ctrls = {"AeEnable": 0, "AwbEnable": 0, "ExposureTime": exp, "AnalogueGain": gain}
+                ctrls.update(zc)
+                if sched.transaction(ctrls, timeout=window) is None:
+                    raise RuntimeError("Калибровка: кадр с новой экспозицией не дождались")
+                zc = {}
+                try:
+                    chk = measure(cam, ring, pump, ir_led, vis_led, target, window)
+                except RuntimeError as e:
+                    print(e); continue
+                if on_step is not None:
+                    on_step(z, i, chk)
+                close = chk["verdict"] == "ok" and abs(chk["p99"] - target) <= tol * target
+                if chk["verdict"] != "over" and (best is None or
+                                                 abs(chk["p99"] - target) < abs(best[2]["p99"] - target)):
+                    best = (exp, gain, chk, close)
+                if close:
+                    break
+                if chk["gain"] > 1 and exp >= table.max_exposure and gain >= table.max_gain:
+                    break   # упёрлись в пределы выдержки и усиления
+                total *= chk["gain"]
+            if best is None:
+                results.append({"zoom": z, "ok": False, "flashes": i + 1,
+                                "seconds": time.monotonic() - t0})
+                continue
+            exp, gain, chk, close = best
+            table.put(mode, z, exp, gain, chk)
+            results.append({"zoom": z, "ExposureTime": exp, "AnalogueGain": gain, "p99": chk["p99"],
+                            "clipped": chk["clipped"], "flashes": i + 1, "ok": close,
+                            "seconds": time.monotonic() - t0})
+            total = exp * gain
+    finally:
+        table.save()
+    return results
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Кольцевой буфер полноразмерных кадров для съёмки без задержки затвора (ZSL).
+
+Пока буфер «взведён» (arm), каждый кадр потока main копируется в
+ограниченную очередь вместе с метаданными и окном экспозиции. Съёмка
+выбирает из буфера первый кадр, экспозиция которого целиком пришлась на
+освещённую часть окна, — вспышку можно гасить сразу, как он пришёл.
+Память ограничена max_bytes (и max_frames). keep(start, end) — копировать
+только кадры с подходящим окном экспозиции (по метаданным, до копии):
+съёмка по плану вспышки не тратит поток камеры на ненужные кадры.
+"""
+
+import threading
+import time
+from collections import deque
+
+from metadata import exposure_window
+
+
+class RingFrame:
+    __slots__ = ("seq", "array", "metadata", "start", "end", "arrived")
+
+    def __init__(self, seq, array, metadata, start, end, arrived):
+        self.seq = seq
+        self.array = array
+        self.metadata = metadata
+        self.start = start       # начало экспозиции, time.monotonic()
+        self.end = end           # конец экспозиции
+        self.arrived = arrived   # когда кадр попал в буфер
+
+
+class FrameRing:
+    """Ограниченный буфер последних кадров потока stream."""
+
+    def __init__(self, cam, stream="main", max_bytes=64 << 20, max_frames=8):
+        self.cam = cam
+        self.stream = stream
+        self.max_bytes = int(max_bytes)
+        self.max_frames = int(max_frames)
+        self.capacity = None       # кадров; считается по размеру кадра
+        self.copied = 0
+        self.evicted = 0
+        self.skipped = 0           # взведён, но кадр не подошёл keep — не копировался
+        self._frames = deque()
+        self._seq = -1
+        self._armed = 0
+        self._keep = None
+        self._seen = None          # последний кадр, не скопированный по keep (без массива) — для stop
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        if self._started: return
+        self.cam.add_listener(self._on_frame)
+        self._started = True
+
+    def stop(self):
+        if not self._started: return
+        self.cam.remove_listener(self._on_frame)
+        self._started = False
+        self.clear()
+
+    def arm(self, keep=None):
+        """Начать копировать кадры (вложенные arm/disarm допустимы);
+        keep — см. keep()."""
+        with self._cond:
+            self._armed += 1
+            self._keep = keep
+
+    def keep(self, pred):
+        """Копировать только кадры, для которых pred(start, end) истинно
+        (None — все); уже скопированные остаются."""
+        with self._cond:
+            self._keep = pred
+
+    def disarm(self):
+        with self._cond:
+            self._armed = max(0, self._armed - 1)
+            if not self._armed:
+                self._keep = self._seen = None
+                self._frames.clear()   # память отдаём сразу
+
+    def clear(self):
+        with self._cond:
+            self._frames.clear()
+
+    @property
+    def bytes_used(self):
+        with self._cond:
+            return sum(f.array.nbytes for f in self._frames)
+
+    def _on_frame(self, request):
+        with self._cond:
+            self._seq += 1
+            if not self._armed:
+                return
+            seq, keep = self._seq, self._keep
+        meta = request.get_metadata() or {}
+        win = exposure_window(meta) or (None, None)
+        if keep is not None and not keep(win[0], win[1]):
+            with self._cond:
+                self.skipped += 1
+                self._seen = RingFrame(seq, None, meta, win[0], win[1], time.monotonic())
+                self._cond.notify_all()
+            return
+        arr = request.make_array(self.stream)
+        frame = RingFrame(seq, arr, meta, win[0], win[1], time.monotonic())
+        with self._cond:
+            self.capacity = max(1, min(self.max_frames, self.max_bytes // max(1, arr.nbytes)))
+            self._frames.append(frame)
+            self.copied += 1
+            while len(self._frames) > self.capacity:
+                self._frames.popleft()
+                self.evicted += 1
+            self._cond.notify_all()
+
+    def frames(self):
+        """Снимок содержимого буфера (старые -> новые)."""
+        with self._cond:
+            return list(self._frames)
+
+    def wait_for(self, pred, timeout=1.0):
+        """Первый кадр буфера, для которого pred(frame) истинно; ждёт новых
+        кадров до timeout. None — не дождались."""
+        got = self.wait_frames(pred, 1, timeout)
+        return got[0] if got else None
+
+    def wait_frames(self, pred, n, timeout=1.0, stop=None):
+        """Первые n кадров, для которых pred(frame) истинно (n не больше
+        ёмкости буфера). По таймауту — сколько набралось (возможно, пусто).
+        stop(frame) — подходящих кадров больше не будет (например, пришёл
+        кадр позже вспышки): вернуть набранное, не дожидаясь таймаута;
+        проверяется и на кадрах, не скопированных по keep (array — None)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                got = [f for f in self._frames if pred(f)]
+                need = min(n, self.capacity or n)
+                if len(got) >= need:
+                    return got[:need]
+                if stop is not None and (any(stop(f) for f in self._frames) or
+                                         (self._seen is not None and stop(self._seen))):
+                    return got
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return got
+                self._cond.wait(left)
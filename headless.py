@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Безголовый режим: предпросмотр MJPEG и HTTP API съёмки без Tk.
+
+Та же логика зума/фокуса/AF/съёмки, что и в fundus.py (controller.py),
+управление — по HTTP на локальном адресе:
+
+  GET  /stream.mjpg          поток предпросмотра (multipart/x-mixed-replace)
+  GET  /snapshot.jpg         последний кадр предпросмотра
+  GET  /status               состояние (JSON): зум, фокус, очередь записи, зрители
+  POST /capture?mode=vis|ir|pair  снимок (pair — ИК перед вспышкой + VIS, связанные);
+                             ответ после съёмки (файл ещё может писаться)
+  POST /zoom?value=4.0       зум (или step=0.1 — приращение)
+  POST /focus?value=5.0      фокус (или step=-0.1)
+  POST /af                   автофокус
+  POST /reset                сброс зума/фокуса
+  POST /raw?on=1|0           сырые снимки .npy (проявка — develop.py)
+  POST /video?on=1|0         видео обследования (с предзаписью); on=0 — ответ со сводкой
+  POST /calibrate?zooms=1,2,4,8  калибровка экспозиции вспышки (на модели глаза); ответ по зумам
+  GET  /trace                p50/p95/p99 стадий (tracing), POST /trace?on=1|0 — вкл/выкл,
+  POST /trace/dump           засечки в save_dir/Fundus/trace_<дата>.json
+
+Каждый кадр кодируется в JPEG один раз на всех зрителей; медленный
+зритель получает самый свежий кадр и пропускает промежуточные (счётчик
+drops), не тормозя остальных. Пока зрителей нет, кадры не кодируются.
+
+Примеры:
+  FUNDUS_CAMERA=sim python3 headless.py
+  curl -X POST 'http://127.0.0.1:8080/capture?mode=ir'
+"""
+
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import tracing
+
+BOUNDARY = "frame"
+JPEG_QUALITY = 80
+
+
+class MjpegBroadcaster:
+    """Кадры предпросмотра -> JPEG один раз -> все зрители.
+
+    source — callable без аргументов: свежий PIL.Image или None
+    (PreviewPipeline.take). Хранится только последний кадр: (номер, jpeg).
+    """
+
+    def __init__(self, source, quality=JPEG_QUALITY, poll=0.005):
+        self.source = source
+        self.quality = quality
+        self.poll = poll
+        self.encoded = 0
+        self.encode_ms = deque(maxlen=60)
+        self._frame = (0, None)
+        self._clients = {}          # id -> {"sent": n, "drops": n}
+        self._next_id = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=1.0)
+        self._thread = None
+
+    def _loop(self):
+        while self._running:
+            with self._cond:
+                if not self._clients:
+                    self._cond.wait(0.1)   # без зрителей не кодируем
+                    continue
+            try:
+                img = self.source()
+            except Exception as e:
+                print("MJPEG source error:", e)
+                img = None
+            if img is None:
+                time.sleep(self.poll); continue
+            t0 = time.perf_counter()
+            buf = io.BytesIO()
+            img.save(buf, "JPEG", quality=self.quality)
+            self.encode_ms.append((time.perf_counter() - t0) * 1000.0)
+            with self._cond:
+                self.encoded += 1
+                self._frame = (self._frame[0] + 1, buf.getvalue())
+                self._cond.notify_all()
+
+    def frames(self, timeout=2.0):
+        """Генератор JPEG для одного зрителя: всегда самый свежий кадр,
+        пропущенные считаются в drops. Завершается по stop() или таймауту."""
+        with self._cond:
+            cid = self._next_id
+            self._next_id += 1
+            client = self._clients[cid] = {"sent": 0, "drops": 0}
+            self._cond.notify_all()
+            last = self._frame[0]
+        try:
+            while self._running:
+                with self._cond:
+                    if not self._cond.wait_for(lambda: self._frame[0] > last or not self._running,
+                                               timeout):
+                        return
+                    seq, jpeg = self._frame
+                if jpeg is None:
+                    return
+                if last and seq - last > 1:
+                    client["drops"] += seq - last - 1
+                last = seq
+                client["sent"] += 1
+                yield jpeg
+        finally:
+            with self._cond:
+                self._clients.pop(cid, None)
+
+    def snapshot(self, timeout=2.0):
+        """Последний кадр JPEG; без зрителей — дождаться свежего."""
+        for jpeg in self.frames(timeout):
+            return jpeg
+        return None
+
+    def stats(self):
+        ms = sorted(self.encode_ms)
+        with self._cond:
+            clients = [dict(c) for c in self._clients.values()]
+        return {"clients": len(clients), "encoded": self.encoded,
+                "encode_ms_p50": ms[len(ms) // 2] if ms else float("nan"),
+                "sent": [c["sent"] for c in clients], "drops": [c["drops"] for c in clients]}
+
+
+def _json_safe(v):
+    if isinstance(v, float) and v != v:
+        return None   # NaN не допускается в JSON
+    if isinstance(v, dict):
+        return {k: _json_safe(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_json_safe(x) for x in v]
+    return v
+
+
+def make_handler(ctl, stream):
+    """Класс обработчика HTTP для контроллера ctl и вещателя stream."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass   # без строки в консоль на каждый запрос
+
+        def _reply(self, code, obj):
+            body = json.dumps(_json_safe(obj), ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _query(self):
+            url = urlparse(self.path)
+            return url.path, {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        def do_GET(self):
+            path, _ = self._query()
+            if path == "/status":
+                st = ctl.state()
+                st["stream"] = stream.stats()
+                return self._reply(200, st)
+            if path == "/trace":
+                return self._reply(200, {"enabled": tracing.enabled(), "stages": tracing.stats()})
+            if path == "/snapshot.jpg":
+                jpeg = stream.snapshot()
+                if jpeg is None:
+                    return self._reply(503, {"error": "нет кадра"})
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(jpeg)))
+                self.end_headers()
+                self.wfile.write(jpeg)
+                return
+            if path == "/stream.mjpg":
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for jpeg in stream.frames():
+                        self.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                         f"Content-Length: {len(jpeg)}\r\n\r\n".encode("ascii"))
+                        self.wfile.write(jpeg)
+                        self.wfile.write(b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                return
+            self._reply(404, {"error": "нет такого пути"})
+
+        def do_POST(self):
+            path, q = self._query()
+            try:
+                if path == "/capture":
+                    mode = q.get("mode", "vis").lower()
+                    if mode not in ("vis", "ir", "pair"):
+                        return self._reply(400, {"error": "mode: vis, ir или pair"})
+                    if mode == "pair":
+                        res = ctl.take_pair(wait=True)
+                    else:
+                        res = ctl.take_photo(visible=(mode == "vis"), wait=True)
+                    if res is None:
+                        return self._reply(503, {"error": "снимок не сделан"})
+                    meta = res.get("metadata") or {}
+                    out = {"path": res.get("path"), "mode": mode.upper(),
+                           "lens_position": meta.get("LensPosition"),
+                           "exposure": meta.get("ExposureTime"), "gain": meta.get("AnalogueGain")}
+                    if mode == "pair":
+                        out.update({"path_ir": res["path_ir"], "gap_ms": round(res["gap_ms"], 2),
+                                    "sensor_timestamp_ir": res["metadata_ir"].get("SensorTimestamp"),
+                                    "sensor_timestamp": meta.get("SensorTimestamp")})
+                    return self._reply(200, out)
+                if path == "/zoom":
+                    if "step" in q: ctl.zoom_by(float(q["step"]))
+                    else: ctl.zoom_to(float(q["value"]))
+                    return self._reply(200, {"zoom": round(ctl.zoom_factor, 2)})
+                if path == "/focus":
+                    if "step" in q: ctl.focus_by(float(q["step"]))
+                    else: ctl.focus_to(float(q["value"]))
+                    return self._reply(200, {"focus": round(ctl.focus_position, 3),
+                                             "af_mode": ctl.af_mode})
+                if path == "/af":
+                    if ctl.af_available:
+                        ctl.enable_autofocus()
+                        return self._reply(200, {"af_mode": ctl.af_mode})
+                    res = ctl.run_soft_autofocus(wait=True)
+                    return self._reply(200, {"af_mode": "soft", "result": res and {
+                        k: res[k] for k in ("position", "score", "steps", "seconds", "converged")}})
+                if path == "/trace":
+                    tracing.enable(q.get("on", "1") not in ("0", "false", "off"))
+                    return self._reply(200, {"enabled": tracing.enabled()})
+                if path == "/raw":
+                    ctl.set_raw(q.get("on", "1") not in ("0", "false", "off"))
+                    return self._reply(200, {"raw": ctl.raw})
+                if path == "/video":
+                    if q.get("on", "1") not in ("0", "false", "off"):
+                        return self._reply(200, {"recording": ctl.start_recording()})
+                    return self._reply(200, {"video": ctl.stop_recording()})
+                if path == "/calibrate":
+                    zooms = tuple(float(z) for z in q["zooms"].split(",")) if "zooms" in q else None
+                    res = ctl.calibrate_flash(zooms, wait=True) if zooms else ctl.calibrate_flash(wait=True)
+                    if res is None:
+                        return self._reply(503, {"error": "калибровка не выполнена"})
+                    return self._reply(200, {"flash": res})
+                if path == "/trace/dump":
+                    return self._reply(200, {"path": ctl.dump_trace()})
+                if path == "/reset":
+                    ctl.reset_zoom_focus()
+                    return self._reply(200, {"zoom": ctl.zoom_factor, "focus": ctl.focus_position})
+            except (KeyError, ValueError) as e:
+                return self._reply(400, {"error": f"параметр: {e}"})
+            self._reply(404, {"error": "нет такого пути"})
+
+    return Handler
+
+
+def main(argv=None):
+    t_launch = time.monotonic()
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1", help="адрес (по умолчанию только локально)")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--box", default="800x440", help="размер кадра предпросмотра, ШxВ")
+    ap.add_argument("--save-dir", help="папка сохранения (по умолчанию ~/Pictures)")
+    ap.add_argument("--camera", help="бэкенд камеры (по умолчанию FUNDUS_CAMERA)")
+    args = ap.parse_args(argv)
+    box = tuple(int(v) for v in args.box.lower().split("x"))
+
+    from controller import CameraController
+    ctl = CameraController(args.camera, args.save_dir)   # до потоков сервера (fork пула)
+    try: ctl.open_store().new_session("headless")
+    except Exception as e: print("Index error:", e)
+    ctl.start_preview(box)
+    stream = MjpegBroadcaster(lambda: ctl.pipeline.take() if ctl.pipeline is not None else None)
+    stream.start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(ctl, stream))
+    server.daemon_threads = True
+    ctl.mark("launch_to_server_ms", t_launch)
+    print(f"http://{args.host}:{server.server_address[1]}/stream.mjpg")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stream.stop()
+        ctl.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Векторные (NumPy) оценки кадров: резкость, пересвет, экспозиция.
+
+Считается на центральной области (ROI), уменьшенной усреднением блоков
+step x step, — на кадре 1280x720 это около миллисекунды.
+"""
+
+import numpy as np
+
+
+def _block_mean(a, step):
+    """Уменьшение в step раз усреднением блоков step x step (шум падает в step раз)."""
+    if step <= 1:
+        return a.astype(np.float32)
+    h, w = (a.shape[0] // step) * step, (a.shape[1] // step) * step
+    a = a[:h, :w].astype(np.float32)
+    return a.reshape(h // step, step, w // step, step, *a.shape[2:]).mean(axis=(1, 3))
+
+
+def roi(arr, fmt=None, frac=0.5, step=4):
+    """Центральная область кадра, уменьшенная в step раз.
+    Возвращает (green, peak): float32 канал G (в нём лучше видны сосуды —
+    «бескрасный» канал) и максимум по каналам (для пересвета; у глазного дна
+    первым насыщается R). Для YUV420 оба — яркость Y."""
+    if fmt in ("YUV420", "YVU420"):
+        h = arr.shape[0] * 2 // 3
+        plane = arr[:h]
+    else:
+        plane = arr
+    h, w = plane.shape[:2]
+    rh, rw = int(h * frac), int(w * frac)
+    y0, x0 = (h - rh) // 2, (w - rw) // 2
+    sub = _block_mean(plane[y0:y0 + rh, x0:x0 + rw], step)
+    if sub.ndim == 2:
+        return sub, sub
+    # индекс 1 — зелёный во всех раскладках Picamera2 (RGB888/BGR888/X*8888)
+    return sub[..., 1], sub[..., :3].max(axis=2)
+
+
+def laplacian_var(g):
+    """Дисперсия 4-связного лапласиана — мера резкости."""
+    if g.shape[0] < 3 or g.shape[1] < 3:
+        return 0.0
+    lap = (4.0 * g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:])
+    return float(lap.var())
+
+
+def clipped_fraction(peak, lo=4, hi=251):
+    """Доля пикселей в провале (<= lo) или пересвете (>= hi)."""
+    if peak.size == 0:
+        return 0.0
+    return float(np.count_nonzero((peak <= lo) | (peak >= hi))) / peak.size
+
+
+def score_frame(arr, fmt=None, frac=0.5, step=4):
+    """Оценка кадра: sharpness (дисперсия лапласиана), clipped (доля
+    пересвета/провала), mean (средняя яркость ROI) и итоговая score —
+    резкость со штрафом за пересвет."""
+    g, peak = roi(arr, fmt, frac, step)
+    sharp = laplacian_var(g)
+    clipped = clipped_fraction(peak)
+    return {"sharpness": sharp, "clipped": clipped, "mean": float(g.mean()) if g.size else 0.0,
+            "score": sharp * max(0.0, 1.0 - 4.0 * clipped)}
+
+
+def exposure_check(arr, fmt=None, target=200, over=0.02, under=0.5, frac=0.5, step=4):
+    """Гистограмма яркости (максимум по каналам) центральной области — одна
+    bincount на уменьшенном кадре, сразу после съёмки. Возвращает p50, p99,
+    доли провала/пересвета, gain — во сколько раз поправить экспозицию,
+    чтобы p99 стал target, и verdict: "over" (пересвет больше over),
+    "under" (p99 ниже under * target) или "ok"."""
+    _, peak = roi(arr, fmt, frac, step)
+    hist = np.bincount(np.clip(peak, 0, 255).astype(np.uint8).ravel(), minlength=256)
+    cum = np.cumsum(hist)
+    n = max(1, int(cum[-1]))
+    p50 = int(np.searchsorted(cum, 0.5 * n))
+    p99 = int(np.searchsorted(cum, 0.99 * n))
+    dark, clip = float(cum[4]) / n, float(hist[251:].sum()) / n
+    verdict = "over" if clip > over else "under" if p99 < under * target else "ok"
+    # в пересвете p99 ничего не говорит о том, насколько много света — шаг вдвое
+    gain = 0.5 if p99 >= 251 else target / max(p99, 1)
+    return {"p50": p50, "p99": p99, "dark": dark, "clipped": clip, "gain": gain, "verdict": verdict}
+
+
+def focus_peaking(rgb, rel=3.0, floor=6.0, step=2):
+    """Маска резких краёв для подсветки фокуса: |dx| + |dy| зелёного канала,
+    уменьшенного в step раз (меньше шума и работы), выше mean + rel*std
+    (но не ниже floor). Маска — в уменьшенном размере (h//step, w//step)."""
+    g = _block_mean(rgb[..., 1], step)
+    gm = np.zeros_like(g)
+    gm[:, :-1] = np.abs(np.diff(g, axis=1))
+    gm[:-1, :] += np.abs(np.diff(g, axis=0))
+    thr = max(floor, float(gm.mean() + rel * gm.std()))
+    return gm > thr
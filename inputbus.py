@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Шина событий ввода: кнопки GPIO и клавиши -> действия камеры -> Tk.
+
+Источник (колбэк gpiozero, привязка Tk) только вызывает emit(имя,
+источник): событие получает метку time.monotonic() прямо там и встаёт в
+очередь. Действия выполняет поток шины по приоритету — затвор (SHUTTER)
+обгоняет накопившиеся повторы зума/фокуса (REPEAT); ни поток gpiozero, ни
+цикл Tk камеру не ждут.
+
+Дедупликация: одно и то же действие не чаще раза в dedupe секунд (дребезг,
+кнопка GPIO и клавиша gpio-key одновременно). Для повторяемых действий
+(repeat=True — зум/фокус) вместо этого сливаются повторы, которые ещё
+ждут в очереди: шина отстаёт — лишние шаги не копятся.
+
+Всё, что трогает Tk (StringVar, after, виджеты), поток шины и остальные
+потоки передают через call(fn, *args); pump_ui() выполняет это в цикле
+Tk. Задержка «нажатие -> действие» считается по каждому событию (stats,
+tracing "input_wait"). Принятые события пишутся в историю: save()/load()
+и replay() воспроизводят запись с теми же интервалами.
+"""
+
+import heapq
+import json
+import threading
+import time
+from collections import deque
+
+import tracing
+
+SHUTTER, CONTROL, REPEAT, UI = 0, 1, 2, 3   # приоритеты: меньше — раньше
+DEDUPE = 0.15        # сек; то же действие чаще — дребезг/дубль, отбрасывается
+HISTORY = 1024       # принятых событий в истории (для save/replay)
+
+
+class InputBus:
+    """bind(name, fn, priority, repeat) — действие на событие name;
+    emit(name, source) — из любого потока; start()/stop() — поток действий;
+    call(fn, *args) + pump_ui() — передача в поток Tk."""
+
+    def __init__(self, dedupe=DEDUPE, history=HISTORY):
+        self.dedupe = dedupe
+        self.emitted = 0
+        self.handled = 0
+        self.deduped = 0           # отброшено как дребезг/дубль
+        self.coalesced = 0         # повтор слит с ждущим в очереди
+        self.unbound = 0
+        self.latency = deque(maxlen=256)   # (имя, приоритет, нажатие -> начало действия, с)
+        self.history = deque(maxlen=history)   # (t, source, name) принятых событий
+        self._bindings = {}
+        self._last = {}            # name -> t последнего принятого
+        self._pending = {}         # name -> ждущих в очереди (для repeat)
+        self._heap = []
+        self._seq = 0
+        self._ui = deque()
+        self._busy = False
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def bind(self, name, fn, priority=CONTROL, repeat=False):
+        self._bindings[name] = (fn, priority, repeat)
+
+    # --- источники ---
+    def emit(self, name, source="key", t=None):
+        """Событие name от source (gpio/key/http/replay); t — метка нажатия
+        (по умолчанию — сейчас). True — принято в очередь."""
+        t = time.monotonic() if t is None else t
+        b = self._bindings.get(name)
+        with self._cond:
+            self.emitted += 1
+            if b is None:
+                self.unbound += 1; return False
+            fn, priority, repeat = b
+            if repeat:
+                if self._pending.get(name):
+                    self.coalesced += 1; return False
+            elif t - self._last.get(name, -1e9) < self.dedupe:
+                self.deduped += 1; return False
+            self._last[name] = t
+            self._pending[name] = self._pending.get(name, 0) + 1
+            self._seq += 1
+            heapq.heappush(self._heap, (priority, self._seq, t, name))
+            self.history.append((t, source, name))
+            self._cond.notify()
+        return True
+
+    # --- поток действий ---
+    def start(self):
+        if self._running: return
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if not self._running: return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._heap or not self._running)
+                if not self._running:
+                    return
+                priority, _, t, name = heapq.heappop(self._heap)
+                self._pending[name] -= 1
+                self._busy = True
+            wait = time.monotonic() - t
+            self.latency.append((name, priority, wait))
+            tracing.record("input_wait", wait)
+            try:
+                self._bindings[name][0]()
+            except Exception as e:
+                print("Input handler error:", name, e)
+            self.handled += 1
+            with self._cond:
+                self._busy = False
+
+    # --- в поток Tk ---
+    def call(self, fn, *args):
+        """Выполнить fn(*args) в потоке Tk (на ближайшем pump_ui)."""
+        self._ui.append((fn, args))
+
+    def pump_ui(self, budget=0.02):
+        """Из цикла Tk: выполнить переданное через call(), не дольше budget с
+        (остальное — на следующем вызове). Число выполненных."""
+        n, t0 = 0, time.perf_counter()
+        while self._ui and time.perf_counter() - t0 < budget:
+            fn, args = self._ui.popleft()
+            try: fn(*args)
+            except Exception as e: print("UI call error:", e)
+            n += 1
+        return n
+
+    # --- запись и воспроизведение ---
+    def save(self, path):
+        """История принятых событий в JSON: [{"dt", "source", "name"}], dt — от первого."""
+        events = list(self.history)
+        t0 = events[0][0] if events else 0.0
+        with open(path, "w") as f:
+            json.dump([{"dt": round(t - t0, 4), "source": s, "name": n} for t, s, n in events], f, indent=1)
+        return path
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return json.load(f)
+
+    def replay(self, events, speed=1.0, wait=True):
+        """Повторить события (список из load()/save()) с исходными интервалами
+        (speed — ускорение). wait=False — в отдельном потоке. Принятых событий."""
+        def run():
+            t0, accepted = time.monotonic(), 0
+            for ev in events:
+                delay = t0 + ev["dt"] / speed - time.monotonic()
+                if delay > 0: time.sleep(delay)
+                accepted += self.emit(ev["name"], "replay")
+            return accepted
+        if wait:
+            return run()
+        threading.Thread(target=run, daemon=True).start()
+        return None
+
+    def drain(self, timeout=5.0):
+        """Дождаться, пока очередь действий опустеет (для тестов и бенчмарка)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._heap and not self._busy:
+                    return True
+            time.sleep(0.002)
+        return False
+
+    def stats(self):
+        def p(values, q):
+            v = sorted(values)
+            return v[min(len(v) - 1, int(q / 100.0 * len(v)))] * 1000.0 if v else float("nan")
+        lat = list(self.latency)
+        shutter = [w for _, pr, w in lat if pr == SHUTTER]
+        return {"input_emitted": self.emitted, "input_handled": self.handled,
+                "input_deduped": self.deduped, "input_coalesced": self.coalesced,
+                "input_queue": len(self._heap), "ui_queue": len(self._ui),
+                "press_to_action_ms_p50": p([w for _, _, w in lat], 50),
+                "press_to_action_ms_p95": p([w for _, _, w in lat], 95),
+                "shutter_press_to_action_ms_p95": p(shutter, 95)}
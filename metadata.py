@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Общий насос метаданных кадров.
+
+Вместо блокирующего picam2.capture_metadata() (ждёт следующий кадр) один
+подписчик на кадры камеры хранит последние метаданные с номером кадра.
+Читать их можно без ожидания (latest) или дождаться первого кадра после
+номера N (wait_after): последние HISTORY кадров хранятся, отставший
+читатель получает их по порядку, а не сразу самый свежий.
+"""
+
+import threading
+import time
+from collections import deque
+
+import tracing
+from camera_backend import sensor_time
+
+HISTORY = 8   # кадров в истории насоса (wait_after/wait_for не пропускают кадры)
+
+
+def exposure_window(meta):
+    """(начало, конец) экспозиции кадра по часам time.monotonic() или None."""
+    ts, exp = meta.get("SensorTimestamp"), meta.get("ExposureTime")
+    if not ts or not exp:
+        return None
+    end = sensor_time(ts)
+    return end - exp / 1e6, end
+
+
+class MetadataPump:
+    """Последние метаданные кадра, номер кадра (seq) и SensorTimestamp.
+
+    seq — собственный счётчик кадров насоса (растёт на каждый кадр),
+    он не зависит от того, отдаёт ли камера SensorSequence.
+    """
+
+    def __init__(self, cam):
+        self.cam = cam
+        self.seq = -1
+        self.timestamp = None      # SensorTimestamp последнего кадра, нс
+        self.received = None       # time.monotonic() прихода последнего кадра
+        self._meta = {}
+        self._history = deque(maxlen=HISTORY)   # (seq, metadata) последних кадров
+        self._cond = threading.Condition()
+        self._started = False
+
+    def start(self):
+        if self._started: return
+        self.cam.add_listener(self._on_frame)
+        self._started = True
+
+    def stop(self):
+        if not self._started: return
+        self.cam.remove_listener(self._on_frame)
+        self._started = False
+        with self._cond:
+            self._cond.notify_all()
+
+    def _on_frame(self, request):
+        meta = request.get_metadata() or {}
+        with self._cond:
+            self.seq += 1
+            self._meta = meta
+            self._history.append((self.seq, meta))
+            self.timestamp = meta.get("SensorTimestamp")
+            self.received = time.monotonic()
+            self._cond.notify_all()
+
+    def latest(self):
+        """(seq, metadata) последнего кадра без ожидания; seq=-1 — кадров ещё не было."""
+        with self._cond:
+            return self.seq, self._meta
+
+    def get(self, key, default=None):
+        with self._cond:
+            return self._meta.get(key, default)
+
+    def wait_after(self, seq, timeout=1.0):
+        """Дождаться первого кадра с номером > seq. (seq, metadata) или None по таймауту.
+        Кадр seq + 1 уже вытеснен из истории — самый старый из хранимых."""
+        with tracing.span("metadata_wait"), self._cond:
+            if not self._cond.wait_for(lambda: self.seq > seq, timeout):
+                return None
+            return next((s, m) for s, m in self._history if s > seq)
+
+    def wait_next(self, timeout=1.0):
+        """Дождаться следующего кадра."""
+        return self.wait_after(self.latest()[0], timeout)
+
+    def wait_for(self, pred, timeout=1.0, after_seq=-1):
+        """Дождаться кадра с номером > after_seq, для метаданных которого pred(meta)
+        истинно. (seq, metadata) или None по таймауту."""
+        deadline = time.monotonic() + timeout
+        seq = after_seq
+        while True:
+            got = self.wait_after(seq, max(0.0, deadline - time.monotonic()))
+            if got is None:
+                return None
+            seq, meta = got
+            if pred(meta):
+                return got
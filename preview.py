@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Подготовка кадров предпросмотра.
+
+PreviewPipeline читает low-res поток в своём потоке, конвертирует и
+масштабирует кадр под окно и кладёт его в единственный слот. Tk-поток
+забирает самый свежий кадр; несъеденные кадры затираются (drop), а не
+копятся в очереди.
+
+Зум (ScalerCrop) камера применяет через несколько кадров. Чтобы картинка
+не отставала и не прыгала, set_crop() задаёт целевое поле зрения: каждый
+кадр, снятый со старым ScalerCrop (по его метаданным), кадрируется до
+целевого поля программно, а последний кадр перепоказывается сразу. Когда
+метаданные подтверждают новый ScalerCrop, кадрирование само становится
+пустым — переход незаметен.
+
+Там же, на уже уменьшенном кадре, считается HUD резкости и (по желанию)
+подсветка фокуса (focus peaking). Анализ прореживается по кадрам так,
+чтобы занимать не больше HUD_SHARE периода кадра.
+"""
+
+import threading
+import time
+from collections import deque
+
+import tracing
+
+HUD_SHARE = 0.2               # доля периода кадра на анализ резкости/peaking
+PEAKING_COLOR = (0, 255, 0)   # цвет подсветки фокуса (на красном дне — зелёный)
+
+
+def _even(x):
+    return int(x) & ~1
+
+
+def resize_contain(img, box_w, box_h, resample=None):
+    """Без обрезки (letterbox): предпросмотр = фото по полю зрения."""
+    if box_w <= 0 or box_h <= 0: return img
+    img_w, img_h = img.size
+    scale = min(box_w / img_w, box_h / img_h)
+    new_w = max(1, int(img_w * scale))
+    new_h = max(1, int(img_h * scale))
+    if (new_w, new_h) == (img_w, img_h): return img
+    if resample is None: return img.resize((new_w, new_h))
+    return img.resize((new_w, new_h), resample)
+
+
+def soft_crop(img, actual, target):
+    """Программный зум: кадр img снят с полем зрения actual (ScalerCrop из его
+    метаданных), показать нужно поле target — вырезать его часть кадра.
+    Поле шире кадра (отдаление) — края чёрные. Совпадает с точностью до
+    пикселя кадра — тот же img."""
+    ax, ay, aw, ah = actual
+    tx, ty, tw, th = target
+    w, h = img.size
+    sx, sy = w / float(aw), h / float(ah)
+    box = (int(round((tx - ax) * sx)), int(round((ty - ay) * sy)),
+           int(round((tx + tw - ax) * sx)), int(round((ty + th - ay) * sy)))
+    if max(abs(box[0]), abs(box[1]), abs(box[2] - w), abs(box[3] - h)) <= 1:
+        return img
+    return img.crop(box)
+
+
+def lores_size(box_w, box_h, main_size):
+    """Размер lores-потока: вписан в окно, с пропорциями main, не больше main."""
+    mw, mh = main_size
+    scale = min(box_w / float(mw), box_h / float(mh), 1.0)
+    return max(64, _even(mw * scale)), max(64, _even(mh * scale))
+
+
+def yuv420_to_rgb(arr, width):
+    """YUV420 (I420) от Picamera2: массив (h*3/2, stride) -> RGB uint8 (h, width, 3).
+    BT.601, ограниченный диапазон."""
+    import numpy as np
+    rows, stride = arr.shape
+    h = rows * 2 // 3
+    cw, ch = stride // 2, h // 2
+    flat = arr[h:].reshape(-1)
+    u = flat[:cw * ch].reshape(ch, cw)[:, :width // 2]
+    v = flat[cw * ch:2 * cw * ch].reshape(ch, cw)[:, :width // 2]
+    y = (arr[:h, :width].astype(np.float32) - 16.0) * 1.164
+    u = np.repeat(np.repeat(u.astype(np.float32) - 128.0, 2, 0), 2, 1)[:h, :width]
+    v = np.repeat(np.repeat(v.astype(np.float32) - 128.0, 2, 0), 2, 1)[:h, :width]
+    rgb = np.empty((h, width, 3), np.float32)
+    rgb[..., 0] = y + 1.596 * v
+    rgb[..., 1] = y - 0.392 * u - 0.813 * v
+    rgb[..., 2] = y + 2.017 * u
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def to_rgb(arr, fmt, width=None):
+    """Массив потока Picamera2 -> RGB. (Имена форматов libcamera «наоборот»:
+    BGR888 — это байты R,G,B.)"""
+    if fmt in ("YUV420", "YVU420"):
+        rgb = yuv420_to_rgb(arr, width or arr.shape[1])
+        return rgb[..., ::-1] if fmt == "YVU420" else rgb
+    if fmt == "RGB888":
+        return arr[..., ::-1]
+    if fmt in ("XRGB8888",):
+        return arr[..., 2::-1]
+    if fmt in ("XBGR8888",):
+        return arr[..., :3]
+    return arr
+
+
+class PreviewPipeline:
+    """Поток-производитель кадров предпросмотра с одним слотом.
+
+    cam     — бэкенд камеры (camera_backend);
+    stream  — имя потока ("lores", если сконфигурирован, иначе "main");
+    paused  — callable; пока True, кадры не читаются (идёт съёмка).
+    """
+
+    def __init__(self, cam, stream="lores", paused=None, resample=None):
+        self.cam = cam
+        self.stream = stream
+        self.paused = paused or (lambda: False)
+        if resample is None:
+            from PIL import Image
+            resample = Image.BILINEAR
+        self.resample = resample
+        self.box = (800, 440)
+        self.metadata = {}         # метаданные последнего кадра
+        self.shown_metadata = {}   # метаданные кадра, отданного take()
+        self.dropped = 0
+        self._slot = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._produced = deque(maxlen=120)
+        self._shown = deque(maxlen=120)
+        self.peaking = False       # подсветка фокуса
+        self.hud = True            # считать резкость для HUD
+        self.sharpness = None      # последняя оценка резкости кадра предпросмотра
+        self._hud_ms = deque(maxlen=30)
+        self._hud_every = 1
+        self._n = 0
+        self._mask = None
+        self.crop = None           # целевой ScalerCrop (программный зум до его применения)
+        self.soft_zoomed = 0       # кадров, показанных с программным кадрированием
+        self._src = None           # (кадр до масштаба, метаданные) — для перепоказа в set_crop
+        self._crop_ver = 0
+
+    def set_box(self, w, h):
+        self.box = (max(1, int(w)), max(1, int(h)))
+
+    def set_crop(self, crop):
+        """Целевое поле зрения (ScalerCrop, который только что задан камере).
+        Последний кадр сразу перепоказывается с этим полем (в потоке вызова,
+        без HUD); следующие — кадрируются, пока камера не догонит."""
+        with self._lock:
+            self.crop = tuple(crop) if crop is not None else None
+            self._crop_ver += 1
+            ver, src = self._crop_ver, self._src
+        if src is None or not self._running:
+            return
+        try:
+            with tracing.span("soft_zoom"):
+                img = self._present(src[0], src[1], self.crop, hud=False)
+        except Exception as e:
+            print("Soft zoom error:", e); return
+        self._put(img, src[1], ver, fresh=False)
+
+    def _present(self, img, meta, crop, hud=True):
+        """Кадр (PIL, полный lores) -> картинка окна: программный зум до crop,
+        масштаб под окно, HUD/peaking."""
+        actual = meta.get("ScalerCrop") if crop is not None else None
+        if actual:
+            cropped = soft_crop(img, actual, crop)
+            if cropped is not img:
+                self.soft_zoomed += 1
+                img = cropped
+        with tracing.span("resize"):
+            img = resize_contain(img, *self.box, resample=self.resample)
+        if hud and (self.peaking or self.hud):
+            with tracing.span("hud"):
+                img = self._analyze(img, meta)
+        return img
+
+    def _put(self, img, meta, ver, fresh=True):
+        with self._lock:
+            if ver != self._crop_ver:
+                return   # поле зрения сменилось, пока кадр готовился — покажем следующий
+            if self._slot is not None and fresh:
+                self.dropped += 1   # Tk не успел забрать — затираем
+            self._slot = (img, meta)
+            if fresh:
+                self.metadata = meta
+                self._produced.append(time.monotonic())
+
+    def start(self):
+        if self._running: return
+        cfg = self.cam.camera_configuration() or {}
+        if not cfg.get(self.stream):
+            self.stream = "main"
+        stream_cfg = cfg.get(self.stream) or {}
+        self._fmt = stream_cfg.get("format", "XBGR8888")
+        self._width = (stream_cfg.get("size") or (None, None))[0]
+        self.dropped = 0
+        self._slot = None
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=1.0)
+        self._thread = None
+
+    def _loop(self):
+        import numpy as np
+        from PIL import Image
+        while self._running:
+            if self.paused():
+                time.sleep(0.01); continue
+            try:
+                with tracing.span("capture_array"):
+                    req = self.cam.capture_request()
+                    try:
+                        # общая память процесса захвата (shmcam) — читаем без копии
+                        view = getattr(req, "make_view", None)
+                        arr = view(self.stream) if view else req.make_array(self.stream)
+                        meta = req.get_metadata()
+                    finally:
+                        req.release()
+                with tracing.span("fromarray"):
+                    rgb = to_rgb(arr, self._fmt, self._width)
+                    if view:
+                        if np.may_share_memory(rgb, arr):
+                            rgb = rgb.copy()   # PIL может не копировать массив
+                        if not req.valid():
+                            self.dropped += 1; continue   # слот перезаписан, пока читали
+                    img = Image.fromarray(rgb)
+                with self._lock:
+                    self._src = (img, meta)
+                    crop, ver = self.crop, self._crop_ver
+                img = self._present(img, meta, crop)
+            except Exception as e:
+                if self._running: print("Preview pipeline error:", e)
+                time.sleep(0.05); continue
+            self._put(img, meta, ver)
+
+    def _analyze(self, img, meta):
+        """Резкость для HUD и маска peaking на уменьшенном кадре. Тяжёлая часть
+        выполняется раз в _hud_every кадров; маска между ними переиспользуется."""
+        import numpy as np
+        from PIL import Image
+        import imaging
+        self._n += 1
+        if self._n % self._hud_every == 0 or (self.peaking and self._mask is None):
+            t0 = time.perf_counter()
+            arr = np.asarray(img)
+            g, _ = imaging.roi(arr[..., 1], frac=0.5, step=1)
+            self.sharpness = imaging.laplacian_var(g)
+            self._mask = None
+            if self.peaking:
+                # маска редкая: храним координаты её точек и красим их блоками step x step
+                step = 2
+                ys, xs = np.nonzero(imaging.focus_peaking(arr, step=step))
+                self._mask = (img.size, ys * step, xs * step, step)
+            cost = time.perf_counter() - t0
+            self._hud_ms.append(cost * 1000.0)
+            period = (meta.get("FrameDuration") or 33333) / 1e6
+            self._hud_every = max(1, int(cost / (HUD_SHARE * period)) + 1)
+        if not self.peaking or self._mask is None or self._mask[0] != img.size:
+            return img
+        _, ys, xs, step = self._mask
+        out = np.array(img)
+        for dy in range(step):
+            for dx in range(step):
+                out[ys + dy, xs + dx] = PEAKING_COLOR
+        return Image.fromarray(out)
+
+    def take(self):
+        """Забрать самый свежий кадр (PIL.Image) или None, если нового нет."""
+        with self._lock:
+            item, self._slot = self._slot, None
+        if item is None:
+            return None
+        self.shown_metadata = item[1]
+        self._shown.append(time.monotonic())
+        return item[0]
+
+    @staticmethod
+    def _rate(stamps, window=1.0):
+        now = time.monotonic()
+        n = sum(1 for t in stamps if now - t <= window)
+        return n / window
+
+    def stats(self):
+        """fps потока камеры, fps показа, число отброшенных кадров и цена
+        анализа HUD/peaking на кадр (мс) с текущим прореживанием."""
+        hud = sorted(self._hud_ms)
+        return {"fps": self._rate(self._produced), "shown_fps": self._rate(self._shown),
+                "dropped": self.dropped, "soft_zoomed": self.soft_zoomed,
+                "hud_ms": hud[len(hud) // 2] if hud else 0.0, "hud_every": self._hud_every}
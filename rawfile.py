@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Сырые снимки: массив потока как есть в .npy, проявка — потом.
+
+В окне съёмки массив потока (main, полный размер, формат потока без
+конвертации) копируется один раз — прямо в отображённый в память .npy
+(numpy.lib.format.open_memmap): ни JPEG, ни RGB-копии, ни передачи в
+процесс пула. Рядом — <имя>.json: формат и ширина потока (для to_rgb) и
+метаданные кадра.
+
+develop() превращает сырой файл в JPEG/PNG/TIFF; пакетно и параллельно по
+ядрам — develop.py.
+"""
+
+import json
+import os
+import time
+
+FORMATS = {"jpg": "JPEG", "png": "PNG", "tiff": "TIFF"}
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def developed_path(path, ext="jpg"):
+    return os.path.splitext(path)[0] + "." + ext
+
+
+def save_raw(arr, path, fmt, width=None, metadata=None, stream="main"):
+    """Массив потока -> path (.npy через memmap) и sidecar JSON. Файл .npy
+    появляется целиком (пишется в .part). Возвращает время записи, с."""
+    import numpy as np
+    t0 = time.perf_counter()
+    info = {"format": fmt, "width": width, "stream": stream, "shape": list(arr.shape),
+            "dtype": str(arr.dtype), "metadata": metadata or {}}
+    with open(sidecar_path(path) + ".part", "w") as f:
+        json.dump(info, f, indent=1, default=str)
+    os.replace(sidecar_path(path) + ".part", sidecar_path(path))
+    tmp = path + ".part"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=arr.dtype, shape=arr.shape)
+    out[...] = arr
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    return time.perf_counter() - t0
+
+
+def load_raw(path):
+    """(массив только для чтения, отображённый из файла; sidecar dict)."""
+    import numpy as np
+    try:
+        with open(sidecar_path(path)) as f:
+            info = json.load(f)
+    except FileNotFoundError:
+        info = {}
+    return np.load(path, mmap_mode="r"), info
+
+
+def to_image(path, fit=None):
+    """PIL.Image сырого файла. fit=(w, h) — прореженный не мельче этого
+    размера: с диска читаются только нужные строки (для миниатюр)."""
+    import numpy as np
+    from PIL import Image
+    from preview import to_rgb
+    arr, info = load_raw(path)
+    fmt, width = info.get("format", "BGR888"), info.get("width")
+    if fit and arr.ndim == 3:   # YUV420 (плоскости друг под другом) не прореживаем
+        step = max(1, min(arr.shape[0] // fit[1], arr.shape[1] // fit[0]))
+        arr, width = arr[::step, ::step], None
+    return Image.fromarray(np.ascontiguousarray(to_rgb(arr, fmt, width)))
+
+
+def develop(path, ext="jpg", quality=95, force=False):
+    """Проявить сырой файл в <имя>.<ext> (jpg, png, tiff). Уже проявленный
+    пропускается (force — переписать). Возвращает (путь, секунды)."""
+    out = developed_path(path, ext)
+    if not force and os.path.exists(out):
+        return out, 0.0
+    t0 = time.perf_counter()
+    img = to_image(path)
+    kind = FORMATS[ext]
+    tmp = out + ".part"
+    if kind == "JPEG":
+        img.save(tmp, kind, quality=quality)
+    elif kind == "TIFF":
+        img.save(tmp, kind, compression="tiff_deflate")
+    else:
+        img.save(tmp, kind)
+    os.replace(tmp, out)
+    return out, time.perf_counter() - t0
+
+
+def pending(root, ext="jpg", everything=False):
+    """Сырые файлы под root, ещё не проявленные в ext (everything — все),
+    старые первыми."""
+    found = []
+    for d, dirs, files in os.walk(root):
+        dirs[:] = [x for x in dirs if not x.startswith(".")]   # .thumbs
+        for name in files:
+            if name.endswith(".npy"):
+                p = os.path.join(d, name)
+                if everything or not os.path.exists(developed_path(p, ext)):
+                    found.append(p)
+    return sorted(found, key=os.path.getmtime)
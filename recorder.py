@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Видео обследования: MJPEG в AVI с предзаписью (pre-roll).
+
+VideoRecorder слушает поток камеры (по умолчанию lores, как предпросмотр):
+слушатель в потоке камеры только забирает массив кадра в короткую очередь,
+JPEG кодируется в своём потоке (PIL, программно — работает и с
+симулятором), на диск пишет третий поток. Пока запись не идёт,
+закодированные кадры держатся в памяти за последние preroll секунд — по
+нажатию они первыми попадают в файл, так что ролик начинается раньше
+нажатия.
+
+Ничего из этого не ждёт предпросмотр: переполненная очередь кодирования
+или записи сбрасывает кадр и считает его (dropped_encode, dropped_write;
+в сводке ролика — только за этот ролик). Предзапись в очередь записи
+кладётся целиком: очередь на ролик — max_write_queue плюс предзапись.
+Файл пишется кусками (буфер CHUNK байт); заголовок AVI (число кадров,
+частота по фактическим меткам SensorTimestamp) дописывается при закрытии.
+Рядом — <имя>.json: метки кадров и счётчики.
+"""
+
+import io
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from collections import deque
+
+from metadata import exposure_window
+
+CHUNK = 1 << 20            # буфер записи файла, байт
+MAX_BYTES = 1 << 31        # предел файла AVI (32-битные смещения RIFF)
+
+
+class AviWriter:
+    """Минимальный AVI (RIFF) с одним потоком MJPEG: кадры пишутся сразу,
+    индекс idx1 и размеры — при close()."""
+
+    def __init__(self, path, size, fps=30.0):
+        self.path = path
+        self.size = tuple(size)
+        self.frames = 0
+        self.bytes = 0
+        self._index = []
+        self._max_frame = 0
+        self._f = open(path + ".part", "wb", buffering=CHUNK)
+        self._header(fps)
+
+    def _header(self, fps):
+        w, h = self.size
+        f = self._f
+        f.write(b"RIFF\0\0\0\0AVI ")
+        f.write(b"LIST" + struct.pack("<I", 4 + 8 + 56 + 8 + 4 + 8 + 56 + 8 + 40) + b"hdrl")
+        self._avih = f.tell() + 8
+        f.write(b"avih" + struct.pack("<I", 56))
+        f.write(struct.pack("<IIIIIIIIII16x", int(1e6 / fps), 0, 0, 0x10, 0, 0, 1, 0, w, h))
+        f.write(b"LIST" + struct.pack("<I", 4 + 8 + 56 + 8 + 40) + b"strl")
+        self._strh = f.tell() + 8
+        f.write(b"strh" + struct.pack("<I", 56))
+        f.write(b"vidsMJPG" + struct.pack("<IHHIIIIIIIIhhhh", 0, 0, 0, 0, 1000, int(fps * 1000),
+                                          0, 0, 0, 0xFFFFFFFF, 0, 0, 0, w, h))
+        f.write(b"strf" + struct.pack("<I", 40))
+        f.write(struct.pack("<IiiHH4sIiiII", 40, w, h, 1, 24, b"MJPG", w * h * 3, 0, 0, 0, 0))
+        self._movi = f.tell()
+        f.write(b"LIST\0\0\0\0movi")
+
+    def write(self, jpeg):
+        pad = len(jpeg) & 1
+        offset = self._f.tell() - (self._movi + 8)
+        self._f.write(b"00dc" + struct.pack("<I", len(jpeg)))
+        self._f.write(jpeg)
+        if pad: self._f.write(b"\0")
+        self._index.append((offset, len(jpeg)))
+        self._max_frame = max(self._max_frame, len(jpeg))
+        self.frames += 1
+        self.bytes += 8 + len(jpeg) + pad
+
+    def close(self, fps=None):
+        """Индекс, размеры и (если известна) фактическая частота; файл
+        появляется целиком."""
+        f = self._f
+        end = f.tell()
+        f.write(b"idx1" + struct.pack("<I", 16 * len(self._index)))
+        for offset, n in self._index:
+            f.write(b"00dc" + struct.pack("<III", 0x10, offset, n))
+        total = f.tell()
+        f.seek(4); f.write(struct.pack("<I", total - 8))
+        f.seek(self._movi + 4); f.write(struct.pack("<I", end - self._movi - 8))
+        f.seek(self._avih + 16); f.write(struct.pack("<I", self.frames))
+        f.seek(self._avih + 28); f.write(struct.pack("<I", self._max_frame))
+        f.seek(self._strh + 32); f.write(struct.pack("<I", self.frames))
+        f.seek(self._strh + 36); f.write(struct.pack("<I", self._max_frame))
+        if fps:
+            f.seek(self._avih); f.write(struct.pack("<I", int(1e6 / fps)))
+            f.seek(self._strh + 24); f.write(struct.pack("<I", int(fps * 1000)))
+        f.close()
+        os.replace(self.path + ".part", self.path)
+
+
+def poster(path):
+    """Первый кадр AVI (JPEG-байты) — для миниатюры; None, если кадров нет."""
+    with open(path, "rb") as f:
+        head = f.read(1 << 20)
+    i = head.find(b"00dc", head.find(b"movi"))
+    if i < 0:
+        return None
+    n = struct.unpack("<I", head[i + 4:i + 8])[0]
+    if i + 8 + n <= len(head):
+        return head[i + 8:i + 8 + n]
+    with open(path, "rb") as f:
+        f.seek(i + 8)
+        return f.read(n)
+
+
+class VideoRecorder:
+    """Предзапись и запись ролика из потока stream камеры cam.
+
+    start()/stop()    — слушать камеру и держать предзапись (preroll, с);
+    record(path)      — начать файл: сначала предзапись, дальше — живые кадры;
+    finish()          — закрыть файл, вернуть сводку (она же в <имя>.json).
+    fps — предел частоты кадров ролика (лишние кадры камеры пропускаются).
+    on_saved(path, error) — файл закрыт (из потока записи).
+    """
+
+    def __init__(self, cam, stream="lores", fps=15.0, preroll=3.0, quality=80,
+                 max_queue=4, max_write_queue=64, on_saved=None):
+        self.cam = cam
+        self.stream = stream
+        self.fps = float(fps)
+        self.preroll = float(preroll)
+        self.quality = quality
+        self.on_saved = on_saved
+        self.max_write_queue = max_write_queue
+        self.frames_in = 0
+        self.encoded = 0
+        self.dropped_encode = 0    # кодер не успевал — кадр не взят (всего; в сводке ролика — за ролик)
+        self.dropped_write = 0     # запись не успевала — кадр не попал в файл
+        self.encode_ms = deque(maxlen=60)
+        self.path = None
+        self._fmt = self._width = None
+        self._last_ts = None
+        self._preroll = deque()    # (t, jpeg)
+        self._preroll_bytes = 0
+        self._frames = queue.Queue(max_queue)
+        self._out = queue.Queue(max_write_queue)
+        self._lock = threading.Lock()
+        self._running = False
+        self._encoder = None
+        self._writer = None
+        self._writer_stats = {}
+        self._drops0 = (0, 0)
+
+    @property
+    def recording(self):
+        return self._writer is not None
+
+    # --- камера -> кодер ---
+    def start(self):
+        if self._running: return
+        cfg = (self.cam.camera_configuration() or {})
+        if not cfg.get(self.stream):
+            self.stream = "main"
+        stream_cfg = cfg.get(self.stream) or {}
+        self._fmt = stream_cfg.get("format", "XBGR8888")
+        self._width = (stream_cfg.get("size") or (None,))[0]
+        self._running = True
+        self._encoder = threading.Thread(target=self._encode_loop, daemon=True)
+        self._encoder.start()
+        self.cam.add_listener(self._on_frame)
+
+    def stop(self):
+        if self.recording:
+            self.finish()
+        if not self._running: return
+        self._running = False
+        self.cam.remove_listener(self._on_frame)
+        try: self._frames.put_nowait(None)
+        except queue.Full: pass
+        if self._encoder is not None:
+            self._encoder.join(timeout=1.0)
+        self._encoder = None
+        with self._lock:
+            self._preroll.clear()
+            self._preroll_bytes = 0
+
+    def _on_frame(self, request):
+        """Поток камеры: только взять массив (с пропуском до fps) и отдать кодеру."""
+        meta = request.get_metadata() or {}
+        win = exposure_window(meta)
+        t = win[0] if win else time.monotonic()
+        if self._last_ts is not None and t - self._last_ts < 0.9 / self.fps:
+            return
+        if not self.recording and self.preroll <= 0:
+            return   # предзаписи нет — без записи не кодируем
+        self._last_ts = t
+        self.frames_in += 1
+        try:
+            self._frames.put_nowait((t, meta.get("SensorTimestamp"), request.make_array(self.stream)))
+        except queue.Full:
+            self.dropped_encode += 1
+
+    def _encode_loop(self):
+        from PIL import Image
+        from preview import to_rgb
+        while self._running:
+            item = self._frames.get()
+            if item is None:
+                return
+            t, ts, arr = item
+            t0 = time.perf_counter()
+            try:
+                buf = io.BytesIO()
+                Image.fromarray(to_rgb(arr, self._fmt, self._width)).save(buf, "JPEG", quality=self.quality)
+            except Exception as e:
+                print("Video encode error:", e); continue
+            self.encode_ms.append((time.perf_counter() - t0) * 1000.0)
+            self.encoded += 1
+            frame = (t, ts, buf.getvalue())
+            with self._lock:
+                if self.recording:
+                    try: self._out.put_nowait(frame)
+                    except queue.Full: self.dropped_write += 1
+                    continue
+                self._preroll.append(frame)
+                self._preroll_bytes += len(frame[2])
+                while self._preroll and (self._preroll[0][0] < t - self.preroll or
+                                         self._preroll_bytes > MAX_BYTES // 64):
+                    self._preroll_bytes -= len(self._preroll.popleft()[2])
+
+    # --- запись ---
+    def record(self, path):
+        """Начать ролик в path (.avi): предзапись — первыми кадрами."""
+        with self._lock:
+            if self.recording:
+                return False
+            self.path = path
+            frames = list(self._preroll)
+            self._preroll.clear()
+            self._preroll_bytes = 0
+            # очередь — на всю предзапись плюс живые кадры: предзапись не теряется
+            self._out = queue.Queue(self.max_write_queue + len(frames))
+            for frame in frames:
+                self._out.put_nowait(frame)
+            self._writer_stats = {"path": path, "preroll_frames": len(frames), "t_press": time.monotonic()}
+            self._drops0 = (self.dropped_encode, self.dropped_write)   # счётчики — за ролик
+            self._writer = threading.Thread(target=self._write_loop, args=(path, self._out, self._drops0),
+                                            daemon=True)
+            self._writer.start()
+        return True
+
+    def finish(self, timeout=5.0):
+        """Остановить запись, дописать очередь и закрыть файл. Сводка или None."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+            out = self._out
+        if writer is None:
+            return None
+        st = self._writer_stats
+        deadline = time.monotonic() + timeout
+        try:
+            out.put(None, timeout=timeout)
+        except queue.Full:
+            # очередь записи полна (диск не успевает) — конец очереди ставится в фоне
+            threading.Thread(target=out.put, args=(None,), daemon=True).start()
+        writer.join(max(0.0, deadline - time.monotonic()))
+        if writer.is_alive():
+            # не дописали за timeout — файл закроется в фоне (on_saved); сводка пока неполная
+            print(f"Video: запись не закончена за {timeout:.0f} с, дописывается в фоне")
+            e0, w0 = self._drops0
+            return {"path": st["path"], "frames": 0, "bytes": 0, "seconds": 0.0,
+                    "preroll_frames": st["preroll_frames"], "preroll_seconds": 0.0,
+                    "write_mb_s": float("nan"), "dropped_encode": self.dropped_encode - e0,
+                    "dropped_write": self.dropped_write - w0, "error": None, "pending": True}
+        return dict(st)
+
+    def _write_loop(self, path, out, drops0):
+        from PIL import Image
+        st = self._writer_stats
+        e0, w0 = drops0
+        stamps, write_s, avi, err = [], 0.0, None, None
+        try:
+            while True:
+                frame = out.get()
+                if frame is None:
+                    break
+                t, ts, jpeg = frame
+                if avi is None:
+                    with Image.open(io.BytesIO(jpeg)) as im:
+                        avi = AviWriter(path, im.size, self.fps)
+                if avi.bytes + len(jpeg) > MAX_BYTES:
+                    self.dropped_write += 1; continue
+                t0 = time.perf_counter()
+                avi.write(jpeg)
+                write_s += time.perf_counter() - t0
+                stamps.append((t, ts))
+            if avi is not None:
+                span = stamps[-1][0] - stamps[0][0] if len(stamps) > 1 else 0.0
+                avi.close(fps=(len(stamps) - 1) / span if span > 0 else None)
+        except Exception as e:
+            err = e
+            print("Video write error:", e)
+        st.update({
+            "path": path, "frames": len(stamps), "bytes": avi.bytes if avi else 0,
+            "seconds": stamps[-1][0] - stamps[0][0] if len(stamps) > 1 else 0.0,
+            "preroll_seconds": max(0.0, st["t_press"] - stamps[0][0]) if stamps else 0.0,
+            "write_mb_s": (avi.bytes / write_s / 1e6) if avi and write_s > 0 else float("nan"),
+            "dropped_encode": self.dropped_encode - e0, "dropped_write": self.dropped_write - w0,
+            "error": str(err) if err else None})
+        if avi is not None and err is None:
+            try:
+                with open(os.path.splitext(path)[0] + ".json", "w") as f:
+                    json.dump(dict(st, timestamps=[ts for _, ts in stamps]), f, indent=1)
+            except Exception as e:
+                print("Video sidecar error:", e)
+        if self.on_saved is not None:
+            try: self.on_saved(path, err if avi is not None else RuntimeError("нет кадров"))
+            except Exception as e: print("on_saved error:", e)
+
+    def stats(self):
+        ms = sorted(self.encode_ms)
+        with self._lock:
+            pre = len(self._preroll)
+        return {"recording": self.recording, "frames_in": self.frames_in, "encoded": self.encoded,
+                "dropped_encode": self.dropped_encode, "dropped_write": self.dropped_write,
+                "preroll_frames": pre, "write_queue": self._out.qsize() if self.recording else 0,
+                "encode_ms_p50": ms[len(ms) // 2] if ms else float("nan")}
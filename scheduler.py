@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Планировщик команд камеры: все записи управления идут через него.
+
+Зум/фокус с автоповтора клавиш не вызывают set_controls на каждое
+событие: set() только обновляет «последнюю цель» по каждому ключу, а
+поток планировщика применяет накопленное не чаще одного раза за кадр
+(одним set_controls). Съёмка берёт камеру в монопольное владение
+(exclusive): пока оно удерживается, очередь копится и применяется сразу
+после. Метрики: глубина очереди и задержка «команда -> кадр с
+результатом» по метаданным.
+
+transaction() — набор управления одной записью с ожиданием первого кадра,
+в котором он действует (по метаданным), вместо sleep «на всякий случай».
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+# ключи, применение которых видно в метаданных кадра
+TRACKED = ("LensPosition", "ScalerCrop", "ExposureTime", "AnalogueGain")
+
+
+def _matches(actual, target):
+    """Метаданные кадра совпадают с заданным значением (с допуском на округление камерой)."""
+    if isinstance(target, (tuple, list)):
+        if not isinstance(actual, (tuple, list)) or len(actual) != len(target):
+            return False
+        return all(abs(a - t) <= max(4, 0.01 * abs(t)) for a, t in zip(actual, target))
+    try:
+        return abs(float(actual) - float(target)) <= max(0.02, 0.01 * abs(float(target)))
+    except (TypeError, ValueError):
+        return actual == target
+
+
+class CameraScheduler:
+    """Единственный писатель управления камеры.
+
+    set(ctrls)       — поставить цель (не блокирует, одинаковые ключи сливаются);
+    apply_now(ctrls) — применить сразу вместе с очередью (триггеры, смена режима);
+                       wait=False — из потока ввода: съёмку не ждёт, ставит в очередь;
+    exclusive()      — монопольный доступ для съёмки/AF: внутри можно звать
+                       cam.set_controls напрямую, очередь ждёт.
+    idle — если кадров нет дольше idle секунд (камера остановлена), очередь
+    применяется без ожидания кадра.
+    """
+
+    def __init__(self, cam, idle=0.1, lag=2):
+        self.cam = cam
+        self.idle = idle
+        self.lag = lag             # задержка применения управления, кадров (libcamera — 2)
+        self.requests = 0          # вызовов set()
+        self.writes = 0            # вызовов cam.set_controls планировщиком
+        self.depth_max = 0
+        self.latency = deque(maxlen=128)   # команда -> первый кадр с результатом, с
+        self._pending = {}
+        self._stamp = {}           # ключ -> время последнего set()
+        self._queued = 0           # set() с момента последней записи
+        self._inflight = {}        # ключ -> (значение, время set(), кадр записи)
+        self._frames = 0
+        self._frame_t = 0.0
+        self._meta = {}
+        self._applied_frame = -1
+        self._cond = threading.Condition()
+        self._owner = threading.RLock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running: return
+        self._running = True
+        self.cam.add_listener(self._on_frame)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running: return
+        self._running = False
+        self.cam.remove_listener(self._on_frame)
+        with self._cond:
+            self._cond.notify_all()
+        t = self._thread
+        if t is not None and t is not threading.current_thread():
+            t.join(timeout=1.0)
+        self._thread = None
+
+    # --- команды ---
+    def set(self, ctrls):
+        """Новая цель для ключей ctrls; более ранние непримененные значения теряются."""
+        now = time.monotonic()
+        with self._cond:
+            for k, v in ctrls.items():
+                self._pending[k] = v
+                self._stamp[k] = now
+            self.requests += 1
+            self._queued += 1
+            self.depth_max = max(self.depth_max, self._queued)
+            self._cond.notify_all()
+
+    def apply_now(self, ctrls=None, wait=True):
+        """Применить очередь и ctrls немедленно (ждёт конца монопольного доступа).
+        wait=False — камерой владеет съёмка: не ждать, ctrls встают в очередь
+        (как set()) и применятся сразу после неё. True — записано сейчас."""
+        if not self._owner.acquire(blocking=wait):
+            if ctrls: self.set(ctrls)
+            return False
+        try:
+            with self._cond:
+                if ctrls:
+                    now = time.monotonic()
+                    for k, v in ctrls.items():
+                        self._pending[k] = v
+                        self._stamp[k] = now
+                    self.requests += 1
+                    self._queued += 1
+            self._write()
+            return True
+        finally:
+            self._owner.release()
+
+    def transaction(self, ctrls, timeout=1.0):
+        """Применить ctrls одной записью (вместе с очередью) и дождаться кадра,
+        в котором они действуют: не раньше чем через lag кадров после записи,
+        ключи, которые камера докладывает в метаданных, совпали с заданными,
+        а при AeEnable=0 — AeLocked (если камера его докладывает).
+        Возвращает (кадр, метаданные, секунды) или None по таймауту."""
+        t0 = time.monotonic()
+        with self._owner:
+            with self._cond:
+                queued, stamps = self._pending, self._stamp
+                self._pending, self._stamp, self._queued = {}, {}, 0
+                start = self._frames
+                self._applied_frame = start
+            pending = dict(queued, **ctrls)
+            try:
+                with tracing.span("set_controls"):
+                    self.cam.set_controls(pending)
+            except Exception:
+                with self._cond:   # очередь не теряется: более новые set() — поверх неё
+                    for k, v in queued.items():
+                        if k not in self._pending:
+                            self._pending[k], self._stamp[k] = v, stamps[k]
+                raise
+            with self._cond:
+                self.writes += 1
+                self.requests += 1
+
+                def done():
+                    # значения, совпавшие «сами» (lock_3a фиксирует текущие), не
+                    # доказывают применения: сначала — задержка управления камеры
+                    if self._frames <= start + self.lag:
+                        return False
+                    meta = self._meta
+                    if "AeEnable" in ctrls and not ctrls["AeEnable"] and meta.get("AeLocked") is False:
+                        return False
+                    return all(_matches(meta[k], ctrls[k]) for k in ctrls if k in TRACKED and k in meta)
+
+                if not self._cond.wait_for(done, timeout):
+                    return None
+                dt = time.monotonic() - t0
+                self.latency.append(dt)
+                return self._frames, self._meta, dt
+
+    @contextmanager
+    def exclusive(self):
+        """Монопольный доступ к камере (съёмка, программный AF)."""
+        with self._owner:
+            yield self.cam
+        with self._cond:
+            self._cond.notify_all()
+
+    def _write(self):
+        """Одна запись накопленного. Вызывать под self._owner."""
+        with self._cond:
+            if not self._pending:
+                return
+            ctrls, stamps = self._pending, self._stamp
+            self._pending, self._stamp, self._queued = {}, {}, 0
+            frame = self._frames
+            self._applied_frame = frame
+        try:
+            with tracing.span("set_controls"):
+                self.cam.set_controls(ctrls)
+        except Exception as e:
+            print("Control error:", e)
+            return
+        with self._cond:
+            self.writes += 1
+            for k in TRACKED:
+                if k in ctrls:
+                    self._inflight[k] = (ctrls[k], stamps[k], frame)
+
+    # --- поток ---
+    def _ready(self):
+        if not self._pending:
+            return False
+        return self._frames > self._applied_frame or time.monotonic() - self._frame_t > self.idle
+
+    def _loop(self):
+        while self._running:
+            with self._cond:
+                if not self._ready():
+                    self._cond.wait(self.idle)
+                    continue
+            # занято съёмкой — очередь подождёт
+            if not self._owner.acquire(timeout=self.idle):
+                continue
+            try:
+                self._write()
+            finally:
+                self._owner.release()
+
+    def _on_frame(self, request):
+        meta = request.get_metadata() or {}
+        now = time.monotonic()
+        with self._cond:
+            self._frames += 1
+            self._frame_t = now
+            self._meta = meta
+            for k, (v, t, frame) in list(self._inflight.items()):
+                if self._frames <= frame:
+                    continue
+                if k in meta and _matches(meta[k], v):
+                    self.latency.append(now - t)
+                    del self._inflight[k]
+                elif now - t > 2.0 or k not in meta:
+                    del self._inflight[k]   # камера не докладывает/не дошла — не считаем
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:   # latency пополняется в потоке камеры под _cond
+            lat = sorted(self.latency)
+            depth = self._queued
+        return {
+            "queue_depth": depth, "queue_depth_max": self.depth_max,
+            "requests": self.requests, "writes": self.writes,
+            "coalesced": max(0, self.requests - self.writes),
+            "control_latency_ms_p50": lat[len(lat) // 2] * 1000.0 if lat else float("nan"),
+            "control_latency_ms_p95": lat[int(len(lat) * 0.95)] * 1000.0 if lat else float("nan"),
+        }
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Индекс снимков по сеансам обследования и миниатюры для галереи.
+
+SessionStore — SQLite-файл save_dir/Fundus/index.sqlite: сеансы и снимки
+(путь, режим, LensPosition, зум, экспозиция, резкость, SensorTimestamp;
+у пары ИК + VIS — ссылки друг на друга). Миниатюры
+делаются в фоновом потоке, когда файл уже записан, в save_dir/Fundus/.thumbs;
+JPEG читается в уменьшенном режиме (draft), полный размер не декодируется.
+ThumbCache — LRU для миниатюр, которые сейчас на экране галереи.
+"""
+
+import datetime
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+THUMB_SIZE = (160, 120)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id      INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    label   TEXT
+);
+CREATE TABLE IF NOT EXISTS captures (
+    id        INTEGER PRIMARY KEY,
+    session   INTEGER REFERENCES sessions(id),
+    taken     TEXT NOT NULL,
+    path      TEXT NOT NULL,
+    mode      TEXT,
+    lens      REAL,
+    zoom      REAL,
+    exposure  INTEGER,
+    gain      REAL,
+    sharpness REAL,
+    status    INTEGER DEFAULT 0,   -- 0 пишется, 1 записан, -1 ошибка
+    thumb     TEXT,
+    pair      INTEGER,             -- id снимка пары ИК + VIS
+    frame_ts  INTEGER              -- SensorTimestamp кадра, нс
+);
+CREATE INDEX IF NOT EXISTS captures_session ON captures(session, id);
+CREATE INDEX IF NOT EXISTS captures_path ON captures(path);
+"""
+
+_COLUMNS = ("id", "session", "taken", "path", "mode", "lens", "zoom", "exposure", "gain",
+            "sharpness", "status", "thumb", "pair", "frame_ts")
+_ADDED = {"pair": "INTEGER", "frame_ts": "INTEGER"}   # столбцы, которых нет в старых базах
+
+
+class SessionStore:
+    """Индекс снимков в корне save_dir (одна база на папку сохранения).
+
+    Все методы потокобезопасны: съёмка пишет из своего потока, пул
+    кодирования отмечает записанные файлы из служебного, галерея читает из Tk.
+    """
+
+    def __init__(self, save_dir, thumb_size=THUMB_SIZE):
+        self.save_dir = save_dir
+        self.root = os.path.join(save_dir, "Fundus")
+        os.makedirs(self.root, exist_ok=True)
+        self.thumb_dir = os.path.join(self.root, ".thumbs")
+        self.thumb_size = tuple(thumb_size)
+        self.session = None
+        self.on_thumb = None           # on_thumb(path) — миниатюра готова
+        self.thumb_times = deque(maxlen=64)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, "index.sqlite"),
+                                   check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        have = {r[1] for r in self._db.execute("PRAGMA table_info(captures)")}
+        for name, kind in _ADDED.items():
+            if name not in have:
+                self._db.execute(f"ALTER TABLE captures ADD COLUMN {name} {kind}")
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._early = {}               # path -> ошибка: файл записан раньше, чем попал в индекс
+
+    def start(self):
+        """Фоновый поток миниатюр; догоняет записанные снимки без миниатюр."""
+        if self._thread is not None: return
+        self._thread = threading.Thread(target=self._thumb_loop, daemon=True)
+        self._thread.start()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT path FROM captures WHERE status = 1 AND thumb IS NULL").fetchall()
+        for (path,) in rows:
+            self._jobs.put(path)
+
+    def close(self):
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        with self._lock:
+            self._db.close()
+
+    # --- запись ---
+    def new_session(self, label=None):
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self.session = self._db.execute(
+                "INSERT INTO sessions (started, label) VALUES (?, ?)", (now, label)).lastrowid
+        return self.session
+
+    def add(self, path, mode, metadata=None, zoom=None, sharpness=None, pair=None):
+        """Записать снимок в индекс (файл может ещё кодироваться). Возвращает id.
+        pair — id снимка пары: связь пишется в обе строки."""
+        if self.session is None:
+            self.new_session()
+        meta = metadata or {}
+        now = datetime.datetime.now().isoformat(timespec="milliseconds")
+        with self._lock:
+            cid = self._db.execute(
+                "INSERT INTO captures (session, taken, path, mode, lens, zoom, exposure, gain, sharpness,"
+                " pair, frame_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.session, now, path, mode, meta.get("LensPosition"), zoom,
+                 meta.get("ExposureTime"), meta.get("AnalogueGain"), sharpness,
+                 pair, meta.get("SensorTimestamp"))).lastrowid
+            if pair is not None:
+                self._db.execute("UPDATE captures SET pair = ? WHERE id = ?", (cid, pair))
+            early = path in self._early
+            error = self._early.pop(path, None)
+        if early:
+            self.saved(path, error)
+        return cid
+
+    def saved(self, path, error=None):
+        """Файл path записан (или нет): отметить и поставить миниатюру в очередь."""
+        with self._lock:
+            n = self._db.execute("UPDATE captures SET status = ? WHERE path = ?",
+                                 (-1 if error is not None else 1, path)).rowcount
+            if not n:
+                self._early[path] = error   # add() ещё не вызван — отметим там
+                return
+        if error is None:
+            self._jobs.put(path)
+
+    # --- чтение ---
+    def count(self, session=None):
+        q, args = "SELECT COUNT(*) FROM captures WHERE status >= 0", ()
+        if session is not None:
+            q, args = q + " AND session = ?", (session,)
+        with self._lock:
+            return self._db.execute(q, args).fetchone()[0]
+
+    def page(self, offset, limit, session=None):
+        """Снимки, новые первыми: [dict] со столбцами captures."""
+        q = f"SELECT {', '.join(_COLUMNS)} FROM captures WHERE status >= 0"
+        args = ()
+        if session is not None:
+            q, args = q + " AND session = ?", (session,)
+        q += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._db.execute(q, args + (limit, offset)).fetchall()
+        return [dict(zip(_COLUMNS, r)) for r in rows]
+
+    def get(self, cid):
+        """Снимок по id (dict со столбцами captures) или None."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM captures WHERE id = ?",
+                                   (cid,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    # --- миниатюры ---
+    def thumb_path(self, path):
+        rel = os.path.relpath(path, self.root)
+        if rel.startswith(".."):
+            rel = os.path.basename(path)
+        return os.path.join(self.thumb_dir, os.path.splitext(rel)[0] + ".jpg")
+
+    def make_thumb(self, path):
+        """Миниатюра файла path. JPEG декодируется сразу уменьшенным (draft),
+        сырой .npy читается прореженным (rawfile.to_image), у видео .avi —
+        первый кадр (recorder.poster)."""
+        from PIL import Image
+        out = self.thumb_path(path)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        fit = (self.thumb_size[0] * 2, self.thumb_size[1] * 2)
+        if path.endswith(".npy"):
+            import rawfile
+            img = rawfile.to_image(path, fit)
+        else:
+            src = path
+            if path.endswith(".avi"):
+                import io
+                import recorder
+                src = io.BytesIO(recorder.poster(path))
+            with Image.open(src) as f:
+                f.draft("RGB", fit)
+                img = f.convert("RGB")
+        img.thumbnail(self.thumb_size)
+        img.save(out + ".part", "JPEG", quality=80)
+        os.replace(out + ".part", out)
+        return out
+
+    def _thumb_loop(self):
+        while True:
+            path = self._jobs.get()
+            if path is None:
+                return
+            try:
+                t0 = time.perf_counter()
+                thumb = self.make_thumb(path)
+                self.thumb_times.append(time.perf_counter() - t0)
+                with self._lock:
+                    self._db.execute("UPDATE captures SET thumb = ? WHERE path = ?", (thumb, path))
+            except Exception as e:
+                print("Thumbnail error:", path, e)
+                continue
+            if self.on_thumb is not None:
+                try: self.on_thumb(path)
+                except Exception as e: print("on_thumb error:", e)
+
+    def stats(self):
+        t = sorted(self.thumb_times)
+        return {"thumbs_pending": self._jobs.qsize(),
+                "thumb_ms_p50": t[len(t) // 2] * 1000.0 if t else float("nan")}
+
+
+class ThumbCache:
+    """LRU миниатюр: loader(path) вызывается только при промахе.
+    Для Tk loader возвращает PhotoImage — вытеснение освобождает картинку."""
+
+    def __init__(self, loader, maxsize=256):
+        self.loader = loader
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, path):
+        item = self._items.get(path)
+        if item is not None:
+            self._items.move_to_end(path)
+            self.hits += 1
+            return item
+        self.misses += 1
+        item = self.loader(path)
+        self._items[path] = item
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return item
+
+    def discard(self, path):
+        self._items.pop(path, None)
+
+    def clear(self):
+        self._items.clear()
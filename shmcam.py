@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Камера и свет в отдельном процессе захвата; кадры — через общую память.
+
+Процесс захвата (fork, FUNDUS_CAMERA=proc:sim|proc:picamera2) владеет
+камерой и светодиодами: Tk, PIL и сборщик мусора интерпретатора UI не
+держат GIL потока кадров. Каждый кадр всех настроенных потоков (main,
+lores) пишется в кольцо слотов multiprocessing.shared_memory; по трубе
+событий уходят только номер кадра, раскладка массивов в слоте и
+метаданные — массивы не копируются между процессами и не сериализуются.
+
+Слот защищён номерами кадра до и после записи (seqlock): читатель,
+отставший на целое кольцо, видит, что слот перезаписан (overruns), а не
+получает смесь двух кадров. SharedCamera в процессе UI — тот же API, что
+у остальных бэкендов: make_array() копирует массив из слота (как
+Picamera2), make_view() — без копии, с проверкой valid() после чтения.
+Команды (configure/start/stop/set_controls/свет) — по маленькой трубе
+управления с ответом. Вспышка по границам кадров (capture.frame_flash)
+уходит одной командой pulse(t_on, t_off): свет переключает сам процесс
+захвата в назначенные моменты (time.monotonic общий для процессов), а не
+две команды туда-обратно с задержкой трубы. Вспышку ведёт свой поток
+процесса захвата: команда отвечает сразу, фактические моменты приходят
+событием — труба управления на время вспышки не занята.
+
+События кадров отправляет отдельный поток: подписчик камеры только ставит
+их в очередь и не ждёт трубу. UI отстал — старые кадры выбрасываются из
+очереди, а поток чтения UI отдаёт подписчикам по порядку все кадры, ещё
+целые в кольце (перезаписанные — dropped, по номерам кадров); смена кольца
+не теряется. Кадр копируется в слот один раз: у Picamera2 — прямо из
+буфера камеры (MappedArray), без промежуточного make_array().
+"""
+
+import contextlib
+
+import multiprocessing
+import threading
+import time
+from collections import deque
+
+from camera_backend import CameraBackend
+
+SLOTS = 6          # кадров в кольце общей памяти
+EVENTS = SLOTS - 2 # событий кадров в очереди на отправку; старше — всё равно перезаписаны
+PULSE_LEAD = 0.02  # сек; запас на доставку команды pulse до включения света
+_HEADER = 16       # байт на слот в заголовке: номер кадра до и после записи
+_ALIGN = 64
+
+
+class SharedFrames:
+    """Кольцо слотов в общей памяти: заголовок (seq до/после записи на слот)
+    и slots слотов по slot_bytes. create=True — владелец (процесс захвата)."""
+
+    def __init__(self, name=None, slot_bytes=0, slots=SLOTS, create=False):
+        import numpy as np
+        from multiprocessing import shared_memory
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        size = _ALIGN * ((slots * _HEADER + _ALIGN - 1) // _ALIGN) + slots * slot_bytes
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        if not create:
+            _untrack(self.shm)   # удаляет владелец; иначе resource_tracker UI удалит сам
+        self.name = self.shm.name
+        self._head = np.ndarray((slots, 2), np.int64, self.shm.buf)
+        if create:
+            self._head[:] = -1
+        self._data = size - slots * slot_bytes
+
+    def _offset(self, seq):
+        return self._data + (seq % self.slots) * self.slot_bytes
+
+    def write(self, seq, arrays):
+        """Массивы {поток: ndarray} кадра seq в его слот. Раскладка
+        {поток: (смещение, форма, dtype)} или None — кадр больше слота."""
+        import numpy as np
+        layout, pos = {}, 0
+        for name, arr in arrays.items():
+            layout[name] = (pos, arr.shape, arr.dtype.str)
+            pos += _ALIGN * ((arr.nbytes + _ALIGN - 1) // _ALIGN)
+        if pos > self.slot_bytes:
+            return None
+        head = self._head[seq % self.slots]
+        head[0] = seq                   # запись началась
+        base = self._offset(seq)
+        for name, arr in arrays.items():
+            off, shape, dtype = layout[name]
+            np.ndarray(shape, dtype, self.shm.buf, base + off)[...] = arr
+        head[1] = seq                   # запись закончена
+        return layout
+
+    def valid(self, seq):
+        head = self._head[seq % self.slots]
+        return int(head[0]) == seq and int(head[1]) == seq
+
+    def view(self, seq, entry):
+        """Массив кадра seq прямо в слоте (без копии) или None — уже перезаписан."""
+        import numpy as np
+        if not self.valid(seq):
+            return None
+        off, shape, dtype = entry
+        return np.ndarray(shape, dtype, self.shm.buf, self._offset(seq) + off)
+
+    def close(self, unlink=False):
+        self._head = None
+        try: self.shm.close()
+        except Exception: pass   # живые представления (make_view) — освободит GC
+        if unlink:
+            try: self.shm.unlink()
+            except Exception: pass
+
+
+def _untrack(shm):
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def _mapped(stack, request, name):
+    """Массив потока без копии: у кадра Picamera2 — MappedArray (буфер
+    отпускается при выходе из stack), у остальных — make_array()."""
+    if hasattr(request, "picam2"):
+        from picamera2 import MappedArray
+        return stack.enter_context(MappedArray(request, name, write=False)).array
+    return request.make_array(name)
+
+
+def _plain(obj):
+    """Конфигурации и свойства Picamera2 -> то, что проходит через трубу."""
+    if isinstance(obj, dict):
+        return {str(k): _plain(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_plain(v) for v in obj)
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return str(obj)
+
+
+# ====== ПРОЦЕСС ЗАХВАТА ======
+def _serve(kind, cmd, evt, slots):
+    """Процесс захвата: команды по cmd, кадры — в SharedFrames, события — в evt."""
+    import camera_backend
+    from capture import _sleep_until
+    state = {"cam": None, "leds": {}, "ring": None, "seq": 0, "configs": {}, "streams": (),
+             "closing": False, "pulses": 0}
+    lock = threading.Lock()
+    events, pending = deque(), [0]   # очередь событий для UI; кадров в ней
+    ev_cond = threading.Condition()
+
+    def post(msg):
+        """Из потока камеры: не блокирует. Кадров больше EVENTS — самый старый выбрасывается."""
+        with ev_cond:
+            events.append(msg)
+            if msg[0] == "frame":
+                pending[0] += 1
+                if pending[0] > EVENTS:
+                    for i, m in enumerate(events):
+                        if m[0] == "frame":
+                            del events[i]; break
+                    pending[0] -= 1
+            ev_cond.notify()
+
+    def sender():
+        while True:
+            with ev_cond:
+                ev_cond.wait_for(lambda: events or state["closing"])
+                if not events:
+                    return
+                msg = events.popleft()
+                if msg[0] == "frame":
+                    pending[0] -= 1
+            try:
+                evt.send(msg)
+            except (OSError, ValueError):
+                return
+
+    threading.Thread(target=sender, daemon=True).start()
+
+    def on_frame(request):
+        meta = request.get_metadata() or {}
+        with contextlib.ExitStack() as mapped, lock:
+            arrays = {}
+            for name in state["streams"]:
+                try: arrays[name] = _mapped(mapped, request, name)
+                except Exception as e: print("Capture process: stream", name, e)
+            ring, seq = state["ring"], state["seq"]
+            need = sum(_ALIGN * ((a.nbytes + _ALIGN - 1) // _ALIGN) for a in arrays.values())
+            if ring is None or need > ring.slot_bytes:
+                ring = SharedFrames(slot_bytes=need, slots=slots, create=True)
+                post(("shm", ring.name, need, slots))
+                if state["ring"] is not None:
+                    state["ring"].close(unlink=True)   # UI отпустит свою копию по событию
+                state["ring"] = ring
+            layout = ring.write(seq, arrays)
+            state["seq"] = seq + 1
+        post(("frame", seq, layout, meta, time.monotonic()))
+
+    def open_(ir_gpio, vis_gpio, active_high):
+        ir, vis, _ = camera_backend.open_lights(ir_gpio, vis_gpio, active_high, kind=kind)
+        cam = camera_backend.open_camera(kind, lights=(ir, vis))
+        cam.add_listener(on_frame)
+        state.update(cam=cam, leds={"ir": ir, "vis": vis})
+        return (_plain(dict(getattr(cam, "camera_controls", {}) or {})),
+                _plain(dict(getattr(cam, "camera_properties", None) or {})))
+
+    def make_config(method, main, lores, kw):
+        cfg = getattr(state["cam"], method)(main=main, lores=lores, **kw)
+        token = len(state["configs"])
+        state["configs"][token] = cfg   # настоящий объект остаётся здесь
+        out = _plain(cfg)
+        out["_token"] = token
+        return out
+
+    def pulse(name, t_on, t_off, off=None):
+        """Свет name на [t_on, t_off] (time.monotonic), off гаснет в момент включения.
+        Ведёт свой поток — цикл команд не ждёт вспышку; ответ — номер вспышки,
+        фактические моменты — событием ("pulse", номер, t_on, t_off)."""
+        leds, token = state["leds"], state["pulses"]
+        state["pulses"] += 1
+
+        def run():
+            got = None
+            try:
+                _sleep_until(t_on)
+                if off is not None:
+                    leds[off].off()
+                leds[name].on()
+                t0 = time.monotonic()
+                _sleep_until(t_off)
+                leds[name].off()
+                got = (t0, time.monotonic())
+            except Exception as e:
+                print("Capture process: pulse", name, e)
+            post(("pulse", token, got))
+
+        threading.Thread(target=run, name="fundus-pulse", daemon=True).start()
+        return token
+
+    def configure(cfg):
+        real = state["configs"].get(cfg.get("_token"))
+        if real is None:
+            real = {k: v for k, v in cfg.items() if k != "_token"}
+        state["cam"].configure(real)
+        state["streams"] = tuple(n for n in ("main", "lores") if (real.get(n) if isinstance(real, dict) else None))
+        out = _plain(state["cam"].camera_configuration())
+        out["_token"] = cfg.get("_token")
+        return out
+
+    ops = {
+        "open": open_,
+        "config": make_config,
+        "configure": configure,
+        "start": lambda: state["cam"].start(),
+        "stop": lambda: state["cam"].stop(),
+        "set_controls": lambda ctrls: state["cam"].set_controls(ctrls),
+        "led": lambda name, on: state["leds"][name].on() if on else state["leds"][name].off(),
+        "pulse": pulse,
+    }
+    while True:
+        try:
+            op, args = cmd.recv()
+        except (EOFError, OSError):
+            op, args = "close", ()
+        if op == "close":
+            break
+        try:
+            cmd.send(("ok", ops[op](*args)))
+        except Exception as e:
+            cmd.send(("err", f"{type(e).__name__}: {e}"))
+    try:
+        for led in state["leds"].values(): led.off()
+        if state["cam"] is not None:
+            state["cam"].stop(); state["cam"].close()
+    except Exception as e:
+        print("Capture process close error:", e)
+    with ev_cond:
+        state["closing"] = True
+        ev_cond.notify_all()
+    if state["ring"] is not None:
+        state["ring"].close(unlink=True)
+    try: cmd.send(("ok", None))
+    except Exception: pass
+
+
+# ====== СТОРОНА UI ======
+class SharedLED:
+    """Светодиод процесса захвата: команда по трубе управления; is_lit — здесь.
+    pulse() — включение по расписанию в самом процессе захвата (frame_flash);
+    lead — запас времени на доставку команды."""
+
+    lead = PULSE_LEAD
+
+    def __init__(self, cam, name):
+        self.cam = cam
+        self.name = name
+        self.is_lit = False
+
+    def pulse(self, t_on, t_off, off=None):
+        """Свет на [t_on, t_off]; off (SharedLED той же камеры) гаснет при включении.
+        Возвращает фактические (t_on, t_off) процесса захвата; труба управления
+        на время вспышки свободна."""
+        token = self.cam._call("pulse", self.name, t_on, t_off, off.name if off is not None else None)
+        got = self.cam._pulse_done(token, t_off - time.monotonic() + 1.0)
+        if off is not None: off.is_lit = False
+        self.is_lit = False
+        return got
+
+    def on(self):
+        self.cam._call("led", self.name, True); self.is_lit = True
+
+    def off(self):
+        self.cam._call("led", self.name, False); self.is_lit = False
+
+
+class SharedRequest:
+    """Кадр из кольца: make_array() — копия из слота, make_view() — без копии
+    (проверять valid() после чтения). Кадр, перезаписанный раньше, чем его
+    прочли, — RuntimeError и счётчик overruns."""
+
+    def __init__(self, cam, ring, seq, layout, metadata):
+        self.cam = cam
+        self.seq = seq
+        self._ring = ring
+        self._layout = layout or {}
+        self._metadata = metadata
+
+    def get_metadata(self):
+        return dict(self._metadata)
+
+    def make_view(self, name="main"):
+        entry = self._layout.get(name)
+        if entry is None:
+            raise RuntimeError(f"Stream {name} is not configured")
+        arr = self._ring.view(self.seq, entry)
+        if arr is None:
+            self.cam.overruns += 1
+            raise RuntimeError("кадр в общей памяти уже перезаписан")
+        return arr
+
+    def valid(self):
+        ok = self._ring.valid(self.seq)
+        if not ok: self.cam.overruns += 1
+        return ok
+
+    def make_array(self, name="main"):
+        out = self.make_view(name).copy()
+        if not self.valid():
+            raise RuntimeError("кадр в общей памяти перезаписан при чтении")
+        return out
+
+    def release(self):
+        pass
+
+
+class SharedCamera(CameraBackend):
+    """Камера процесса захвата. Создавайте до потоков и Tk (процесс — fork);
+    открывается командой open() — в фоне, как остальные бэкенды.
+    latency — публикация кадра в процессе захвата -> кадр у подписчиков UI, с;
+    overruns — кадры, перезаписанные в кольце раньше, чем их прочли."""
+
+    def __init__(self, kind="picamera2", slots=SLOTS):
+        ctx = multiprocessing.get_context("fork")
+        self._cmd, child_cmd = ctx.Pipe()
+        self._evt, child_evt = ctx.Pipe(duplex=False)
+        self.proc = ctx.Process(target=_serve, args=(kind, child_cmd, child_evt, slots),
+                                name="fundus-capture", daemon=True)
+        self.proc.start()
+        child_cmd.close(); child_evt.close()   # концы процесса захвата — только у него
+        self.kind = kind
+        self.camera_controls = {}
+        self.camera_properties = {}
+        self.ir_led, self.vis_led = SharedLED(self, "ir"), SharedLED(self, "vis")
+        self.frames = 0
+        self.overruns = 0
+        self.dropped = 0           # кадры, пропущенные из-за отставания UI (по номерам кадров)
+        self.latency = deque(maxlen=256)
+        self._config = None
+        self._ring = None
+        self._last = None
+        self._seq = -1
+        self._pulses = {}          # номер вспышки -> фактические (t_on, t_off)
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._reader = None
+        self._running = False
+        self._opened = False
+
+    def _call(self, op, *args):
+        with self._lock:
+            self._cmd.send((op, args))
+            status, value = self._cmd.recv()
+        if status != "ok":
+            raise RuntimeError(f"Процесс захвата: {value}")
+        return value
+
+    def open(self, ir_gpio, vis_gpio, active_high=True):
+        """Открыть камеру и свет в процессе захвата (один раз)."""
+        if self._opened: return
+        self.camera_controls, self.camera_properties = self._call("open", ir_gpio, vis_gpio, active_high)
+        self._opened = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    # --- конфигурация ---
+    def create_preview_configuration(self, main=None, lores=None, **kw):
+        return self._call("config", "create_preview_configuration", main or {}, lores, kw)
+
+    def create_still_configuration(self, main=None, lores=None, **kw):
+        return self._call("config", "create_still_configuration", main or {}, lores, kw)
+
+    def configure(self, config):
+        self._config = self._call("configure", config)
+
+    def camera_configuration(self):
+        return self._config
+
+    def start(self):
+        self._call("start")
+        self._running = True
+
+    def stop(self):
+        self._running = False
+        self._call("stop")
+        with self._cond:
+            self._cond.notify_all()
+
+    def set_controls(self, ctrls):
+        self._call("set_controls", dict(ctrls))
+
+    def add_listener(self, fn):
+        if fn not in self._listeners: self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        try: self._listeners.remove(fn)
+        except ValueError: pass
+
+    def _pulse_done(self, token, timeout):
+        with self._cond:
+            if not self._cond.wait_for(lambda: token in self._pulses, max(0.0, timeout)):
+                raise RuntimeError("Процесс захвата: вспышка не подтверждена")
+            got = self._pulses.pop(token)
+        if got is None:
+            raise RuntimeError("Процесс захвата: ошибка вспышки")
+        return tuple(got)
+
+    # --- кадры ---
+    def _read_loop(self):
+        while True:
+            try:
+                msg = self._evt.recv()
+            except (EOFError, OSError):
+                return
+            if msg[0] == "shm":
+                old, self._ring = self._ring, SharedFrames(msg[1], msg[2], msg[3])
+                if old is not None: old.close()
+            elif msg[0] == "pulse":
+                with self._cond:
+                    self._pulses[msg[1]] = msg[2]
+                    self._cond.notify_all()
+            else:
+                self._deliver(msg)
+
+    def _deliver(self, msg):
+        """Кадр — подписчикам, если его слот ещё цел; перезаписанный
+        пропускается (dropped — по номерам кадров)."""
+        _, seq, layout, meta, t_pub = msg
+        if layout is None or self._ring is None or not self._ring.valid(seq):
+            return
+        req = SharedRequest(self, self._ring, seq, layout, meta)
+        with self._cond:
+            self.latency.append(time.monotonic() - t_pub)
+            if self._seq >= 0 and seq > self._seq + 1:
+                self.dropped += seq - self._seq - 1
+            self._seq = seq
+            self._last = req
+            self.frames += 1
+            self._cond.notify_all()
+        for fn in list(self._listeners):
+            try: fn(req)
+            except Exception as e: print("Listener error:", e)
+
+    def _next_request(self, timeout=2.0):
+        with self._cond:
+            seq = self._seq
+            if not self._cond.wait_for(lambda: self._seq > seq or not self._running, timeout):
+                raise TimeoutError("Процесс захвата: нет кадра")
+            if self._seq <= seq:
+                raise RuntimeError("Camera is not running")
+            return self._last
+
+    def capture_request(self):
+        return self._next_request()
+
+    def capture_metadata(self):
+        return self._next_request().get_metadata()
+
+    def capture_array(self, name="main"):
+        return self._next_request().make_array(name)
+
+    def capture_file(self, path, name="main"):
+        from PIL import Image
+        from preview import to_rgb
+        req = self._next_request()
+        cfg = (self._config or {}).get(name) or {}
+        arr = req.make_array(name)
+        Image.fromarray(to_rgb(arr, cfg.get("format", "BGR888"), (cfg.get("size") or (None,))[0])).save(path)
+        return req.get_metadata()
+
+    def stats(self):
+        with self._cond:   # latency пополняется потоком чтения под _cond
+            lat = sorted(self.latency)
+        return {"frames": self.frames, "overruns": self.overruns, "dropped": self.dropped,
+                "latency_ms_p50": lat[len(lat) // 2] * 1000.0 if lat else float("nan"),
+                "latency_ms_max": lat[-1] * 1000.0 if lat else float("nan")}
+
+    def close(self):
+        if not self.proc.is_alive(): return
+        try: self._call("close")
+        except Exception: pass
+        self.proc.join(timeout=3.0)
+        if self.proc.is_alive(): self.proc.terminate()
+        if self._ring is not None:
+            self._ring.close()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Стек ИК-кадров: совмещение фазовой корреляцией, отбраковка, среднее.
+
+ИК-подсветка тусклая, одиночный кадр шумный. K кадров подряд совмещаются
+с опорным (самым резким) по сдвигу из фазовой корреляции (FFT) — это
+исправляет дрейф глаза между кадрами. Кадры с другой яркостью (моргание),
+смазанные, с плохой корреляцией или слишком большим сдвигом отбрасываются
+целиком, а в оставшихся попиксельно — выбросы дальше kappa·σ от усечённого
+среднего (без min и max пикселя — одиночный выброс не сдвигает ни центр, ни
+σ). Усреднение во float32 векторно (NumPy), полосами строк — память
+ограничена.
+
+Выполняется в процессе пула записи (storage.EncodeQueue.submit_call):
+stack_and_save получает сырые массивы потока и пишет оба файла — стек и
+опорный кадр.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from imaging import _block_mean, laplacian_var
+
+KAPPA = 3.0          # порог выброса на пиксель, в σ от усечённого среднего стека
+MAX_SHIFT = 0.1      # наибольший сдвиг, доля стороны кадра
+MIN_PEAK = 0.5       # пик корреляции ниже этой доли от медианного — кадр отбрасывается
+MAX_LEVEL = 0.2      # яркость дальше этой доли от медианной — кадр отбрасывается (моргание)
+MIN_SHARP = 0.5      # резкость ниже этой доли от медианной — кадр отбрасывается (смаз)
+CORR_STEP = 2        # корреляция на уменьшенном в CORR_STEP раз зелёном канале
+ROWS = 64            # полоса строк для попиксельной отбраковки
+
+
+def _green(rgb, step=CORR_STEP):
+    return _block_mean(rgb[..., 1], step)
+
+
+def _hann(h, w):
+    return np.outer(np.hanning(h), np.hanning(w)).astype(np.float32)
+
+
+def phase_correlate(ref_f, g, win):
+    """Сдвиг (dy, dx) кадра g относительно опорного (ref_f — его rfft2 с окном)
+    и высота пика корреляции (0..1, больше — увереннее)."""
+    f = np.fft.rfft2((g - g.mean()) * win)
+    r = ref_f * np.conj(f)
+    r /= np.abs(r) + 1e-6
+    corr = np.fft.irfft2(r, s=g.shape)
+    k = int(np.argmax(corr))
+    py, px = divmod(k, corr.shape[1])
+    h, w = corr.shape
+
+    def sub(c_m, c_0, c_p):
+        den = c_m - 2.0 * c_0 + c_p
+        return 0.5 * (c_m - c_p) / den if den < 0 else 0.0
+
+    # субпиксель — вершина параболы по соседям пика (с переходом через край)
+    dy = py + sub(corr[py - 1, px], corr[py, px], corr[(py + 1) % h, px])
+    dx = px + sub(corr[py, px - 1], corr[py, px], corr[py, (px + 1) % w])
+    if dy > h / 2: dy -= h
+    if dx > w / 2: dx -= w
+    return dy, dx, float(corr[py, px])
+
+
+def noise_sigma(g):
+    """Шум канала по 4-связному лапласиану (гладкая структура глазного дна
+    почти не проходит): σ = √(π/2)·среднее |L|/√20."""
+    lap = (4.0 * g[1:-1, 1:-1] - g[:-2, 1:-1] - g[2:, 1:-1] - g[1:-1, :-2] - g[1:-1, 2:]).ravel()
+    lap /= np.sqrt(20.0)
+    return float(1.2533 * np.abs(lap - np.median(lap)).mean())
+
+
+def _clipped_mean(stack, kappa):
+    """Среднее по оси 0 без выбросов дальше kappa·σ. Центр и σ — по стеку
+    без наибольшего и наименьшего значения пикселя (только суммы и min/max —
+    быстро, в отличие от медианы по оси)."""
+    k = stack.shape[0]
+    if k < 3:
+        return stack.mean(axis=0)
+    lo, hi = stack.min(axis=0), stack.max(axis=0)
+    s1 = stack.sum(axis=0) - lo - hi
+    s2 = np.einsum("k...,k...->...", stack, stack) - lo * lo - hi * hi
+    center = s1 / (k - 2)
+    # усечение занижает σ — поправка ~1.5 для k≈8
+    sigma = 1.5 * np.sqrt(np.maximum(s2 / (k - 2) - center * center, 0.0))
+    keep = np.abs(stack - center) <= kappa * sigma + 0.5
+    n = keep.sum(axis=0)
+    out = np.where(keep, stack, 0.0).sum(axis=0)
+    return np.divide(out, n, out=center, where=n > 0)
+
+
+def _near_median(values, i, tol):
+    m = float(np.median(values))
+    return abs(values[i] - m) <= tol * abs(m)
+
+
+def stack_frames(frames, ref=None, kappa=KAPPA, max_shift=MAX_SHIFT, min_peak=MIN_PEAK):
+    """frames — [RGB uint8] одного размера. Возвращает (стек uint8, индекс
+    опорного, dict: used, rejected, shifts [(dy, dx, пик)], snr_gain, seconds)."""
+    t0 = time.perf_counter()
+    greens = [_green(f) for f in frames]
+    levels = [float(g.mean()) for g in greens]
+    sharp = [laplacian_var(g) for g in greens]
+    ok = [_near_median(levels, i, MAX_LEVEL) and sharp[i] >= MIN_SHARP * float(np.median(sharp))
+          for i in range(len(frames))]
+    if ref is None:
+        ref = max(range(len(frames)), key=lambda i: (ok[i], sharp[i]))
+    h, w = greens[ref].shape
+    win = _hann(h, w)
+    g = greens[ref]
+    ref_f = np.fft.rfft2((g - g.mean()) * win)
+
+    shifts = []
+    for i, g in enumerate(greens):
+        if i == ref:
+            shifts.append((0.0, 0.0, 1.0)); continue
+        dy, dx, peak = phase_correlate(ref_f, g, win)
+        shifts.append((dy * CORR_STEP, dx * CORR_STEP, peak))
+    peaks = sorted(p for i, (_, _, p) in enumerate(shifts) if i != ref)
+    floor = min_peak * peaks[len(peaks) // 2] if peaks else 0.0
+    H, W = frames[ref].shape[:2]
+    used = [i for i, (dy, dx, p) in enumerate(shifts)
+            if i == ref or (ok[i] and p >= floor and abs(dy) <= max_shift * H and abs(dx) <= max_shift * W)]
+
+    # общая для всех совмещённых кадров область; вне неё — опорный кадр
+    ints = {i: (int(round(shifts[i][0])), int(round(shifts[i][1]))) for i in used}
+    # (кадр i совмещён: aligned[y, x] = frames[i][y - dy, x - dx])
+    top = max(0, max(dy for dy, _ in ints.values()))
+    bottom = H + min(0, min(dy for dy, _ in ints.values()))
+    left = max(0, max(dx for _, dx in ints.values()))
+    right = W + min(0, min(dx for _, dx in ints.values()))
+
+    out = frames[ref].astype(np.float32)
+    if len(used) > 1 and bottom > top and right > left:
+        for y in range(top, bottom, ROWS):
+            y1 = min(bottom, y + ROWS)
+            band = np.stack([frames[i][y - dy:y1 - dy, left - dx:right - dx] for i, (dy, dx) in
+                             ((i, ints[i]) for i in used)]).astype(np.float32)
+            out[y:y1, left:right] = _clipped_mean(band, kappa)
+    # выигрыш по шуму — в общей области, по зелёному каналу (стек — до округления)
+    a = frames[ref][top:bottom, left:right, 1].astype(np.float32)
+    b = out[top:bottom, left:right, 1]
+    n_ref, n_stack = noise_sigma(a), noise_sigma(b)
+    info = {"used": len(used), "rejected": len(frames) - len(used), "ref": ref,
+            "shifts": [(round(float(dy), 2), round(float(dx), 2), round(float(p), 3))
+                       for dy, dx, p in shifts],
+            "noise_ref": n_ref, "noise_stack": n_stack,
+            "snr_gain": n_ref / n_stack if n_stack > 0 else float("nan"),
+            "seconds": time.perf_counter() - t0}
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8), ref, info
+
+
+def _save(rgb, path, quality):
+    from PIL import Image
+    tmp = path + ".part"
+    Image.fromarray(rgb).save(tmp, "JPEG", quality=quality)
+    os.replace(tmp, path)   # файл появляется целиком
+
+
+def ref_path(path):
+    """Путь опорного кадра стека: <имя>_ref.jpg."""
+    return os.path.splitext(path)[0] + "_ref.jpg"
+
+
+def stack_and_save(arrays, fmt, width, path, quality=92, kappa=KAPPA):
+    """Выполняется в процессе пула: сырые массивы потока -> стек в path,
+    опорный кадр в ref_path(path). Возвращает info stack_frames (+ seconds
+    всей работы, включая запись)."""
+    from preview import to_rgb
+    t0 = time.perf_counter()
+    frames = [to_rgb(a, fmt, width) for a in arrays]
+    stacked, ref, info = stack_frames(frames, kappa=kappa)
+    info["stack_seconds"] = info["seconds"]
+    _save(stacked, path, quality)
+    _save(frames[ref], ref_path(path), quality)
+    info["seconds"] = time.perf_counter() - t0
+    return info
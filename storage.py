@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Сохранение снимков вне окна вспышки.
+
+EncodeQueue — ограниченная очередь кодирования JPEG в пуле процессов:
+съёмка отдаёт сырой массив и сразу освобождается, кодирование и запись
+на диск идут параллельно. Место в очереди резервируется до вспышки
+(reserve), чтобы не светить пациенту, если сохранить снимок некуда.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import tracing
+
+POOL_NICE = 10   # процессы пула кодирования уступают поток камеры и UI
+
+
+def _encode(arr, fmt, width, path, quality):
+    """Выполняется в процессе пула: RGB -> файл. Возвращает время, с."""
+    from PIL import Image
+    from preview import to_rgb
+    t0 = time.perf_counter()
+    img = Image.fromarray(to_rgb(arr, fmt, width))
+    tmp = path + ".part"
+    fmt_name = Image.registered_extensions().get(os.path.splitext(path)[1].lower(), "JPEG")
+    if fmt_name == "JPEG":
+        img.save(tmp, fmt_name, quality=quality)
+    else:
+        img.save(tmp, fmt_name)
+    os.replace(tmp, path)   # файл появляется целиком
+    return time.perf_counter() - t0
+
+
+def _noop():
+    return None
+
+
+def _lower_priority():
+    """Процесс пула: ниже приоритетом, чем камера и съёмка (не отнимает у них процессор)."""
+    try: os.nice(POOL_NICE)
+    except Exception: pass
+
+
+class EncodeQueue:
+    """Пул процессов для кодирования снимков с ограниченной очередью.
+
+    max_pending — сколько снимков может ждать/кодироваться одновременно;
+    on_done(path, error, seconds) вызывается из служебного потока пула.
+    Пул создаётся fork'ом при start(): вызывайте до запуска камеры и Tk,
+    пока в процессе нет лишних потоков.
+    """
+
+    def __init__(self, workers=2, max_pending=4, quality=92, on_done=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.quality = quality
+        self.on_done = on_done
+        self.pending = 0
+        self.max_depth = 0
+        self.done = 0
+        self.failed = 0
+        self.rejected = 0
+        self.encode_times = deque(maxlen=64)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._cond = threading.Condition()
+        self._pool = None
+
+    def start(self):
+        if self._pool is not None: return
+        try:
+            ctx = multiprocessing.get_context("fork")
+        except ValueError:
+            ctx = None
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                         initializer=_lower_priority)
+        # с fork все процессы создаются на первой задаче — делаем это сейчас
+        self._pool.submit(_noop).result()
+
+    def reserve(self, timeout=0.0):
+        """Занять место в очереди. False — очередь полна (backpressure)."""
+        ok = self._slots.acquire(timeout=timeout) if timeout else self._slots.acquire(blocking=False)
+        if not ok:
+            with self._cond:
+                self.rejected += 1
+            return False
+        with self._cond:
+            self.pending += 1
+            self.max_depth = max(self.max_depth, self.pending)
+        return True
+
+    def cancel(self):
+        """Вернуть зарезервированное место (снимок не получился)."""
+        self._release()
+
+    def _release(self, ok=None):
+        """Освободить место; ok — снимок записан (True) или нет (False), счётчики
+        меняются под той же блокировкой, что и pending (stats() видит их вместе)."""
+        with self._cond:
+            self.pending -= 1
+            if ok is not None:
+                if ok: self.done += 1
+                else: self.failed += 1
+            self._cond.notify_all()
+        self._slots.release()
+
+    def submit(self, arr, fmt, width, path):
+        """Отдать массив на кодирование. Место должно быть занято reserve()."""
+        if self._pool is None:
+            self.start()
+        try:
+            fut = self._pool.submit(_encode, arr, fmt, width, path, self.quality)
+        except Exception:
+            self._release()
+            raise
+        fut.add_done_callback(lambda f: self._finished(f, path))
+        return fut
+
+    def submit_call(self, fn, args, path):
+        """Отдать в пул свою обработку (например, стек ИК-кадров): fn(*args)
+        выполняется в процессе пула и пишет path сам; возвращает секунды или
+        dict с ключом "seconds". Место должно быть занято reserve()."""
+        if self._pool is None:
+            self.start()
+        try:
+            fut = self._pool.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        fut.add_done_callback(lambda f: self._finished(f, path))
+        return fut
+
+    def complete(self, path, seconds=None, err=None):
+        """Снимок записан без пула, в потоке съёмки (сырой .npy, rawfile):
+        освободить зарезервированное место и сообщить on_done, как пул."""
+        self._release(err is None)
+        if self.on_done is not None:
+            try: self.on_done(path, err, seconds)
+            except Exception as e: print("on_done error:", e)
+
+    def _finished(self, fut, path):
+        err, dt = None, None
+        try:
+            dt = fut.result()
+            if isinstance(dt, dict):
+                dt = dt.get("seconds")
+            with self._cond:
+                self.encode_times.append(dt)
+            tracing.record("encode", dt)
+        except Exception as e:
+            err = e
+        self._release(err is None)
+        if self.on_done is not None:
+            try: self.on_done(path, err, dt)
+            except Exception as e: print("on_done error:", e)
+
+    def flush(self, timeout=None):
+        """Дождаться, пока всё из очереди будет записано. False — таймаут."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self, timeout=None):
+        """Дописать очередь и остановить пул."""
+        ok = self.flush(timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        return ok
+
+    def stats(self):
+        with self._cond:   # счётчики и encode_times меняет служебный поток пула
+            t = sorted(self.encode_times)
+            out = {"queue_depth": self.pending, "queue_depth_max": self.max_depth,
+                   "done": self.done, "failed": self.failed, "rejected": self.rejected}
+        return dict(out, **{
+            "encode_ms_p50": t[len(t) // 2] * 1000.0 if t else float("nan"),
+            "encode_ms_max": t[-1] * 1000.0 if t else float("nan"),
+        })
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Общее для тестов: корень репозитория в sys.path, кэш калибровок — во
+временной папке (до импорта controller), стенд на симуляторе камеры."""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="fundus-test-")
+
+import pytest
+
+import camera_backend
+from frame_ring import FrameRing
+from metadata import MetadataPump
+from scheduler import CameraScheduler
+
+SIZE = (640, 360)   # маленький кадр: симулятор на слабой машине не теряет кадры
+
+
+class Rig:
+    """SimCamera со светом, MetadataPump, CameraScheduler и FrameRing — как в контроллере."""
+
+    def __init__(self):
+        self.ir, self.vis = camera_backend.SimLED("ir"), camera_backend.SimLED("vis")
+        self.cam = camera_backend.SimCamera(sensor_size=(1152, 648), lights=(self.ir, self.vis))
+        self.cam.configure(self.cam.create_preview_configuration(main={"size": SIZE}))
+        self.pump = MetadataPump(self.cam)
+        self.sched = CameraScheduler(self.cam)
+        self.ring = FrameRing(self.cam, "main")
+
+    def start(self):
+        self.pump.start(); self.sched.start(); self.ring.start()
+        self.cam.start()
+        self.ir.on()
+        time.sleep(0.5)   # AE сходится
+
+    def locked(self, fn):
+        """fn() с зафиксированными AE/AWB, как при съёмке в контроллере."""
+        import capture
+        lock = capture.lock_3a(self.cam, True, True, self.pump, self.sched)
+        try:
+            return fn()
+        finally:
+            self.vis.off(); self.ir.on()
+            capture.restore_3a(self.cam, lock, True, self.sched)
+
+    def stop(self):
+        self.ring.stop(); self.sched.stop(); self.pump.stop()
+        self.cam.stop()
+
+
+@pytest.fixture
+def rig():
+    r = Rig()
+    r.start()
+    yield r
+    r.stop()
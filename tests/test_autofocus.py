@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Контрастный автофокус на симуляторе: проход по метаданным и золотое сечение."""
+
+from autofocus import ContrastAF
+
+
+class _Request:
+    def __init__(self, request):
+        self._request = request
+
+    def get_metadata(self):
+        md = dict(self._request.get_metadata() or {})
+        md.pop("LensPosition", None)
+        return md
+
+    def make_array(self, stream):
+        return self._request.make_array(stream)
+
+
+class _NoLensPosition:
+    """Камера, которая не сообщает положение линзы в метаданных."""
+
+    def __init__(self, cam):
+        self._cam = cam
+        self._wrapped = {}
+
+    def add_listener(self, fn):
+        self._wrapped[fn] = lambda r: fn(_Request(r))
+        self._cam.add_listener(self._wrapped[fn])
+
+    def remove_listener(self, fn):
+        self._cam.remove_listener(self._wrapped.pop(fn))
+
+    def __getattr__(self, name):
+        return getattr(self._cam, name)
+
+
+def test_sweep_finds_the_best_focus(rig):
+    res = ContrastAF(rig.cam, budget=2.0).run()
+    assert res["mode"] == "sweep" and res["converged"]
+    assert abs(res["position"] - rig.cam.best_focus) < 0.3
+    assert all(0.0 <= p <= 10.0 for p, _ in res["trace"])
+
+
+def test_golden_search_without_lens_position(rig):
+    res = ContrastAF(_NoLensPosition(rig.cam), budget=4.0, settle=2).run()
+    assert res["mode"] == "golden"
+    assert abs(res["position"] - rig.cam.best_focus) < 0.5
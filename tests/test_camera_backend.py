@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Симулятор камеры и света: задержка управления, сетка кадров, форматы потоков."""
+
+import time
+
+import pytest
+
+import camera_backend
+from camera_backend import SimLED
+
+
+def test_sim_led_lit_fraction():
+    now = [0.0]
+    led = SimLED("vis", clock=lambda: now[0])
+    now[0] = 1.0; led.on()
+    now[0] = 3.0; led.off()
+    assert led.lit_fraction(0.0, 1.0) == 0.0
+    assert led.lit_fraction(0.0, 2.0) == pytest.approx(0.5)
+    assert led.lit_fraction(1.5, 2.5) == 1.0
+    assert led.lit_fraction(2.0, 4.0) == pytest.approx(0.5)
+
+
+def test_controls_apply_after_control_delay(rig):
+    s0 = rig.pump.latest()[1]["SensorSequence"]
+    rig.cam.set_controls({"LensPosition": 7.0})
+    got = rig.pump.wait_for(lambda m: m["LensPosition"] == 7.0, timeout=2.0)
+    assert got is not None
+    assert got[1]["SensorSequence"] >= s0 + 1 + rig.cam.control_delay
+    with pytest.raises(RuntimeError):
+        rig.cam.set_controls({"NoSuchControl": 1})
+
+
+def test_frames_stay_on_the_sensor_grid(rig):
+    metas = []
+    rig.cam.add_listener(lambda r: metas.append(r.get_metadata()))
+    time.sleep(0.3)
+    period = 1e9 / rig.cam.fps
+    for a, b in zip(metas, metas[1:]):
+        frames = b["SensorSequence"] - a["SensorSequence"]
+        assert frames >= 1   # потерянный кадр — пропуск номера, сетка та же
+        assert abs((b["SensorTimestamp"] - a["SensorTimestamp"]) - frames * period) < 1e6
+
+
+def test_stream_formats():
+    cam = camera_backend.SimCamera(sensor_size=(1152, 648))
+    cam.configure(cam.create_preview_configuration(main={"size": (320, 180)},
+                                                   lores={"size": (160, 90), "format": "YUV420"}))
+    cam.start()
+    try:
+        req = cam.capture_request()
+        assert req.make_array("main").shape == (180, 320, 3)
+        assert req.make_array("lores").shape == (135, 160)   # I420: h * 3 / 2
+        assert req.make_array("main") is req.make_array("main")   # рендер — один раз на кадр
+        with pytest.raises(RuntimeError):
+            cam.configure(cam.create_still_configuration())   # только остановленная камера
+    finally:
+        cam.stop()
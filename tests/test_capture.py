@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Съёмка на симуляторе: серия, вспышка по границам кадров, ZSL, лучший кадр серии."""
+
+import numpy as np
+
+import capture
+from metadata import exposure_window
+
+
+def test_burst_returns_all_frames(rig, tmp_path):
+    res = rig.locked(lambda: capture.flash_and_capture(rig.cam, rig.ir, rig.vis, str(tmp_path / "b.jpg"),
+                                                       burst=3, pump=rig.pump))
+    assert res["synced"]
+    assert len(res["scores"]) == 3
+
+
+def test_flash_covers_exactly_the_lit_frames(rig):
+    def flash():
+        rig.ring.arm()
+        try:
+            rig.ir.off()
+            t_on, t_off = capture.frame_flash(rig.vis, rig.pump, 2)
+            lit = capture._lit(t_on, t_off, capture.readout_time(rig.pump.latest()[1]))
+            got = rig.ring.wait_frames(lambda f: lit(f.start, f.end), 2,
+                                       stop=lambda f: f.start is not None and f.start > t_off)
+            return got, rig.ring.frames(), t_on
+        finally:
+            rig.ring.disarm()
+
+    got, frames, t_on = rig.locked(flash)
+    assert len(got) == 2
+    seqs = [f.metadata["SensorSequence"] for f in got]
+    assert seqs[1] == seqs[0] + 1
+    ro = rig.cam.readout
+    for f in frames:
+        first = rig.vis.lit_fraction(f.start, f.end)
+        last = rig.vis.lit_fraction(f.start + ro, f.end + ro)   # rolling shutter: последняя строка
+        if f in got:
+            assert first == 1.0 and last == 1.0
+        elif f.start < t_on:
+            assert first == 0.0 and last == 0.0   # кадр до вспышки её не задевает
+        else:
+            assert first < 1.0
+
+
+def test_flashed_frame_is_lit_to_the_last_row(rig, tmp_path):
+    res = rig.locked(lambda: capture.flash_and_capture(rig.cam, rig.ir, rig.vis, str(tmp_path / "v.npy"),
+                                                       pump=rig.pump))
+    arr = np.load(res["path"]).astype(np.float32)
+    band = arr.shape[0] // 8
+    top, bottom = arr[:band].mean(), arr[-band:].mean()
+    assert abs(bottom - top) < 0.1 * top
+
+
+def test_zsl_takes_the_flashed_frame_from_the_ring(rig, tmp_path):
+    path = str(tmp_path / "z.jpg")
+    res = rig.locked(lambda: capture.flash_and_capture_zsl(rig.cam, rig.ring, rig.ir, rig.vis, path,
+                                                           burst=2, pump=rig.pump))
+    assert res["synced"] and len(res["scores"]) == 2
+    start, end = exposure_window(res["metadata"])
+    assert rig.vis.lit_fraction(start, end) == 1.0
+    assert res["t_capture"] <= res["t_end"] + 0.1   # кадр взят из буфера, не после вспышки
+    assert not rig.ring.frames()   # буфер разряжен после съёмки
+
+
+def test_store_best_keeps_the_sharpest_frame(rig, tmp_path):
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(40, 200, (360, 640, 3), dtype=np.uint8)
+    flat = np.full_like(sharp, 120)
+    frames = [(flat, {"SensorSequence": 1}), (sharp, {"SensorSequence": 2}), (flat, {"SensorSequence": 3})]
+    path = str(tmp_path / "s.jpg")
+    res = capture.store_best(rig.cam, frames, path, keep_rest=True)
+    assert res["best"] == 1
+    assert res["scores"][1]["score"] > res["scores"][0]["score"]
+    assert res["exposure"]["verdict"] in ("ok", "under", "over")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["s.jpg", "s_b1.jpg", "s_b3.jpg"]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Калибровка вспышки VIS: таблица по зуму, выдержка и усиление, подбор на симуляторе."""
+
+import math
+
+import pytest
+
+import capture
+import flashcal
+
+
+def test_flash_table_interpolates_in_logs(tmp_path):
+    table = flashcal.FlashTable(str(tmp_path / "flash.json"))
+    assert table.get("mode", 2.0) is None
+    table.put("mode", 1.0, 1000, 1.0)
+    table.put("mode", 4.0, 4000, 2.0)
+    mid = table.get("mode", 2.0)
+    # exp·gain 1000 и 8000 -> на полпути в логарифме зума: sqrt(1000·8000)
+    assert mid["ExposureTime"] * mid["AnalogueGain"] == pytest.approx(math.sqrt(1000 * 8000), rel=0.01)
+    assert table.get("mode", 4.0) == {"ExposureTime": 4000, "AnalogueGain": 2.0}
+    assert table.get("mode", 8.0) == {"ExposureTime": 4000, "AnalogueGain": 2.0}   # вне — ближайшая
+    assert table.get("mode", 0.5) == {"ExposureTime": 1000, "AnalogueGain": 1.0}
+    table.save()
+    assert flashcal.FlashTable(table.path).get("mode", 4.0)["ExposureTime"] == 4000
+
+
+def test_split_prefers_exposure():
+    assert flashcal.split(5000) == (5000, 1.0)
+    exp, gain = flashcal.split(flashcal.MAX_EXPOSURE * 3)
+    assert exp == flashcal.MAX_EXPOSURE and gain == 3.0
+    assert flashcal.split(flashcal.MAX_EXPOSURE * 100)[1] == flashcal.MAX_GAIN
+
+
+def test_calibrate_brings_p99_to_target(rig, tmp_path):
+    table = flashcal.FlashTable(str(tmp_path / "flash.json"))
+    steps = []
+    try:
+        with rig.sched.exclusive():
+            res = flashcal.calibrate(rig.cam, rig.sched, rig.pump, rig.ring, rig.ir, rig.vis, table, "mode",
+                                     (1.0, 2.0), lambda z: None, (10000, 1.0),
+                                     on_step=lambda z, i, chk: steps.append((z, chk["verdict"])))
+            again = flashcal.measure(rig.cam, rig.ring, rig.pump, rig.ir, rig.vis)
+    finally:
+        capture.restore_3a(rig.cam, {"ae": True, "awb": True}, False, rig.sched)
+    assert [r["zoom"] for r in res] == [1.0, 2.0] and all(r["ok"] for r in res)
+    assert steps[0] == (1.0, "over")   # с экспозицией ИК вспышка пересвечена
+    for r in res:
+        assert abs(r["p99"] - flashcal.TARGET) <= flashcal.TOLERANCE * flashcal.TARGET
+    assert again["verdict"] == "ok"   # последняя подобранная экспозиция остаётся в силе
+    saved = flashcal.FlashTable(table.path)
+    assert saved.get("mode", 2.0) == {"ExposureTime": res[1]["ExposureTime"],
+                                      "AnalogueGain": res[1]["AnalogueGain"]}
+    assert not rig.vis.is_lit and rig.ir.is_lit
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""FrameRing: копирует только взведённым, ёмкость, keep по окну экспозиции, stop."""
+
+import time
+
+from frame_ring import FrameRing
+
+
+def test_copies_only_while_armed(rig):
+    ring = FrameRing(rig.cam, "main", max_frames=3)
+    ring.start()
+    try:
+        time.sleep(0.2)
+        assert ring.copied == 0 and not ring.frames()
+        ring.arm()
+        got = ring.wait_frames(lambda f: True, 5, timeout=2.0)
+        assert len(got) == 3   # n урезается до ёмкости
+        time.sleep(0.2)
+        frames = ring.frames()
+        assert len(frames) == ring.capacity == 3 and ring.evicted > 0
+        seqs = [f.metadata["SensorSequence"] for f in frames]
+        assert seqs == sorted(seqs)
+        assert all(f.array.shape == (360, 640, 3) for f in frames)
+        ring.disarm()
+        assert not ring.frames()   # память отдаётся сразу
+    finally:
+        ring.stop()
+
+
+def test_capacity_limited_by_bytes(rig):
+    ring = FrameRing(rig.cam, "main", max_bytes=640 * 360 * 3 * 2, max_frames=8)
+    ring.start()
+    ring.arm()
+    try:
+        ring.wait_frames(lambda f: True, 4, timeout=2.0)
+        assert ring.capacity == 2
+        assert ring.bytes_used <= ring.max_bytes
+    finally:
+        ring.disarm(); ring.stop()
+
+
+def test_keep_skips_frames_before_copy_and_stop_sees_them(rig):
+    ring = FrameRing(rig.cam, "main")
+    ring.start()
+    t = time.monotonic() + 0.2
+    ring.arm(lambda start, end: start is not None and start >= t)
+    try:
+        got = ring.wait_frames(lambda f: True, 1, timeout=2.0)
+        assert got and got[0].start >= t
+        assert ring.skipped > 0   # кадры до t не копировались
+        ring.keep(lambda start, end: False)   # больше ничего не подходит
+        t1 = time.monotonic()
+        got = ring.wait_frames(lambda f: f.start > 1e12, 1, timeout=2.0,
+                               stop=lambda f: f.start is not None and f.start > t1)
+        assert got == [] and time.monotonic() - t1 < 0.5   # stop — по пропущенному кадру, не по таймауту
+    finally:
+        ring.disarm(); ring.stop()
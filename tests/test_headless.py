@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""HTTP API безголового режима на симуляторе: /status, /capture, зум и фокус, кадры, трассировка."""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from headless import MjpegBroadcaster, make_handler
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    from controller import CameraController
+    ctl = CameraController("sim", str(tmp_path_factory.mktemp("pictures")))
+    ctl.start_preview((640, 352))
+    time.sleep(1.0)
+    stream = MjpegBroadcaster(lambda: ctl.pipeline.take() if ctl.pipeline is not None else None)
+    stream.start()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(ctl, stream))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", ctl
+    server.shutdown()
+    server.server_close()
+    stream.stop()
+    ctl.close()
+
+
+def _call(url, method="GET"):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, method=method), timeout=30) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _written(paths, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(os.path.exists(p) for p in paths):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_status(api):
+    base, _ = api
+    code, st = _call(base + "/status")
+    assert code == 200
+    assert st["preview"] is True and st["capturing"] is False
+    assert {"zoom", "focus", "encode", "controls", "stream"} <= set(st)
+
+
+def test_capture_vis_and_ir(api):
+    base, _ = api
+    paths = []
+    for mode in ("vis", "ir"):
+        code, res = _call(base + f"/capture?mode={mode}", "POST")
+        assert code == 200
+        assert res["mode"] == mode.upper()
+        assert res["exposure"]
+        paths.append(res["path"])
+    assert _written(paths)   # файлы пишет пул кодирования — после ответа
+    _, st = _call(base + "/status")
+    assert st["capturing"] is False
+
+
+def test_capture_pair_under_encode_load(api):
+    base, _ = api
+    for mode in ("vis", "ir"):   # пул ещё кодирует эти снимки, когда снимается пара
+        assert _call(base + f"/capture?mode={mode}", "POST")[0] == 200
+    code, res = _call(base + "/capture?mode=pair", "POST")
+    assert code == 200, res
+    assert res["sensor_timestamp"] > res["sensor_timestamp_ir"]
+    assert 0 <= res["gap_ms"] < 1000.0 / 30
+    assert os.path.dirname(res["path"]) == os.path.dirname(res["path_ir"])
+    assert _written([res["path"], res["path_ir"]])
+
+
+def test_zoom_and_focus(api):
+    base, _ = api
+    from controller import INITIAL_FOCUS, INITIAL_ZOOM
+    code, res = _call(base + "/zoom?value=2", "POST")
+    assert code == 200 and res["zoom"] == 2.0
+    assert _call(base + "/zoom?step=0.5", "POST")[1]["zoom"] == 2.5
+    code, res = _call(base + "/focus?value=3.5", "POST")
+    assert code == 200 and res["focus"] == 3.5
+    code, res = _call(base + "/reset", "POST")
+    assert code == 200 and res["zoom"] == INITIAL_ZOOM and res["focus"] == INITIAL_FOCUS
+
+
+def test_snapshot_and_stream(api):
+    base, _ = api
+    with urllib.request.urlopen(base + "/snapshot.jpg", timeout=10) as r:
+        assert r.headers["Content-Type"] == "image/jpeg"
+        assert r.read()[:2] == b"\xff\xd8"
+    with urllib.request.urlopen(base + "/stream.mjpg", timeout=10) as r:
+        assert r.headers["Content-Type"].startswith("multipart/x-mixed-replace")
+        head = r.read(256)
+    assert b"Content-Type: image/jpeg" in head and b"\xff\xd8" in head
+
+
+def test_trace_endpoints(api):
+    base, _ = api
+    assert _call(base + "/trace?on=1", "POST")[1] == {"enabled": True}
+    try:
+        time.sleep(0.3)
+        code, res = _call(base + "/trace")
+        assert code == 200 and "capture_array" in res["stages"]
+        code, res = _call(base + "/trace/dump", "POST")
+        assert code == 200 and os.path.exists(res["path"])
+    finally:
+        assert _call(base + "/trace?on=0", "POST")[1] == {"enabled": False}
+
+
+def test_bad_requests(api):
+    base, _ = api
+    assert _call(base + "/capture?mode=uv", "POST")[0] == 400
+    assert _call(base + "/zoom", "POST")[0] == 400
+    assert _call(base + "/nowhere")[0] == 404
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Анализ кадра: резкость, подсветка фокуса, проверка экспозиции."""
+
+import time
+
+import numpy as np
+
+import imaging
+from preview import PEAKING_COLOR, PreviewPipeline
+
+
+def _edge(h=120, w=160):
+    rgb = np.full((h, w, 3), 60, np.uint8)
+    rgb[:, w // 2:] = 200   # одна вертикальная граница
+    return rgb
+
+
+def test_focus_peaking_marks_only_the_edge():
+    mask = imaging.focus_peaking(_edge(), step=2)
+    assert mask.shape == (60, 80)
+    cols = np.nonzero(mask.any(axis=0))[0]
+    assert len(cols) and all(abs(c - 40) <= 1 for c in cols)
+    assert not imaging.focus_peaking(np.full((120, 160, 3), 90, np.uint8)).any()   # floor: шум не красим
+
+
+def test_sharpness_prefers_the_focused_frame():
+    rng = np.random.default_rng(1)
+    sharp = rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    soft = (sharp.astype(np.float32).reshape(60, 4, 80, 4, 3).mean(axis=(1, 3))
+            .repeat(4, 0).repeat(4, 1).astype(np.uint8))
+    assert imaging.score_frame(sharp, step=1)["sharpness"] > 4 * imaging.score_frame(soft, step=1)["sharpness"]
+
+
+def test_pipeline_hud_and_peaking(rig):
+    pipe = PreviewPipeline(rig.cam)
+    pipe.set_box(640, 360)
+    pipe.peaking = True
+    pipe.start()
+    try:
+        deadline = time.monotonic() + 2.0
+        img = None
+        while img is None and time.monotonic() < deadline:
+            img = pipe.take(); time.sleep(0.02)
+        time.sleep(0.3)
+        img = pipe.take() or img
+        assert pipe.sharpness is not None and pipe.sharpness > 0
+        assert (np.asarray(img) == PEAKING_COLOR).all(axis=2).any()
+        st = pipe.stats()
+        assert st["hud_ms"] > 0 and st["hud_every"] >= 1
+    finally:
+        pipe.stop()
+
+
+def test_exposure_check_verdicts():
+    ok = imaging.exposure_check(np.full((120, 160, 3), 180, np.uint8))
+    assert ok["verdict"] == "ok" and ok["p99"] == 180
+    assert abs(ok["gain"] - 200 / 180) < 1e-9
+    over = imaging.exposure_check(np.full((120, 160, 3), 255, np.uint8))
+    assert over["verdict"] == "over" and over["gain"] == 0.5 and over["clipped"] == 1.0
+    under = imaging.exposure_check(np.full((120, 160, 3), 40, np.uint8))
+    assert under["verdict"] == "under" and under["gain"] == 5.0
+
+
+def test_exposure_check_yuv_uses_luma():
+    h, w = 120, 160
+    yuv = np.full((h * 3 // 2, w), 250, np.uint8)   # хрома яркая, яркость — нет
+    yuv[:h] = 100
+    chk = imaging.exposure_check(yuv, "YUV420")
+    assert chk["p99"] == 100 and chk["verdict"] == "ok"
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Шина ввода: приоритеты, слияние повторов, дребезг, запись и воспроизведение."""
+
+import time
+
+from inputbus import CONTROL, REPEAT, SHUTTER, InputBus
+
+
+def _bus(order, dedupe=0.15):
+    bus = InputBus(dedupe=dedupe)
+    bus.bind("shutter", lambda: order.append("shutter"), SHUTTER)
+    bus.bind("af", lambda: order.append("af"), CONTROL)
+    bus.bind("zoom+", lambda: order.append("zoom+"), REPEAT, repeat=True)
+    return bus
+
+
+def test_inputbus_priority_and_coalescing():
+    order = []
+    bus = _bus(order)
+    for _ in range(5):
+        bus.emit("zoom+")
+    bus.emit("af")
+    bus.emit("shutter")
+    assert not bus.emit("nothing")
+    bus.start()
+    try:
+        assert bus.drain()
+    finally:
+        bus.stop()
+    # затвор обгоняет накопившееся, повторы зума слиты в один шаг
+    assert order == ["shutter", "af", "zoom+"]
+    st = bus.stats()
+    assert st["input_coalesced"] == 4
+    assert st["input_handled"] == 3
+
+
+def test_inputbus_dedupes_bounce():
+    bus = _bus([])
+    t = time.monotonic()
+    assert bus.emit("shutter", "gpio", t)
+    assert not bus.emit("shutter", "key", t + 0.05)   # дубль той же кнопки
+    assert bus.emit("shutter", "gpio", t + 0.5)
+    assert bus.deduped == 1
+
+
+def test_inputbus_replay(tmp_path):
+    order = []
+    bus = _bus(order, dedupe=0.0)
+    bus.start()
+    try:
+        for name in ("af", "zoom+", "shutter"):
+            bus.emit(name)
+            bus.drain()
+            time.sleep(0.02)
+        path = bus.save(str(tmp_path / "input.json"))
+    finally:
+        bus.stop()
+    events = InputBus.load(path)
+    assert [e["name"] for e in events] == ["af", "zoom+", "shutter"]
+    assert events[0]["dt"] == 0.0 and events[-1]["dt"] >= 0.04
+
+    again = []
+    bus = _bus(again, dedupe=0.0)
+    bus.start()
+    try:
+        t0 = time.monotonic()
+        assert bus.replay(events, speed=2.0) == 3
+        assert time.monotonic() - t0 >= events[-1]["dt"] / 2.0
+        assert bus.drain()
+    finally:
+        bus.stop()
+    assert again == order
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""MetadataPump: номера кадров, ожидание первого кадра после seq, окно экспозиции."""
+
+import metadata
+from metadata import MetadataPump, exposure_window
+
+
+class _Cam:
+    """Камера, кадры которой подаются из теста."""
+
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def remove_listener(self, fn):
+        self.listeners.remove(fn)
+
+    def frame(self, meta):
+        req = type("Req", (), {"get_metadata": lambda self: dict(meta)})()
+        for fn in list(self.listeners):
+            fn(req)
+
+
+def test_wait_after_returns_the_first_later_frame():
+    cam = _Cam()
+    pump = MetadataPump(cam)
+    pump.start()
+    for i in range(5):
+        cam.frame({"SensorSequence": 100 + i})
+    # читатель отстал на несколько кадров — получает их по порядку, не самый свежий
+    assert pump.wait_after(1, timeout=0.1) == (2, {"SensorSequence": 102})
+    assert pump.latest()[0] == 4
+    assert pump.wait_after(4, timeout=0.05) is None
+    got = pump.wait_for(lambda m: m["SensorSequence"] % 2 == 1, timeout=0.1, after_seq=0)
+    assert got == (1, {"SensorSequence": 101})   # подходящий кадр не пропущен
+    pump.stop()
+    assert not cam.listeners
+
+
+def test_wait_after_past_history_gives_the_oldest_kept():
+    cam = _Cam()
+    pump = MetadataPump(cam)
+    pump.start()
+    for i in range(metadata.HISTORY + 5):
+        cam.frame({"SensorSequence": i})
+    seq, meta = pump.wait_after(0, timeout=0.1)
+    assert seq == 5 and meta["SensorSequence"] == 5
+
+
+def test_exposure_window(rig):
+    _, meta = rig.pump.wait_next(1.0)
+    start, end = exposure_window(meta)
+    assert abs((end - start) - meta["ExposureTime"] / 1e6) < 1e-9
+    assert exposure_window({"SensorTimestamp": 0, "ExposureTime": 100}) is None
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Пара ИК + VIS на симуляторе: соседние кадры, вспышка только на VIS."""
+
+import json
+
+import capture
+from metadata import exposure_window
+
+
+def test_pair_frames_are_adjacent(rig, tmp_path):
+    for i in range(3):
+        res = rig.locked(lambda: capture.capture_pair(rig.cam, rig.ring, rig.ir, rig.vis,
+                                                      str(tmp_path / f"p{i}.jpg"), rig.pump))
+        ir_seq = res["metadata_ir"]["SensorSequence"]
+        vis_seq = res["metadata"]["SensorSequence"]
+        assert vis_seq == ir_seq + 1
+        # зазор — от конца экспозиции ИК до начала VIS: меньше периода кадра
+        assert 0 <= res["gap_ms"] < 1000.0 / rig.cam.fps
+        ir_win, vis_win = exposure_window(res["metadata_ir"]), exposure_window(res["metadata"])
+        assert rig.vis.lit_fraction(*vis_win) == 1.0
+        assert rig.vis.lit_fraction(*ir_win) == 0.0
+        with open(res["path_json"]) as f:
+            side = json.load(f)
+        assert (side["ir"]["seq"], side["vis"]["seq"]) == (ir_seq, vis_seq)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Предпросмотр: один слот с затиранием, размер lores, конвертация форматов."""
+
+import time
+
+import numpy as np
+
+from preview import PreviewPipeline, lores_size, to_rgb, yuv420_to_rgb
+
+
+def test_lores_size_fits_box_and_main():
+    assert lores_size(800, 440, (1280, 720)) == (782, 440)
+    assert lores_size(4000, 3000, (1280, 720)) == (1280, 720)   # не больше main
+    w, h = lores_size(10, 10, (1280, 720))
+    assert w >= 64 and h >= 64 and w % 2 == 0 and h % 2 == 0
+
+
+def test_yuv420_gray_and_formats():
+    h, w = 4, 6
+    yuv = np.full((h * 3 // 2, w), 128, np.uint8)
+    yuv[:h] = 126   # Y=126, U=V=128 -> серый (126-16)*1.164 = 128
+    rgb = yuv420_to_rgb(yuv, w)
+    assert rgb.shape == (h, w, 3)
+    assert np.all(np.abs(rgb.astype(int) - 128) <= 1)
+    px = np.zeros((1, 1, 4), np.uint8)
+    px[0, 0] = (1, 2, 3, 4)
+    assert to_rgb(px[..., :3], "BGR888")[0, 0].tolist() == [1, 2, 3]   # байты уже R,G,B
+    assert to_rgb(px[..., :3], "RGB888")[0, 0].tolist() == [3, 2, 1]
+    assert to_rgb(px, "XBGR8888")[0, 0].tolist() == [1, 2, 3]
+    assert to_rgb(px, "XRGB8888")[0, 0].tolist() == [3, 2, 1]
+
+
+def test_pipeline_keeps_only_the_newest_frame(rig):
+    pipe = PreviewPipeline(rig.cam, "lores")   # lores не настроен — берёт main
+    pipe.set_box(320, 240)
+    pipe.start()
+    try:
+        time.sleep(0.6)   # Tk «не забирает» кадры — слот затирается
+        assert pipe.stream == "main"
+        img = pipe.take()
+        assert img is not None and img.size == (320, 180)
+        assert pipe.take() is None   # слот один и уже пуст
+        assert pipe.dropped > 0
+        newest = pipe.metadata["SensorSequence"]
+        assert pipe.shown_metadata["SensorSequence"] >= newest - 1
+        assert pipe.stats()["fps"] > 0
+    finally:
+        pipe.stop()
+
+
+def test_pipeline_waits_while_paused(rig):
+    paused = [True]
+    pipe = PreviewPipeline(rig.cam, paused=lambda: paused[0])
+    pipe.start()
+    try:
+        time.sleep(0.2)
+        assert pipe.take() is None   # идёт съёмка — кадры не читаются
+        paused[0] = False
+        deadline = time.monotonic() + 2.0
+        img = None
+        while img is None and time.monotonic() < deadline:
+            img = pipe.take(); time.sleep(0.02)
+        assert img is not None
+    finally:
+        pipe.stop()
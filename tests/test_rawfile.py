@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Сырые снимки: .npy с sidecar, проявка, поиск непроявленных, develop.py."""
+
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import develop
+import rawfile
+
+
+def _raw(path, h=120, w=160):
+    arr = np.zeros((h, w, 3), np.uint8)
+    arr[..., 0] = 200   # BGR888 — байты R, G, B: красный кадр
+    rawfile.save_raw(arr, str(path), "BGR888", w, {"SensorSequence": 5})
+    return str(path)
+
+
+def test_save_and_load(tmp_path):
+    path = _raw(tmp_path / "a.npy")
+    assert not os.path.exists(path + ".part")
+    arr, info = rawfile.load_raw(path)
+    assert isinstance(arr, np.memmap) and not arr.flags.writeable
+    assert arr.shape == (120, 160, 3)
+    assert info["format"] == "BGR888" and info["metadata"] == {"SensorSequence": 5}
+    small = rawfile.to_image(path, fit=(40, 30))
+    assert small.size == (40, 30) and small.getpixel((0, 0)) == (200, 0, 0)
+
+
+def test_develop_and_pending(tmp_path):
+    os.makedirs(tmp_path / "s"); os.makedirs(tmp_path / ".thumbs")
+    a, b = _raw(tmp_path / "a.npy"), _raw(tmp_path / "s" / "b.npy")
+    _raw(tmp_path / ".thumbs" / "x.npy")   # служебные папки пропускаются
+    assert sorted(rawfile.pending(str(tmp_path))) == sorted([a, b])
+    out, dt = rawfile.develop(a, "png")
+    with Image.open(out) as img:
+        assert img.size == (160, 120) and img.getpixel((5, 5)) == (200, 0, 0)
+    assert rawfile.develop(a, "png") == (out, 0.0)   # уже проявлен
+    assert rawfile.pending(str(tmp_path), "png") == [b]
+    assert len(rawfile.pending(str(tmp_path), "png", everything=True)) == 2
+
+
+def test_develop_cli(tmp_path, capsys):
+    _raw(tmp_path / "a.npy"); _raw(tmp_path / "b.npy")
+    assert develop.main([str(tmp_path), "--workers", "1"]) == 0
+    assert os.path.exists(tmp_path / "a.jpg") and os.path.exists(tmp_path / "b.jpg")
+    assert develop.main([str(tmp_path)]) == 0
+    assert "Нечего проявлять" in capsys.readouterr().out
+    with open(tmp_path / "a.json") as f:
+        assert json.load(f)["width"] == 160
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Видео обследования: AVI MJPEG, предзапись, finish() не ждёт медленный диск."""
+
+import io
+import json
+import os
+import struct
+import threading
+import time
+
+from PIL import Image
+
+import recorder
+from recorder import AviWriter, VideoRecorder, poster
+
+
+def _jpeg(v):
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 24), (v, v, v)).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def test_avi_writer_header_and_poster(tmp_path):
+    path = str(tmp_path / "v.avi")
+    avi = AviWriter(path, (32, 24), fps=30.0)
+    frames = [_jpeg(v) for v in (10, 120, 240)]
+    for jpeg in frames:
+        avi.write(jpeg)
+    assert not os.path.exists(path)   # до close — только .part
+    avi.close(fps=12.5)
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:4] == b"RIFF" and data[8:12] == b"AVI "
+    assert struct.unpack("<I", data[4:8])[0] == len(data) - 8
+    assert struct.unpack("<I", data[avi._avih:avi._avih + 4])[0] == int(1e6 / 12.5)
+    assert struct.unpack("<I", data[avi._avih + 16:avi._avih + 20])[0] == 3
+    assert data.count(b"00dc") == 2 * 3   # кадры и записи индекса
+    assert poster(path) == frames[0]
+
+
+def test_recording_starts_with_preroll(rig, tmp_path):
+    saved = []
+    rec = VideoRecorder(rig.cam, fps=10.0, preroll=0.5, on_saved=lambda p, e: saved.append((p, e)))
+    rec.start()
+    try:
+        time.sleep(1.0)
+        path = str(tmp_path / "exam.avi")
+        assert rec.record(path)
+        time.sleep(0.5)
+        info = rec.finish()
+    finally:
+        rec.stop()
+    assert info["error"] is None and info["preroll_frames"] > 0
+    assert info["frames"] > info["preroll_frames"]
+    assert 0.2 < info["preroll_seconds"] <= 0.5 + 0.25   # + задержка кадра и кодера
+    assert saved == [(path, None)]
+    with open(str(tmp_path / "exam.json")) as f:
+        assert len(json.load(f)["timestamps"]) == info["frames"]
+
+
+def test_finish_does_not_block_on_a_full_write_queue(rig, tmp_path, monkeypatch):
+    stuck = threading.Event()
+    write = AviWriter.write
+    monkeypatch.setattr(recorder.AviWriter, "write", lambda self, jpeg: (stuck.wait(5.0), write(self, jpeg)))
+    rec = VideoRecorder(rig.cam, fps=30.0, preroll=0.0, max_write_queue=1)
+    rec.start()
+    try:
+        rec.record(str(tmp_path / "slow.avi"))
+        time.sleep(0.5)   # диск «завис» на первом кадре, очередь записи полна
+        t0 = time.monotonic()
+        info = rec.finish(timeout=0.3)
+        assert time.monotonic() - t0 < 1.0
+        assert info["pending"]
+        stuck.set()
+        assert rec.dropped_write > 0
+    finally:
+        stuck.set()
+        rec.stop()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""CameraScheduler на симуляторе: слияние set(), транзакции управления."""
+
+import threading
+import time
+
+import pytest
+
+import capture
+
+
+def test_lock_transaction_waits_for_control_delay(rig):
+    # lock_3a задаёт текущие значения — совпадают сразу, но действуют только через lag кадров
+    seq0 = rig.pump.latest()[1]["SensorSequence"]
+    state = capture.lock_3a(rig.cam, True, True, rig.pump, rig.sched)
+    meta = rig.pump.latest()[1]
+    assert state["settle_ms"] is not None
+    assert meta["AeLocked"] is True
+    assert meta["SensorSequence"] > seq0 + rig.cam.control_delay
+
+
+def test_failed_transaction_keeps_queue(rig):
+    with rig.sched.exclusive():
+        rig.sched.set({"LensPosition": 3.0})
+        with pytest.raises(RuntimeError):
+            rig.sched.transaction({"NoSuchControl": 1})
+    got = rig.pump.wait_for(lambda m: abs(m.get("LensPosition", 0) - 3.0) < 1e-6, timeout=2.0)
+    assert got is not None
+
+
+def test_apply_now_does_not_wait_for_capture(rig):
+    held, release = threading.Event(), threading.Event()
+
+    def capture():
+        with rig.sched.exclusive():
+            held.set()
+            release.wait(2.0)
+
+    t = threading.Thread(target=capture)
+    t.start()
+    held.wait(1.0)
+    t0 = time.monotonic()
+    assert rig.sched.apply_now({"LensPosition": 6.0}, wait=False) is False   # в очередь
+    assert time.monotonic() - t0 < 0.05
+    release.set()
+    t.join()
+    got = rig.pump.wait_for(lambda m: abs(m.get("LensPosition", 0) - 6.0) < 1e-6, timeout=2.0)
+    assert got is not None
+    assert rig.sched.apply_now({"LensPosition": 5.0}, wait=False) is True
+
+
+def test_scheduler_coalesces_queued_sets(rig):
+    sched = rig.sched
+    writes, requests = sched.writes, sched.requests
+    with sched.exclusive():   # съёмка держит камеру — очередь копится
+        for i in range(20):
+            sched.set({"LensPosition": 1.0 + i * 0.1})
+        time.sleep(0.2)
+        assert sched.writes == writes
+    got = rig.pump.wait_for(lambda m: abs(m.get("LensPosition", 0) - 2.9) < 1e-6, timeout=2.0)
+    assert got is not None
+    assert sched.requests - requests == 20
+    assert sched.writes - writes == 1   # двадцать set() — одна запись, последнее значение
+
+
+def test_transaction_waits_for_applied_frame(rig):
+    got = rig.sched.transaction({"LensPosition": 4.0}, timeout=2.0)
+    assert got is not None
+    _, meta, _ = got
+    assert abs(meta["LensPosition"] - 4.0) < 1e-6
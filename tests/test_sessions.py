@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Индекс сеансов: статусы записи, пары, страницы галереи, миниатюры, LRU."""
+
+import os
+import threading
+
+from PIL import Image
+
+from sessions import SessionStore, ThumbCache
+
+
+def _jpeg(path, size=(640, 480)):
+    Image.new("RGB", size, (90, 40, 20)).save(path, "JPEG")
+    return path
+
+
+def test_status_pairs_and_pages(tmp_path):
+    store = SessionStore(str(tmp_path))
+    try:
+        s = store.new_session("OD")
+        a = store.add(str(tmp_path / "ir.jpg"), "ir", {"LensPosition": 5.0, "SensorTimestamp": 7})
+        store.saved(str(tmp_path / "vis.jpg"))   # записан раньше, чем попал в индекс
+        b = store.add(str(tmp_path / "vis.jpg"), "vis", pair=a)
+        c = store.add(str(tmp_path / "bad.jpg"), "vis")
+        store.saved(str(tmp_path / "bad.jpg"), error=OSError("диск"))
+        assert store.get(a)["pair"] == b and store.get(b)["pair"] == a
+        assert store.get(a)["lens"] == 5.0 and store.get(a)["frame_ts"] == 7
+        assert store.get(b)["status"] == 1 and store.get(a)["status"] == 0
+        assert store.get(c)["status"] == -1
+        assert store.count(s) == 2   # ошибки в галерею не попадают
+        assert [r["id"] for r in store.page(0, 10, s)] == [b, a]
+        assert [r["id"] for r in store.page(1, 1)] == [a]
+    finally:
+        store.close()
+
+
+def test_thumbnails_in_background(tmp_path):
+    store = SessionStore(str(tmp_path))
+    done = threading.Event()
+    store.on_thumb = lambda path: done.set()
+    store.start()
+    try:
+        path = _jpeg(os.path.join(store.root, "shot.jpg"))
+        cid = store.add(path, "vis")
+        store.saved(path)
+        assert done.wait(5.0)
+        thumb = store.get(cid)["thumb"]
+        with Image.open(thumb) as img:
+            assert img.size[0] <= store.thumb_size[0] and img.size[1] <= store.thumb_size[1]
+        assert thumb.startswith(store.thumb_dir)
+    finally:
+        store.close()
+
+
+def test_reopened_store_catches_up_missing_thumbs(tmp_path):
+    store = SessionStore(str(tmp_path))
+    path = _jpeg(os.path.join(store.root, "old.jpg"))
+    cid = store.add(path, "ir")
+    store.saved(path)   # поток миниатюр не запущен — миниатюры нет
+    store.close()
+    store = SessionStore(str(tmp_path))
+    done = threading.Event()
+    store.on_thumb = lambda p: done.set()
+    store.start()
+    try:
+        assert done.wait(5.0)
+        assert os.path.exists(store.get(cid)["thumb"])
+    finally:
+        store.close()
+
+
+def test_thumb_cache_lru():
+    loads = []
+    cache = ThumbCache(lambda p: loads.append(p) or p.upper(), maxsize=2)
+    assert cache.get("a") == "A"
+    cache.get("b"); cache.get("a"); cache.get("c")   # вытесняется b
+    cache.get("a"); cache.get("b")
+    assert loads == ["a", "b", "c", "b"]
+    assert cache.hits == 2 and cache.misses == 4
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Процесс захвата: кольцо общей памяти (seqlock), кадры по порядку, вспышка по расписанию."""
+
+import time
+
+import numpy as np
+import pytest
+
+from shmcam import SharedCamera, SharedFrames
+
+
+def test_shared_frames_seqlock():
+    ring = SharedFrames(slot_bytes=1024, slots=3, create=True)
+    try:
+        arr = np.arange(12, dtype=np.uint8).reshape(3, 4)
+        layout = ring.write(0, {"main": arr})
+        assert np.array_equal(ring.view(0, layout["main"]), arr)
+        assert ring.write(1, {"main": np.zeros(2048, np.uint8)}) is None   # больше слота
+        for seq in range(1, 4):
+            ring.write(seq, {"main": arr + seq})
+        assert not ring.valid(0) and ring.view(0, layout["main"]) is None   # слот занят кадром 3
+        assert ring.view(3, layout["main"])[0, 0] == 3
+        ring._head[1 % 3, 0] = 4   # запись кадра 4 началась и не закончена
+        assert not ring.valid(1) and not ring.valid(4)
+    finally:
+        ring.close(unlink=True)
+
+
+@pytest.fixture(scope="module")
+def shared():
+    cam = SharedCamera("sim")
+    try:
+        cam.open(17, 27)
+        cam.configure(cam.create_preview_configuration(main={"size": (640, 360)},
+                                                       lores={"size": (320, 180), "format": "YUV420"}))
+        cam.start()
+        yield cam
+    finally:
+        try: cam.stop()
+        except Exception: pass
+        cam.close()
+
+
+def test_frames_arrive_in_order(shared):
+    seqs = []
+
+    def on_frame(request):
+        seqs.append(request.seq)
+
+    shared.add_listener(on_frame)
+    try:
+        req = shared.capture_request()
+        assert req.make_array("main").shape == (360, 640, 3)
+        assert req.make_array("lores").shape == (270, 320)
+        view = req.make_view("main")
+        assert not view.flags.owndata and req.valid()
+        time.sleep(0.5)
+    finally:
+        shared.remove_listener(on_frame)
+    assert len(seqs) > 5 and seqs == sorted(seqs)
+    st = shared.stats()
+    assert st["frames"] > 0 and st["latency_ms_p50"] < 100.0
+
+
+def test_pulse_runs_in_the_capture_process(shared):
+    shared.ir_led.on()
+    t_on = time.monotonic() + 0.1
+    t0 = time.monotonic()
+    got_on, got_off = shared.vis_led.pulse(t_on, t_on + 0.1, off=shared.ir_led)
+    assert abs(got_on - t_on) < 0.02 and abs(got_off - (t_on + 0.1)) < 0.02
+    assert time.monotonic() - t0 >= 0.2
+    assert not shared.vis_led.is_lit and not shared.ir_led.is_lit
+    shared.set_controls({"LensPosition": 3.0})   # труба управления свободна и после вспышки
+    deadline = time.monotonic() + 2.0
+    while shared.capture_metadata().get("LensPosition") != 3.0:
+        assert time.monotonic() < deadline
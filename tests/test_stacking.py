@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Стек ИК-кадров: совмещение сдвигов, отбраковка моргания, выигрыш по шуму."""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+import stacking
+
+
+def _scene(h=240, w=320, seed=0):
+    """Похоже на глазное дно: размытые пятна и тонкие тёмные «сосуды»."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    img = np.full((h, w), 80.0, np.float32)
+    for _ in range(40):
+        cy, cx, r, a = rng.uniform(0, h), rng.uniform(0, w), rng.uniform(4, 20), rng.uniform(-40, 40)
+        img += a * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * r * r))
+    for _ in range(12):
+        cy, cx, t = rng.uniform(0, h), rng.uniform(0, w), rng.uniform(0, np.pi)
+        d = np.abs((y - cy) * np.cos(t) - (x - cx) * np.sin(t))
+        img -= 40.0 * np.exp(-d * d / (2 * 1.5 ** 2))
+    return img
+
+
+def _frames(shifts, sigma=8.0, seed=1):
+    rng = np.random.default_rng(seed)
+    base = _scene()
+    out = []
+    for dy, dx in shifts:
+        g = np.roll(base, (dy, dx), axis=(0, 1)) + rng.normal(0, sigma, base.shape)
+        out.append(np.repeat(np.clip(g + 0.5, 0, 255).astype(np.uint8)[..., None], 3, axis=2))
+    return out
+
+
+SHIFTS = [(0, 0), (2, -4), (-6, 2), (4, 6), (0, -2), (-2, -6), (6, 0), (-4, 4)]
+
+
+def test_shifts_are_recovered_and_noise_drops():
+    frames = _frames(SHIFTS)
+    stacked, ref, info = stacking.stack_frames(frames)
+    assert stacked.shape == frames[0].shape and stacked.dtype == np.uint8
+    assert info["used"] == len(frames) and info["rejected"] == 0
+    ry, rx = SHIFTS[ref]
+    for (dy, dx, _), (sy, sx) in zip(info["shifts"], SHIFTS):
+        # сдвиг, который совмещает кадр с опорным
+        assert abs(dy - (ry - sy)) <= 1.0 and abs(dx - (rx - sx)) <= 1.0
+    assert info["snr_gain"] > 2.0
+
+
+def test_blink_frame_is_rejected():
+    frames = _frames(SHIFTS[:6])
+    frames[3] = (frames[3] * 0.3).astype(np.uint8)   # моргание — кадр темнее
+    _, ref, info = stacking.stack_frames(frames)
+    assert ref != 3
+    assert info["used"] == 5 and info["rejected"] == 1
+
+
+def test_stack_and_save_writes_stack_and_reference(tmp_path):
+    frames = _frames(SHIFTS[:4])
+    path = str(tmp_path / "ir.jpg")
+    info = stacking.stack_and_save([f[..., ::-1].copy() for f in frames], "RGB888", None, path)
+    assert os.path.exists(path) and os.path.exists(stacking.ref_path(path))
+    with Image.open(path) as img:
+        assert img.size == (320, 240)
+    assert info["used"] == 4 and info["seconds"] >= info["stack_seconds"]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Ленивый запуск контроллера: железо открывается в фоне, базовый кроп — из кэша."""
+
+import json
+import os
+import threading
+
+import controller
+from controller import CameraController
+
+
+def test_warm_up_opens_hardware_in_background(tmp_path):
+    ctl = CameraController("sim", str(tmp_path))
+    ready = threading.Event()
+    try:
+        assert ctl.cam is None   # конструктор железо не трогает
+        ctl.warm_up((640, 352), on_ready=ready.set)
+        assert ready.wait(10.0)
+        assert ctl.streaming and ctl.base_crop is not None
+        assert {"open_ms", "warm_up_ms"} <= set(ctl.timings)
+        ctl.start_preview((640, 352))   # прогрето под этот размер — без перенастройки
+        assert ctl.state()["startup_ms"]["open_ms"] == ctl.timings["open_ms"]
+    finally:
+        ctl.close()
+
+
+def test_base_crop_is_cached_per_sensor_mode(tmp_path):
+    ctl = CameraController("sim", str(tmp_path))
+    try:
+        ctl.wait_ready()
+        ctl._stream((640, 352))
+        key, crop = ctl._mode_key(), ctl.base_crop
+        with open(os.path.join(controller.CACHE_DIR, "base_crop.json")) as f:
+            assert json.load(f)[key] == list(crop)
+        ctl._crop_cache(key, (2, 2, 100, 50))   # следующий запуск берёт кроп из кэша
+        ctl.init_base_crop()
+        assert ctl.base_crop == (2, 2, 100, 50)
+        ctl._crop_cache(key, crop)
+    finally:
+        ctl.close()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""EncodeQueue: резерв места, отмена, backpressure, счётчики."""
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from storage import EncodeQueue
+
+
+@pytest.fixture
+def queue():
+    done = []
+    q = EncodeQueue(workers=1, max_pending=2, on_done=lambda path, err, dt: done.append((path, err)))
+    q.start()
+    q.results = done
+    yield q
+    q.close(timeout=10.0)
+
+
+def test_backpressure_and_cancel(queue):
+    assert queue.reserve() and queue.reserve()
+    assert not queue.reserve()   # очередь полна — съёмка не ждёт
+    assert queue.stats()["rejected"] == 1
+    queue.cancel()
+    assert queue.reserve()
+    queue.cancel(); queue.cancel()
+    st = queue.stats()
+    assert st["queue_depth"] == 0 and st["queue_depth_max"] == 2
+    assert st["done"] == st["failed"] == 0
+
+
+def test_encode_writes_file_and_counts(queue, tmp_path):
+    arr = np.full((48, 64, 3), 120, np.uint8)
+    path = str(tmp_path / "a.jpg")
+    assert queue.reserve()
+    queue.submit(arr, "RGB888", 64, path)
+    assert queue.reserve()
+    queue.submit(arr, "RGB888", 64, str(tmp_path / "missing" / "b.jpg"))   # папки нет — ошибка
+    assert queue.flush(10.0)
+    deadline = time.monotonic() + 5.0
+    while len(queue.results) < 2 and time.monotonic() < deadline:   # on_done — после освобождения места
+        time.sleep(0.01)
+    assert os.path.getsize(path) > 0
+    st = queue.stats()
+    assert (st["done"], st["failed"], st["queue_depth"]) == (1, 1, 0)
+    assert [p for p, err in queue.results if err is None] == [path]
+
+
+def test_complete_releases_reserved_slot(queue):
+    assert queue.reserve()
+    queue.complete("raw.npy", 0.01)
+    assert queue.stats()["queue_depth"] == 0 and queue.stats()["done"] == 1
+    assert queue.results == [("raw.npy", None)]
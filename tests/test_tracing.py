@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Трассировка стадий: выключенная ничего не пишет, процентили, кольцо, dump."""
+
+import json
+import time
+
+import pytest
+
+import tracing
+from preview import PreviewPipeline
+
+
+@pytest.fixture
+def traced():
+    tracing.reset(); tracing.enable()
+    yield
+    tracing.enable(False); tracing.reset()
+
+
+def test_disabled_records_nothing():
+    tracing.reset()
+    assert not tracing.enabled()
+    with tracing.span("resize"):
+        pass
+    tracing.record("encode", 0.01)
+    assert tracing.stats() == {}
+
+
+def test_percentiles_ring_and_dump(traced, tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "RING", 100)
+    for i in range(150):   # в кольце остаются последние 100: 50..149 мс
+        tracing.record("encode", i / 1000.0)
+    st = tracing.stats()["encode"]
+    assert st["n"] == 100 and st["last"] == pytest.approx(149.0)
+    assert st["p50"] == pytest.approx(100.0) and st["p99"] == pytest.approx(149.0)
+    with tracing.span("resize"):
+        time.sleep(0.01)
+    assert tracing.stats()["resize"]["max"] >= 10.0
+    assert tracing.lines(["resize", "nothing"])[0].startswith("resize")
+    with open(tracing.dump(str(tmp_path / "trace.json"))) as f:
+        data = json.load(f)
+    assert data["ring"] == 100 and len(data["samples"]["encode"]) == 100
+
+
+def test_preview_stages_are_traced(traced, rig):
+    pipe = PreviewPipeline(rig.cam)
+    pipe.set_box(320, 180)
+    pipe.start()
+    try:
+        time.sleep(0.5)
+    finally:
+        pipe.stop()
+    assert {"capture_array", "fromarray", "resize", "hud"} <= set(tracing.stats())
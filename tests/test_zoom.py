@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Программный зум до применения ScalerCrop и ускорение автоповтора клавиш."""
+
+import time
+
+from PIL import Image
+
+from controller import KeyRepeat
+from preview import PreviewPipeline, soft_crop
+
+
+def test_soft_crop_cuts_the_target_field():
+    img = Image.new("RGB", (400, 300), (10, 20, 30))
+    actual = (100, 100, 800, 600)
+    assert soft_crop(img, actual, actual) is img
+    assert soft_crop(img, actual, (101, 100, 800, 600)) is img   # меньше пикселя кадра
+    zoomed = soft_crop(img, actual, (300, 250, 400, 300))   # 2× по центру
+    assert zoomed.size == (200, 150)
+    wide = soft_crop(img, actual, (-300, -200, 1600, 1200))   # отдаление — края чёрные
+    assert wide.size == (800, 600)
+    assert wide.getpixel((0, 0)) == (0, 0, 0) and wide.getpixel((400, 300)) == (10, 20, 30)
+
+
+def test_set_crop_reshows_the_last_frame_at_once(rig):
+    pipe = PreviewPipeline(rig.cam)
+    pipe.set_box(640, 360)
+    pipe.hud = False
+    pipe.start()
+    try:
+        time.sleep(0.3)
+        sw, sh = rig.pump.latest()[1]["ScalerCrop"][2:]
+        pipe.take()
+        pipe.set_crop((sw // 4, sh // 4, sw // 2, sh // 2))
+        assert pipe.take() is not None   # перепоказан в потоке вызова, без ожидания кадра
+        assert pipe.soft_zoomed >= 1
+    finally:
+        pipe.stop()
+
+
+def test_key_repeat_accelerates_and_resets():
+    rep = KeyRepeat(gap=10.0, accel=2.0)
+    assert [rep.step("zoom+", 0.1, 0.8) for _ in range(5)] == [0.1, 0.2, 0.4, 0.8, 0.8]
+    assert rep.step("focus+", 0.1, 0.8) == 0.1   # другая клавиша — с базового шага
+    rep = KeyRepeat(gap=0.0, accel=2.0)
+    rep.step("zoom+", 0.1, 0.8)
+    time.sleep(0.01)
+    assert rep.step("zoom+", 0.1, 0.8) == 0.1   # пауза дольше gap
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Трассировка стадий: где уходит время от кадра до экрана и от кнопки до файла.
+
+Каждая стадия (capture_array, fromarray, resize, photoimage, metadata_wait,
+set_controls, flash, capture_file, encode, …) пишет (момент окончания по
+time.monotonic(), длительность) в свой кольцевой буфер фиксированного
+размера; stats() — скользящие p50/p95/p99 по буферу, dump() — в JSON.
+
+Выключено по умолчанию: span() тогда возвращает общий пустой объект, а
+record() сразу выходит — цена засечки на кадр ~0.1 мкс.
+
+    with tracing.span("resize"):
+        img = img.resize(...)
+    tracing.record("encode", seconds)
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+RING = 512          # засечек на стадию
+
+_enabled = False
+_rings = {}         # стадия -> deque[(t_end, мс)]
+_lock = threading.Lock()
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = bool(on)
+
+
+def enabled():
+    return _enabled
+
+
+def span(name):
+    """Контекст-засечка стадии name (ничего не делает, если трассировка выключена)."""
+    return _Span(name) if _enabled else _NO_SPAN
+
+
+def record(name, seconds):
+    """Длительность стадии name, измеренная снаружи (с)."""
+    if not _enabled or seconds is None:
+        return
+    with _lock:
+        ring = _rings.get(name)
+        if ring is None:
+            ring = _rings[name] = deque(maxlen=RING)
+        ring.append((time.monotonic(), seconds * 1000.0))
+
+
+def reset():
+    with _lock:
+        _rings.clear()
+
+
+def _pct(v, p):
+    return v[min(len(v) - 1, int(p / 100.0 * len(v)))]
+
+
+def stats():
+    """{стадия: {n, p50, p95, p99, max, last}} в мс по текущему буферу."""
+    with _lock:
+        rings = {k: [ms for _, ms in r] for k, r in _rings.items()}
+    out = {}
+    for name, ms in sorted(rings.items()):
+        if not ms:
+            continue
+        v = sorted(ms)
+        out[name] = {"n": len(v), "p50": _pct(v, 50), "p95": _pct(v, 95), "p99": _pct(v, 99),
+                     "max": v[-1], "last": ms[-1]}
+    return out
+
+
+def lines(names=None):
+    """Строки для оверлея: 'стадия  p50/p95/p99 мс'."""
+    st = stats()
+    out = []
+    for name in (names or st):
+        s = st.get(name)
+        if s is None:
+            continue
+        out.append(f"{name:14s}{s['p50']:6.1f}{s['p95']:6.1f}{s['p99']:6.1f}")
+    return out
+
+
+def dump(path):
+    """Статистика и все засечки буферов в JSON-файл path."""
+    with _lock:
+        samples = {k: list(r) for k, r in _rings.items()}
+    data = {"monotonic": time.monotonic(), "wall": time.time(), "ring": RING,
+            "stats": stats(), "samples": samples}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+    return path